@@ -0,0 +1,265 @@
+"""
+Almacenamiento de los audios y fotos de los gastos.
+Cada archivo se guarda bajo el SHA-256 de su contenido, repartido en
+subdirectorios por los primeros caracteres del hash: un mismo audio o foto se
+guarda una sola vez y ningún directorio crece sin límite. La referencia que
+retorna guardar() es lo que queda en gastos.archivo_path; un archivo se puede
+borrar cuando ningún gasto ni trabajo pendiente lo referencia.
+
+Los archivos se copian por bloques (guardar_archivo) calculando el hash en la
+misma pasada, así una grabación o foto grande nunca está entera en memoria.
+
+Hay dos implementaciones: disco local (por defecto, en uploads/) y S3 o
+cualquier servicio compatible (requiere boto3). Se elige con PASEOS_ALMACENAMIENTO.
+"""
+import hashlib
+import os
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from io import BytesIO
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from database import Database
+
+# Tamaño de los bloques al copiar archivos
+TAMANO_BLOQUE = 1024 * 1024
+
+# Un archivo guardado (o reutilizado) hace menos de esto puede ser de un borrador que
+# todavía no registró su trabajo: ni liberar ni recolectar_basura lo borran
+GRACIA_SEGUNDOS = 24 * 3600
+
+def copiar_con_hash(origen: BinaryIO, destino: BinaryIO, tamano_bloque: int = TAMANO_BLOQUE) -> str:
+    """Copia un archivo por bloques desde su posición actual y retorna el SHA-256 de lo copiado"""
+    h = hashlib.sha256()
+    for bloque in iter(lambda: origen.read(tamano_bloque), b""):
+        h.update(bloque)
+        destino.write(bloque)
+    return h.hexdigest()
+
+class Almacenamiento(ABC):
+    """Interfaz común de los almacenamientos de archivos"""
+
+    @staticmethod
+    def _nombre(digest: str, extension: str) -> str:
+        """Ruta relativa del archivo: ab/cd/abcd...ef.ext"""
+        return f"{digest[:2]}/{digest[2:4]}/{digest}.{extension.lstrip('.')}"
+
+    def guardar(self, datos: bytes, extension: str) -> str:
+        """Guarda un contenido que ya está en memoria (si no existía ya) y retorna su referencia"""
+        # BytesIO sobre bytes no copia el contenido
+        return self.guardar_archivo(BytesIO(datos), extension)
+
+    @abstractmethod
+    def guardar_archivo(self, archivo: BinaryIO, extension: str) -> str:
+        """Guarda un archivo abierto (desde su posición actual) leyéndolo por bloques y retorna su referencia"""
+
+    @abstractmethod
+    def leer(self, referencia: str) -> bytes:
+        """Retorna el contenido de un archivo"""
+
+    @abstractmethod
+    def existe(self, referencia: str) -> bool:
+        """Indica si el archivo existe"""
+
+    @abstractmethod
+    def eliminar(self, referencia: str):
+        """Borra un archivo (no falla si ya no existe)"""
+
+    @abstractmethod
+    def listar(self) -> Iterator[Tuple[str, float]]:
+        """Recorre todos los archivos guardados: (referencia, fecha de modificación en segundos)"""
+
+    @abstractmethod
+    def modificado(self, referencia: str) -> Optional[float]:
+        """Fecha de modificación de un archivo en segundos (None si no existe)"""
+
+    def _descargar(self, referencia: str, destino: BinaryIO):
+        """Escribe el contenido de un archivo en destino"""
+        destino.write(self.leer(referencia))
+
+    @contextmanager
+    def ruta_local(self, referencia: str):
+        """Entrega una ruta en disco con el contenido del archivo (para APIs que piden un archivo)"""
+        extension = os.path.splitext(referencia)[1]
+        with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as tmp:
+            self._descargar(referencia, tmp)
+        try:
+            yield tmp.name
+        finally:
+            os.unlink(tmp.name)
+
+class AlmacenamientoLocal(Almacenamiento):
+    def __init__(self, directorio: str = "uploads"):
+        self.directorio = directorio
+
+    def guardar_archivo(self, archivo: BinaryIO, extension: str) -> str:
+        # El hash se conoce solo al terminar de copiar: se escribe aparte y luego se renombra,
+        # así nadie ve nunca un archivo a medio escribir. Si el proceso muere a mitad de la
+        # copia, el temporal queda suelto y lo borra recolectar_basura.
+        os.makedirs(self.directorio, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                digest = copiar_con_hash(archivo, f)
+            referencia = f"{self.directorio}/{self._nombre(digest, extension)}"
+            if os.path.exists(referencia):
+                os.remove(tmp)
+                # Ya existía: se renueva su fecha para que recolectar_basura respete al nuevo dueño
+                os.utime(referencia)
+            else:
+                os.makedirs(os.path.dirname(referencia), exist_ok=True)
+                os.replace(tmp, referencia)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return referencia
+
+    def leer(self, referencia: str) -> bytes:
+        with open(referencia, "rb") as f:
+            return f.read()
+
+    def existe(self, referencia: str) -> bool:
+        return os.path.exists(referencia)
+
+    def eliminar(self, referencia: str):
+        if os.path.exists(referencia):
+            os.remove(referencia)
+
+    def modificado(self, referencia: str) -> Optional[float]:
+        try:
+            return os.path.getmtime(referencia)
+        except OSError:
+            return None
+
+    def listar(self) -> Iterator[Tuple[str, float]]:
+        # También recorre los archivos sueltos de versiones anteriores (uploads/<paseo>_<fecha>_...)
+        for raiz, _, archivos in os.walk(self.directorio):
+            for nombre in archivos:
+                ruta = os.path.join(raiz, nombre).replace(os.sep, "/")
+                yield ruta, os.path.getmtime(ruta)
+
+    @contextmanager
+    def ruta_local(self, referencia: str):
+        # Ya está en disco: no hace falta copiarlo
+        yield referencia
+
+class AlmacenamientoS3(Almacenamiento):
+    def __init__(self, bucket: str, prefijo: str = "uploads/", endpoint_url: str = None):
+        try:
+            import boto3
+        except ImportError as e:
+            raise ImportError("El almacenamiento S3 requiere boto3 (pip install boto3)") from e
+        self.bucket = bucket
+        self.prefijo = prefijo
+        # endpoint_url permite usar servicios compatibles con S3 (MinIO, R2, etc.)
+        self.cliente = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _clave(self, referencia: str) -> str:
+        return referencia[len(f"s3://{self.bucket}/"):]
+
+    def guardar_archivo(self, archivo: BinaryIO, extension: str) -> str:
+        # Primero a un temporal en disco para conocer el hash (la clave) sin tenerlo en memoria
+        with tempfile.TemporaryFile() as tmp:
+            digest = copiar_con_hash(archivo, tmp)
+            clave = f"{self.prefijo}{self._nombre(digest, extension)}"
+            referencia = f"s3://{self.bucket}/{clave}"
+            if self.existe(referencia):
+                # Copiarlo sobre sí mismo renueva LastModified (la fecha que ve recolectar_basura)
+                self.cliente.copy_object(Bucket=self.bucket, Key=clave, MetadataDirective="REPLACE",
+                                         CopySource={"Bucket": self.bucket, "Key": clave})
+            else:
+                tmp.seek(0)
+                # upload_fileobj sube por partes
+                self.cliente.upload_fileobj(tmp, self.bucket, clave)
+        return referencia
+
+    def leer(self, referencia: str) -> bytes:
+        return self.cliente.get_object(Bucket=self.bucket, Key=self._clave(referencia))["Body"].read()
+
+    def existe(self, referencia: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self.cliente.head_object(Bucket=self.bucket, Key=self._clave(referencia))
+            return True
+        except ClientError:
+            return False
+
+    def modificado(self, referencia: str) -> Optional[float]:
+        from botocore.exceptions import ClientError
+        try:
+            return self.cliente.head_object(Bucket=self.bucket, Key=self._clave(referencia))["LastModified"].timestamp()
+        except ClientError:
+            return None
+
+    def _descargar(self, referencia: str, destino: BinaryIO):
+        self.cliente.download_fileobj(self.bucket, self._clave(referencia), destino)
+
+    def eliminar(self, referencia: str):
+        self.cliente.delete_object(Bucket=self.bucket, Key=self._clave(referencia))
+
+    def listar(self) -> Iterator[Tuple[str, float]]:
+        paginas = self.cliente.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefijo)
+        for pagina in paginas:
+            for objeto in pagina.get("Contents", []):
+                yield f"s3://{self.bucket}/{objeto['Key']}", objeto["LastModified"].timestamp()
+
+def crear_almacenamiento() -> Almacenamiento:
+    """Crea el almacenamiento configurado por variables de entorno"""
+    if os.getenv("PASEOS_ALMACENAMIENTO", "local") == "s3":
+        return AlmacenamientoS3(
+            os.environ["PASEOS_S3_BUCKET"],
+            os.getenv("PASEOS_S3_PREFIJO", "uploads/"),
+            os.getenv("PASEOS_S3_ENDPOINT")
+        )
+    return AlmacenamientoLocal(os.getenv("PASEOS_UPLOADS_DIR", "uploads"))
+
+def liberar(db: Database, almacenamiento: Almacenamiento, referencia: str) -> bool:
+    """
+    Borra un archivo si ya nadie lo referencia; retorna si se borró. Si se guardó o
+    reutilizó hace poco se deja: guardar_archivo pudo haberlo entregado a un borrador
+    que aún no registra su trabajo, y recolectar_basura lo borrará después si sobra.
+    """
+    if not referencia or db.contar_referencias_archivo(referencia) > 0:
+        return False
+    modificado = almacenamiento.modificado(referencia)
+    if modificado is None or modificado > time.time() - GRACIA_SEGUNDOS:
+        return False
+    almacenamiento.eliminar(referencia)
+    return True
+
+def recolectar_basura(db: Database, almacenamiento: Almacenamiento, gracia_segundos: float = GRACIA_SEGUNDOS,
+                      simular: bool = False) -> List[str]:
+    """
+    Borra los archivos que no referencia ningún gasto ni trabajo pendiente.
+    Los más nuevos que gracia_segundos se respetan: pueden ser de un borrador que
+    todavía no se ha guardado. Retorna las referencias borradas (o que se borrarían).
+    """
+    referenciados = db.get_archivos_referenciados()
+    limite = time.time() - gracia_segundos
+    borrados = []
+    for referencia, modificado in almacenamiento.listar():
+        if referencia in referenciados or modificado > limite:
+            continue
+        if not simular:
+            almacenamiento.eliminar(referencia)
+        borrados.append(referencia)
+    return borrados
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Mantenimiento de los archivos de gastos")
+    parser.add_argument("comando", choices=["recolectar-basura"])
+    parser.add_argument("--db", default="paseos.db", help="Ruta de la base de datos")
+    parser.add_argument("--gracia-horas", type=float, default=GRACIA_SEGUNDOS / 3600,
+                        help="No borrar archivos más nuevos que esto")
+    parser.add_argument("--simular", action="store_true", help="Solo listar lo que se borraría")
+    args = parser.parse_args()
+
+    borrados = recolectar_basura(Database(args.db), crear_almacenamiento(), args.gracia_horas * 3600, args.simular)
+    for referencia in borrados:
+        print(referencia)
+    print(f"{len(borrados)} archivo(s) {'por borrar' if args.simular else 'borrado(s)'}")
@@ -1,12 +1,16 @@
 import streamlit as st
 import os
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from database import Database
-from openai_helper import transcribir_audio, transcribir_y_extraer, analizar_foto_factura, generar_analisis_inteligente
-import base64
-import pandas as pd
-from io import BytesIO
-import tempfile
+from liquidacion import MODO_PARES, MODO_SIMPLIFICADO
+from openai_helper import generar_analisis_inteligente_stream, MODELO_ANALISIS, VERSION_PROMPT_ANALISIS
+from cache_respuestas import clave_cache
+from trabajos import (ColaTrabajos, EXTENSIONES, TIPO_AUDIO, TIPO_FOTO, ESTADO_LISTO, ESTADO_ERROR,
+                      ESTADO_USADO, ESTADO_GUARDADO, ESTADOS_ACTIVOS, ESTADOS_VISIBLES)
+from preprocesamiento import preparar_audio
+from almacenamiento import TAMANO_BLOQUE, crear_almacenamiento, liberar
+from exportacion import FORMATOS, exportar_paseo, formatos_disponibles, nombre_descarga
+import hashlib
 import json
 
 # Configuración de página
@@ -412,6 +416,15 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Cantidad de gastos por página en la lista de gastos
+GASTOS_POR_PAGINA = 20
+
+# Cada cuántos segundos se consulta el estado de los audios y fotos en proceso
+INTERVALO_TRABAJOS = 2
+
+# Edad máxima del análisis de IA guardado; después se regenera aunque el paseo no haya cambiado
+ANALISIS_MAX_EDAD_HORAS = 24
+
 # Inicializar base de datos
 @st.cache_resource
 def get_database():
@@ -419,6 +432,19 @@ def get_database():
 
 db = get_database()
 
+# Cola compartida por todas las sesiones para procesar audios y fotos en segundo plano
+@st.cache_resource
+def get_cola_trabajos():
+    return ColaTrabajos(get_database(), get_almacenamiento())
+
+# Audios y fotos de los gastos (disco local o S3, según PASEOS_ALMACENAMIENTO)
+@st.cache_resource
+def get_almacenamiento():
+    return crear_almacenamiento()
+
+almacenamiento = get_almacenamiento()
+cola = get_cola_trabajos()
+
 # Sistema de autenticación
 def init_session_state():
     if 'usuario_id' not in st.session_state:
@@ -556,23 +582,102 @@ def mostrar_paseo(paseo_id, paseo_info, usuario_id):
     if paseo_info.get('descripcion'):
         st.caption(paseo_info['descripcion'])
     
-    # Tabs principales
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["💳 Gastos", "📊 Resumen", "💸 Deudas", "👥 Equipo", "🏷️ Categorías"])
-    
-    with tab1:
-        mostrar_gastos(paseo_id, usuario_id)
-    
-    with tab2:
-        mostrar_resumen(paseo_id, usuario_id)
-    
-    with tab3:
-        mostrar_deudas(paseo_id, usuario_id)
-    
-    with tab4:
-        mostrar_participantes(paseo_id, usuario_id)
-    
-    with tab5:
-        mostrar_categorias(paseo_id)
+    # Secciones principales. A diferencia de st.tabs, que ejecuta todas las pestañas en
+    # cada rerun, solo se calcula la sección activa: escribir en el formulario de gastos
+    # no dispara el cálculo de deudas, la exportación ni el análisis con IA.
+    secciones = {
+        "💳 Gastos": lambda: mostrar_gastos(paseo_id, usuario_id),
+        "📊 Resumen": lambda: mostrar_resumen(paseo_id, usuario_id),
+        "💸 Deudas": lambda: mostrar_deudas(paseo_id, usuario_id),
+        "👥 Equipo": lambda: mostrar_participantes(paseo_id, usuario_id),
+        "🏷️ Categorías": lambda: mostrar_categorias(paseo_id),
+    }
+    seccion = st.radio(
+        "Sección",
+        list(secciones.keys()),
+        horizontal=True,
+        key="seccion_paseo",
+        label_visibility="collapsed"
+    )
+    secciones[seccion]()
+
+def hash_subida(archivo):
+    """SHA-256 de un archivo subido, leído por bloques (getbuffer() o getvalue() podrían copiarlo entero)"""
+    archivo.seek(0)
+    h = hashlib.sha256()
+    for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE), b""):
+        h.update(bloque)
+    return h.hexdigest()
+
+def encolar_archivo(paseo_id, usuario_id, tipo, datos, extension=None):
+    """
+    Guarda un audio o foto (bytes o archivo abierto), lo envía a la cola y lo deja
+    como archivo del borrador. En la sesión solo queda la referencia, no el contenido.
+    """
+    extension = extension or EXTENSIONES[tipo]
+    if isinstance(datos, bytes):
+        archivo_path = almacenamiento.guardar(datos, extension)
+    else:
+        datos.seek(0)
+        archivo_path = almacenamiento.guardar_archivo(datos, extension)
+    trabajo_id = cola.encolar(usuario_id, paseo_id, tipo, archivo_path)
+    st.session_state['trabajo_borrador'] = {
+        'id': trabajo_id, 'tipo': tipo, 'archivo_path': archivo_path, 'aplicado': False
+    }
+    st.toast("⏳ Procesando en segundo plano, puedes seguir ingresando gastos")
+
+def usar_resultado_trabajo(trabajo):
+    """Carga el resultado de un trabajo terminado en el borrador del gasto"""
+    resultado = trabajo['resultado']
+    # Agregar nombre del usuario al concepto
+    usuario_nombre = st.session_state.get('usuario_nombre', '')
+    st.session_state['concepto_extraido'] = f"{resultado['concepto']} - {usuario_nombre}" if usuario_nombre else resultado['concepto']
+    st.session_state['valor_extraido'] = resultado['valor']
+    st.session_state['transcripcion_temp'] = resultado.get('transcripcion')
+    st.session_state['categoria_extraida'] = resultado.get('categoria')
+    st.session_state['trabajo_borrador'] = {
+        'id': trabajo['id'], 'tipo': trabajo['tipo'], 'archivo_path': trabajo['archivo_path'], 'aplicado': True
+    }
+    db.actualizar_trabajo(trabajo['id'], ESTADO_USADO)
+
+def mostrar_trabajos(trabajos):
+    """Lista los audios y fotos del usuario en proceso o listos para usar"""
+    st.markdown("#### ⏳ Procesamientos")
+    for trabajo in trabajos:
+        icono = "🎤" if trabajo['tipo'] == TIPO_AUDIO else "📸"
+        col1, col2, col3 = st.columns([4, 1, 1])
+        with col1:
+            if trabajo['estado'] == ESTADO_LISTO:
+                resultado = trabajo['resultado']
+                st.markdown(f"{icono} ✅ **{resultado['concepto']}** · ${resultado['valor']:,.0f}")
+            elif trabajo['estado'] == ESTADO_ERROR:
+                st.markdown(f"{icono} ❌ {trabajo['error'] or 'Error al procesar'}")
+            else:
+                st.markdown(f"{icono} 🔄 {trabajo['estado'].capitalize()}...")
+        if trabajo['estado'] == ESTADO_LISTO:
+            with col2:
+                if st.button("Usar", key=f"usar_trabajo_{trabajo['id']}"):
+                    usar_resultado_trabajo(trabajo)
+                    st.rerun()
+        if trabajo['estado'] in (ESTADO_LISTO, ESTADO_ERROR):
+            with col3:
+                if st.button("🗑️", key=f"descartar_trabajo_{trabajo['id']}"):
+                    cola.descartar(trabajo['id'])
+                    st.rerun()
+
+@st.fragment(run_every=INTERVALO_TRABAJOS)
+def mostrar_trabajos_en_curso(paseo_id, usuario_id):
+    """Refresca solo la lista de procesamientos mientras haya audios o fotos pendientes"""
+    trabajos = db.get_trabajos_usuario(usuario_id, paseo_id, ESTADOS_VISIBLES)
+    borrador = st.session_state.get('trabajo_borrador')
+    borrador_listo = bool(borrador) and not borrador['aplicado'] and any(
+        t['id'] == borrador['id'] and t['estado'] == ESTADO_LISTO for t in trabajos
+    )
+    # Al terminar todo (o el audio/foto del borrador) se recarga la página completa:
+    # así el resultado llega al formulario y se deja de consultar
+    if not any(t['estado'] in ESTADOS_ACTIVOS for t in trabajos) or borrador_listo:
+        st.rerun()
+    mostrar_trabajos(trabajos)
 
 def mostrar_gastos(paseo_id, usuario_id):
     """Muestra y permite agregar gastos"""
@@ -600,15 +705,21 @@ def mostrar_gastos(paseo_id, usuario_id):
     if st.session_state['tipo_gasto_anterior'] != tipo_gasto:
         # Limpiar todos los valores temporales al cambiar tipo
         keys_to_clear = ['transcripcion_temp', 'concepto_extraido', 'valor_extraido', 'categoria_extraida', 
-                        'audio_temp', 'audio_procesado_size', 'foto_temp', 'foto_procesada_size', 'nueva_categoria_nombre']
+                        'trabajo_borrador', 'audio_procesado_hash', 'foto_procesada_hash', 'nueva_categoria_nombre']
         for key in keys_to_clear:
             if key in st.session_state:
                 del st.session_state[key]
         st.session_state['tipo_gasto_anterior'] = tipo_gasto
     
-    # Subida de archivos según el tipo
-    archivo_subido = None
-    transcripcion_texto = None
+    # Si el audio o la foto del borrador ya se procesó, cargar su resultado. El valor ya se
+    # dibujó en este rerun, así que se vuelve a ejecutar para que el formulario lo muestre
+    # (si no, el siguiente clic guardaría un valor que el usuario no vio)
+    borrador = st.session_state.get('trabajo_borrador')
+    if borrador and not borrador['aplicado']:
+        trabajo = db.get_trabajo(borrador['id'])
+        if trabajo and trabajo['estado'] == ESTADO_LISTO:
+            usar_resultado_trabajo(trabajo)
+            st.rerun()
     
     # Concepto - se actualiza con el valor extraído automáticamente o la transcripción
     concepto_default = st.session_state.get('concepto_extraido', '') or st.session_state.get('transcripcion_temp', '')
@@ -629,39 +740,14 @@ def mostrar_gastos(paseo_id, usuario_id):
         if audio_grabado:
             st.audio(audio_grabado)
             
-            # Verificar si ya procesamos este audio
-            audio_bytes = audio_grabado.getvalue()
-            audio_size = len(audio_bytes)
-            
-            if st.session_state.get('audio_procesado_size') != audio_size:
-                # Audio nuevo - procesar automáticamente
-                with st.spinner("🤖 Procesando audio automáticamente..."):
-                    # Guardar temporalmente
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-                        tmp_file.write(audio_bytes)
-                        tmp_path = tmp_file.name
-                    
-                    # Transcribir y extraer información
-                    resultado = transcribir_y_extraer(tmp_path, None)
-                    
-                    if resultado:
-                        st.session_state['transcripcion_temp'] = resultado['transcripcion']
-                        # Agregar nombre del usuario al concepto
-                        usuario_nombre = st.session_state.get('usuario_nombre', '')
-                        concepto_con_usuario = f"{resultado['concepto']} - {usuario_nombre}" if usuario_nombre else resultado['concepto']
-                        st.session_state['concepto_extraido'] = concepto_con_usuario
-                        st.session_state['valor_extraido'] = resultado['valor']
-                        st.session_state['categoria_extraida'] = resultado['categoria']
-                        st.session_state['audio_temp'] = audio_bytes
-                        st.session_state['audio_procesado_size'] = audio_size
-                        os.unlink(tmp_path)
-                        st.rerun()
-                    else:
-                        st.error("❌ Error al procesar el audio")
-                        os.unlink(tmp_path)
+            # Verificar si ya procesamos este audio (por contenido, no por tamaño)
+            audio_hash = hash_subida(audio_grabado)
             
-            # Guardar audio grabado para usar después
-            archivo_subido = audio_grabado
+            if st.session_state.get('audio_procesado_hash') != audio_hash:
+                # Audio nuevo - se recorta y comprime, y se transcribe en segundo plano
+                audio_preparado, extension = preparar_audio(audio_grabado)
+                encolar_archivo(paseo_id, usuario_id, TIPO_AUDIO, audio_preparado, extension)
+                st.session_state['audio_procesado_hash'] = audio_hash
         
         # Mostrar información extraída si existe
         if 'transcripcion_temp' in st.session_state and st.session_state['transcripcion_temp']:
@@ -700,33 +786,21 @@ def mostrar_gastos(paseo_id, usuario_id):
         
         if foto_camara:
             st.image(foto_camara, width=300)
-            archivo_subido = foto_camara
             
-            # Verificar si ya procesamos esta foto
-            foto_bytes = foto_camara.getvalue()
-            foto_size = len(foto_bytes)
+            # Verificar si ya procesamos esta foto (por contenido, no por tamaño)
+            foto_hash = hash_subida(foto_camara)
             
-            if st.session_state.get('foto_procesada_size') != foto_size:
-                # Foto nueva - procesar automáticamente
-                with st.spinner("🤖 Analizando factura automáticamente..."):
-                    # Convertir a base64
-                    imagen_base64 = base64.b64encode(foto_bytes).decode('utf-8')
-                    
-                    # Analizar con GPT-4 Vision
-                    resultado = analizar_foto_factura(imagen_base64)
-                    
-                    if resultado and (resultado['concepto'] or resultado['valor'] > 0):
-                        # Agregar nombre del usuario al concepto
-                        usuario_nombre = st.session_state.get('usuario_nombre', '')
-                        concepto_con_usuario = f"{resultado['concepto']} - {usuario_nombre}" if usuario_nombre else resultado['concepto']
-                        st.session_state['concepto_extraido'] = concepto_con_usuario
-                        st.session_state['valor_extraido'] = resultado['valor']
-                        st.session_state['foto_temp'] = foto_bytes
-                        st.session_state['foto_procesada_size'] = foto_size
-                        st.success("✅ Factura analizada correctamente")
-                        st.rerun()
-                    else:
-                        st.warning("⚠️ No se pudo extraer información. Ingresa los datos manualmente.")
+            if st.session_state.get('foto_procesada_hash') != foto_hash:
+                # Foto nueva - se copia por bloques al almacenamiento y se analiza en segundo plano
+                encolar_archivo(paseo_id, usuario_id, TIPO_FOTO, foto_camara)
+                st.session_state['foto_procesada_hash'] = foto_hash
+    
+    # Audios y fotos en proceso: solo se consulta periódicamente mientras haya alguno pendiente
+    trabajos = db.get_trabajos_usuario(usuario_id, paseo_id, ESTADOS_VISIBLES)
+    if any(t['estado'] in ESTADOS_ACTIVOS for t in trabajos):
+        mostrar_trabajos_en_curso(paseo_id, usuario_id)
+    elif trabajos:
+        mostrar_trabajos(trabajos)
     
     # Sin categorías - la información del lugar va en el concepto
     categoria_id = None
@@ -748,13 +822,11 @@ def mostrar_gastos(paseo_id, usuario_id):
         st.warning("⚠️ No hay participantes en este paseo. Agrega participantes primero.")
     
     # Calcular división automática en partes iguales
+    # (la base de datos reparte los pesos sobrantes para que sumen exactamente el valor)
     divisiones = {}
     if participantes_seleccionados:
-        porcentaje_cada_uno = 100 // len(participantes_seleccionados)
-        resto = 100 % len(participantes_seleccionados)
-        for i, pid in enumerate(participantes_seleccionados):
-            # El primero recibe el resto para que sume 100%
-            divisiones[pid] = porcentaje_cada_uno + (resto if i == 0 else 0)
+        for pid in participantes_seleccionados:
+            divisiones[pid] = 100 / len(participantes_seleccionados)
         
         # Mostrar división
         if valor > 0:
@@ -775,52 +847,46 @@ def mostrar_gastos(paseo_id, usuario_id):
             archivo_path = None
             tipo_archivo_final = None
             
-            # Verificar si hay audio grabado en session_state
-            if 'audio_temp' in st.session_state and tipo_gasto == "Audio":
-                os.makedirs("uploads", exist_ok=True)
-                archivo_path = f"uploads/{paseo_id}_{datetime.now().timestamp()}_grabacion.wav"
-                with open(archivo_path, "wb") as f:
-                    f.write(st.session_state['audio_temp'])
-                tipo_archivo_final = "audio"
-            elif archivo_subido:
-                os.makedirs("uploads", exist_ok=True)
-                # Determinar extensión del archivo
-                if hasattr(archivo_subido, 'name'):
-                    ext = archivo_subido.name.split('.')[-1]
-                    archivo_path = f"uploads/{paseo_id}_{datetime.now().timestamp()}_{archivo_subido.name}"
-                else:
-                    archivo_path = f"uploads/{paseo_id}_{datetime.now().timestamp()}_archivo.wav"
-                with open(archivo_path, "wb") as f:
-                    f.write(archivo_subido.getvalue())
-                tipo_archivo_final = tipo_gasto.lower()
+            # El archivo ya quedó guardado al encolarlo: el gasto solo lo referencia
+            borrador = st.session_state.get('trabajo_borrador')
+            if borrador:
+                archivo_path = borrador['archivo_path']
+                tipo_archivo_final = borrador['tipo']
             
             # Usar transcripción si existe
             transcripcion_final = st.session_state.get('transcripcion_temp', None)
             
-            gasto_id = db.crear_gasto(
-                paseo_id, usuario_id, concepto, valor,
-                datetime.combine(fecha, datetime.min.time()),
-                tipo_archivo_final,
-                archivo_path,
-                transcripcion_final,
-                None  # Sin categorías - la info del lugar va en el concepto
-            )
-            
-            # Crear divisiones
+            # Divisiones del gasto
             divisiones_list = []
             for part_id, porcentaje in divisiones.items():
                 divisiones_list.append({
                     'usuario_id': part_id,
-                    'porcentaje': porcentaje,
-                    'monto': valor * (porcentaje / 100)
+                    'porcentaje': porcentaje
                 })
             
-            db.crear_division_gasto(gasto_id, divisiones_list)
+            # Gasto y divisiones se guardan juntos en una sola transacción
+            try:
+                db.crear_gasto_con_divisiones(
+                    paseo_id, usuario_id, concepto, valor,
+                    datetime.combine(fecha, datetime.min.time()),
+                    divisiones_list,
+                    tipo_archivo_final,
+                    archivo_path,
+                    transcripcion_final,
+                    None  # Sin categorías - la info del lugar va en el concepto
+                )
+            except ValueError as e:
+                st.error(f"No se pudo guardar el gasto: {e}")
+                st.stop()
+            if borrador:
+                # Recién ahora el gasto retiene el archivo y el trabajo puede soltarlo. Si se
+                # guardó a mano antes de que terminara, su resultado tampoco se ofrece ya
+                db.actualizar_trabajo(borrador['id'], ESTADO_GUARDADO)
             
             # Limpiar estado temporal
-            keys_to_clear = ['transcripcion_temp', 'tipo_gasto_anterior', 'audio_temp', 
+            keys_to_clear = ['transcripcion_temp', 'tipo_gasto_anterior', 'trabajo_borrador', 
                            'concepto_extraido', 'valor_extraido', 'categoria_extraida', 'nueva_categoria_nombre',
-                           'audio_procesado_size', 'foto_temp', 'foto_procesada_size']
+                           'audio_procesado_hash', 'foto_procesada_hash']
             for key in keys_to_clear:
                 if key in st.session_state:
                     del st.session_state[key]
@@ -845,7 +911,11 @@ def mostrar_gastos(paseo_id, usuario_id):
     for cat in categorias_filtro:
         filtro_opciones[f"{cat['icono']} {cat['nombre'].split(' ', 1)[-1] if ' ' in cat['nombre'] else cat['nombre']}"] = cat['id']
     
-    col_filtro1, col_filtro2 = st.columns([3, 1])
+    pagador_opciones = {"👥 Todos los pagadores": None}
+    for participante in participantes:
+        pagador_opciones[f"👤 {participante['nombre']}"] = participante['id']
+    
+    col_filtro1, col_filtro2, col_filtro3 = st.columns([2, 2, 2])
     with col_filtro1:
         filtro_categoria = st.selectbox(
             "Filtrar por categoría",
@@ -853,9 +923,39 @@ def mostrar_gastos(paseo_id, usuario_id):
             key="filtro_categoria",
             label_visibility="collapsed"
         )
+    with col_filtro2:
+        filtro_pagador = st.selectbox(
+            "Filtrar por pagador",
+            options=list(pagador_opciones.keys()),
+            key="filtro_pagador",
+            label_visibility="collapsed"
+        )
+    with col_filtro3:
+        filtro_fechas = st.date_input(
+            "Filtrar por fechas",
+            value=(),
+            key="filtro_fechas",
+            label_visibility="collapsed"
+        )
     
     categoria_filtro_id = filtro_opciones[filtro_categoria]
-    gastos = db.get_gastos_paseo(paseo_id, categoria_filtro_id)
+    pagador_filtro_id = pagador_opciones[filtro_pagador]
+    fecha_desde = datetime.combine(filtro_fechas[0], datetime.min.time()) if len(filtro_fechas) > 0 else None
+    # Hasta es inclusiva para el usuario: se consulta hasta el inicio del día siguiente
+    fecha_hasta = datetime.combine(filtro_fechas[-1] + timedelta(days=1), datetime.min.time()) if len(filtro_fechas) > 1 else None
+    
+    # Paginación: pila de cursores de las páginas visitadas (se reinicia si cambian los filtros)
+    filtros = (categoria_filtro_id, pagador_filtro_id, fecha_desde, fecha_hasta)
+    paginacion_key = f"paginacion_gastos_{paseo_id}"
+    paginacion = st.session_state.get(paginacion_key)
+    if not paginacion or paginacion['filtros'] != filtros:
+        paginacion = {'filtros': filtros, 'cursores': [None]}
+        st.session_state[paginacion_key] = paginacion
+    
+    gastos, siguiente_cursor = db.get_gastos_paseo_pagina(
+        paseo_id, GASTOS_POR_PAGINA, paginacion['cursores'][-1],
+        categoria_filtro_id, pagador_filtro_id, fecha_desde, fecha_hasta
+    )
     
     # Mostrar resumen por categorías
     resumen_categorias = db.get_gastos_por_categoria(paseo_id)
@@ -908,6 +1008,8 @@ def mostrar_gastos(paseo_id, usuario_id):
                     st.rerun()
                 if st.button("🗑️", key=f"delete_{gasto['id']}", help="Eliminar"):
                     db.eliminar_gasto(gasto['id'])
+                    # Borrar el audio o foto si ningún otro gasto lo comparte
+                    liberar(db, almacenamiento, gasto.get('archivo_path'))
                     st.rerun()
             
             # Formulario de edición (visible si está activado)
@@ -937,6 +1039,24 @@ def mostrar_gastos(paseo_id, usuario_id):
                             st.session_state[f"editing_{gasto['id']}"] = False
                             st.rerun()
                     st.markdown("---")
+        
+        # Navegación entre páginas
+        if len(paginacion['cursores']) > 1 or siguiente_cursor:
+            col_anterior, col_pagina, col_siguiente = st.columns([1, 1, 1])
+            with col_anterior:
+                if len(paginacion['cursores']) > 1 and st.button("⬅️ Anteriores", key="gastos_pagina_anterior"):
+                    paginacion['cursores'].pop()
+                    st.rerun()
+            with col_pagina:
+                st.markdown(f"<p style='text-align: center; color: #94a3b8;'>Página {len(paginacion['cursores'])}</p>", unsafe_allow_html=True)
+            with col_siguiente:
+                if siguiente_cursor and st.button("Siguientes ➡️", key="gastos_pagina_siguiente"):
+                    paginacion['cursores'].append(siguiente_cursor)
+                    st.rerun()
+    elif len(paginacion['cursores']) > 1:
+        # La página quedó vacía (p. ej. se eliminó su último gasto): volver a la anterior
+        paginacion['cursores'].pop()
+        st.rerun()
     else:
         st.markdown("""
         <div class='modern-card' style='text-align: center; padding: 2rem;'>
@@ -948,10 +1068,13 @@ def mostrar_gastos(paseo_id, usuario_id):
 
 def mostrar_resumen(paseo_id, usuario_id):
     """Muestra el resumen de gastos del usuario con análisis inteligente"""
-    resumen = db.get_resumen_usuario_paseo(usuario_id, paseo_id)
     gastos = db.get_gastos_paseo(paseo_id)
     participantes = db.get_participantes_paseo(paseo_id)
     deudas = db.calcular_deudas_paseo(paseo_id)
+    # Saldos de todos los participantes en una sola consulta
+    resumenes = db.get_resumenes_paseo(paseo_id)
+    resumenes_por_id = {r['id']: r for r in resumenes}
+    resumen = resumenes_por_id.get(usuario_id) or db.get_resumen_usuario_paseo(usuario_id, paseo_id)
     
     # Métricas con diseño moderno
     col1, col2, col3 = st.columns(3)
@@ -979,84 +1102,86 @@ def mostrar_resumen(paseo_id, usuario_id):
         </div>
         """, unsafe_allow_html=True)
     
-    # Botón de descarga Excel
+    # Exportación: se genera solo al pedirla (leyendo la base por partes) y se reutiliza
+    # mientras no cambien los datos del paseo
     if gastos:
-        # Preparar datos para Excel
-        df_gastos = pd.DataFrame([{
-            'Fecha': g.get('fecha', ''),
-            'Concepto': g.get('concepto', ''),
-            'Valor': g.get('valor', 0),
-            'Pagado por': g.get('pagador_nombre', ''),
-            'Tipo': g.get('tipo_archivo', 'Manual')
-        } for g in gastos])
-        
-        df_deudas = pd.DataFrame([{
-            'Deudor': d.get('deudor_nombre', ''),
-            'Acreedor': d.get('pagador_nombre', ''),
-            'Monto': d.get('total', 0)
-        } for d in deudas]) if deudas else pd.DataFrame()
-        
-        df_participantes = pd.DataFrame([{
-            'Nombre': p.get('nombre', ''),
-            'Pagó': db.get_resumen_usuario_paseo(p['id'], paseo_id)['total_pagado'],
-            'Debe': db.get_resumen_usuario_paseo(p['id'], paseo_id)['total_debe'],
-            'Balance': db.get_resumen_usuario_paseo(p['id'], paseo_id)['balance']
-        } for p in participantes])
-        
-        # Crear Excel en memoria
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_gastos.to_excel(writer, sheet_name='Gastos', index=False)
-            df_participantes.to_excel(writer, sheet_name='Participantes', index=False)
-            if not df_deudas.empty:
-                df_deudas.to_excel(writer, sheet_name='Deudas', index=False)
-        output.seek(0)
+        col_formato, col_exportar = st.columns([2, 1])
+        with col_formato:
+            formato = st.selectbox(
+                "Formato",
+                formatos_disponibles(),
+                format_func=lambda f: FORMATOS[f][0],
+                key=f"formato_exportacion_{paseo_id}",
+                label_visibility="collapsed"
+            )
+        with col_exportar:
+            if st.button("📦 Exportar", key=f"exportar_{paseo_id}"):
+                with st.spinner("Generando archivo..."):
+                    st.session_state['exportacion'] = {
+                        'paseo_id': paseo_id,
+                        'formato': formato,
+                        'digest': db.digest_paseo(paseo_id),
+                        'ruta': exportar_paseo(db, paseo_id, formato)
+                    }
         
-        st.download_button(
-            label="📥 Descargar Excel",
-            data=output,
-            file_name=f"paseo_{paseo_id}_gastos.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        exportacion = st.session_state.get('exportacion')
+        if (exportacion and exportacion['paseo_id'] == paseo_id and exportacion['formato'] == formato
+                and exportacion['digest'] == db.digest_paseo(paseo_id) and os.path.exists(exportacion['ruta'])):
+            with open(exportacion['ruta'], 'rb') as archivo:
+                st.download_button(
+                    label=f"📥 Descargar {FORMATOS[formato][0]}",
+                    data=archivo,
+                    file_name=nombre_descarga(paseo_id, formato),
+                    mime=FORMATOS[formato][2]
+                )
     
     # Análisis inteligente automático
     if gastos:
         st.markdown("---")
         st.markdown("### 🤖 Análisis Inteligente")
         
-        # Usar cache para no regenerar cada vez (incluye suma de valores para detectar ediciones)
-        total_valores = sum(g.get('valor', 0) for g in gastos)
-        cache_key = f"analisis_{paseo_id}_{len(gastos)}_{total_valores}"
+        # El análisis se guarda en la base de datos (compartido por todos los participantes) y
+        # se reutiliza mientras no cambien los gastos, divisiones o participantes del paseo
+        clave_analisis = clave_cache(MODELO_ANALISIS, VERSION_PROMPT_ANALISIS, db.digest_paseo(paseo_id))
+        analisis_guardado = db.get_analisis(paseo_id, clave_analisis, ANALISIS_MAX_EDAD_HORAS * 3600)
+        regenerar = st.button("🔄 Regenerar análisis", key=f"regenerar_analisis_{paseo_id}")
         
-        if cache_key not in st.session_state:
-            with st.spinner("🧠 Analizando gastos con IA..."):
-                # Preparar gastos con nombre del pagador
-                gastos_con_pagador = []
-                for g in gastos:
-                    gasto_info = dict(g)
-                    # Obtener nombre del pagador
-                    pagador = next((p for p in participantes if p['id'] == g.get('usuario_id')), None)
-                    gasto_info['pagador_nombre'] = pagador['nombre'] if pagador else 'Desconocido'
-                    gastos_con_pagador.append(gasto_info)
-                
-                analisis = generar_analisis_inteligente(gastos_con_pagador, participantes, deudas)
-                if analisis:
-                    st.session_state[cache_key] = analisis
-        
-        if cache_key in st.session_state:
-            st.markdown(f"""
-            <div style='background: rgba(99,102,241,0.1); border-radius: 12px; padding: 1rem; border: 1px solid rgba(99,102,241,0.3);'>
-            """, unsafe_allow_html=True)
-            st.markdown(st.session_state[cache_key])
-            st.markdown("</div>", unsafe_allow_html=True)
+        st.markdown(f"""
+        <div style='background: rgba(99,102,241,0.1); border-radius: 12px; padding: 1rem; border: 1px solid rgba(99,102,241,0.3);'>
+        """, unsafe_allow_html=True)
+        if analisis_guardado and not regenerar:
+            st.markdown(analisis_guardado['contenido'])
+            st.caption(f"🕒 Generado hace {max(analisis_guardado['edad_segundos'] // 60, 1)} min")
+        else:
+            # Preparar gastos con nombre del pagador
+            gastos_con_pagador = []
+            for g in gastos:
+                gasto_info = dict(g)
+                # Obtener nombre del pagador
+                pagador = next((p for p in participantes if p['id'] == g.get('usuario_id')), None)
+                gasto_info['pagador_nombre'] = pagador['nombre'] if pagador else 'Desconocido'
+                gastos_con_pagador.append(gasto_info)
+            
+            transferencias = db.calcular_deudas_paseo(paseo_id, modo=MODO_SIMPLIFICADO)
+            # El análisis se va mostrando mientras el modelo lo escribe
+            estado_analisis = {}
+            analisis = st.write_stream(
+                generar_analisis_inteligente_stream(gastos_con_pagador, participantes, deudas, transferencias,
+                                                    estado=estado_analisis)
+            )
+            # Solo se guarda (y se comparte con los demás participantes) si llegó completo
+            if analisis and estado_analisis.get('completo'):
+                db.guardar_analisis(paseo_id, clave_analisis, analisis.strip())
+            elif analisis:
+                st.caption("⚠️ El análisis quedó incompleto; se generará de nuevo en la próxima visita")
+        st.markdown("</div>", unsafe_allow_html=True)
     
     # Resumen por participante (colapsado)
     st.markdown("---")
     st.markdown("### 👥 Detalle por Participante")
-    for participante in participantes:
-        resumen_part = db.get_resumen_usuario_paseo(participante['id'], paseo_id)
+    for resumen_part in resumenes:
         balance_color = '#10b981' if resumen_part['balance'] >= 0 else '#ef4444'
-        with st.expander(f"👤 {participante['nombre']}"):
+        with st.expander(f"👤 {resumen_part['nombre']}"):
             col_a, col_b, col_c = st.columns(3)
             with col_a:
                 st.markdown(f"**💳 Pagó:** <span style='color:#10b981'>${resumen_part['total_pagado']:,.0f}</span>", unsafe_allow_html=True)
@@ -1067,7 +1192,12 @@ def mostrar_resumen(paseo_id, usuario_id):
 
 def mostrar_deudas(paseo_id, usuario_id):
     """Muestra las deudas entre usuarios"""
-    deudas = db.calcular_deudas_paseo(paseo_id)
+    simplificar = st.toggle(
+        "🔀 Simplificar deudas",
+        key=f"simplificar_deudas_{paseo_id}",
+        help="Calcula el mínimo de transferencias para quedar a paz y salvo, en vez de las deudas entre cada pareja"
+    )
+    deudas = db.calcular_deudas_paseo(paseo_id, modo=MODO_SIMPLIFICADO if simplificar else MODO_PARES)
     
     if deudas:
         # Mis deudas primero
@@ -1092,6 +1222,8 @@ def mostrar_deudas(paseo_id, usuario_id):
                 </div>
                 """, unsafe_allow_html=True)
                 
+                if not deuda['conceptos']:
+                    continue
                 with st.expander("📋 Ver conceptos"):
                     for concepto in deuda['conceptos']:
                         st.markdown(f"• {concepto['concepto']}: <span style='color:#fbbf24'>${concepto['monto']:,.0f}</span>", unsafe_allow_html=True)
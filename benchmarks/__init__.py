@@ -0,0 +1,5 @@
+"""
+Benchmarks de rendimiento de Paseos.
+Cada módulo se ejecuta por separado desde la raíz del repositorio, por ejemplo:
+    python -m benchmarks.bench_liquidacion
+"""
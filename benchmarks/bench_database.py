@@ -0,0 +1,184 @@
+"""
+Benchmark de las consultas más usadas de Database sobre datos sintéticos.
+Uso: python -m benchmarks.bench_database --gastos 100,1000,10000 --salida resultados.json
+     python -m benchmarks.bench_database --comparar base.json resultados.json
+
+Por cada tamaño (gastos por paseo) crea una base temporal con
+benchmarks.datos_sinteticos y mide cada escenario en frío (cache de consultas
+vacío, como tras una escritura) y con cache, con calentamiento previo y rotando
+entre los paseos. Los resultados (percentiles en milisegundos, más el commit y
+los parámetros) se guardan en JSON para comparar entre commits.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.datos_sinteticos import generar_datos
+from database import Database
+
+# Escenario: función (db, paseo_id, usuario_id) que ejecuta la consulta
+ESCENARIOS: Dict[str, Callable[[Database, int, int], object]] = {
+    "get_gastos_paseo": lambda db, paseo_id, usuario_id: db.get_gastos_paseo(paseo_id),
+    "calcular_deudas_paseo": lambda db, paseo_id, usuario_id: db.calcular_deudas_paseo(paseo_id),
+    "get_resumen_usuario_paseo": lambda db, paseo_id, usuario_id: db.get_resumen_usuario_paseo(usuario_id, paseo_id),
+    "get_gastos_por_categoria": lambda db, paseo_id, usuario_id: db.get_gastos_por_categoria(paseo_id),
+}
+
+MODO_FRIO = "frio"      # Se vacía el cache de consultas antes de cada llamada
+MODO_CACHE = "cache"    # Llamadas repetidas sin escrituras de por medio
+
+# Una comparación se marca como regresión si la mediana empeora más que esto...
+UMBRAL_REGRESION = 0.10
+# ...y más que esto en valor absoluto (por debajo es ruido de medición)
+DIFERENCIA_MINIMA_MS = 0.05
+
+def percentil(valores: List[float], p: float) -> float:
+    """Percentil p (0-100) con interpolación lineal entre los valores ordenados"""
+    ordenados = sorted(valores)
+    posicion = (len(ordenados) - 1) * p / 100
+    abajo = int(posicion)
+    arriba = min(abajo + 1, len(ordenados) - 1)
+    return ordenados[abajo] + (ordenados[arriba] - ordenados[abajo]) * (posicion - abajo)
+
+def medir(db: Database, escenario: Callable, casos: List[Tuple[int, int]], modo: str,
+          calentamiento: int, repeticiones: int) -> Dict:
+    """Ejecuta un escenario rotando entre los casos (paseo_id, usuario_id) y retorna sus tiempos en ms"""
+    tiempos = []
+    for i in range(calentamiento + repeticiones):
+        paseo_id, usuario_id = casos[i % len(casos)]
+        if modo == MODO_FRIO:
+            db.cache.clear()
+        inicio = time.perf_counter()
+        escenario(db, paseo_id, usuario_id)
+        duracion = (time.perf_counter() - inicio) * 1000
+        if i >= calentamiento:
+            tiempos.append(duracion)
+    return {
+        "repeticiones": repeticiones,
+        "p50_ms": percentil(tiempos, 50),
+        "p90_ms": percentil(tiempos, 90),
+        "p99_ms": percentil(tiempos, 99),
+        "media_ms": statistics.fmean(tiempos),
+        "min_ms": min(tiempos),
+        "max_ms": max(tiempos),
+    }
+
+def commit_actual() -> str:
+    """Commit del repositorio (con '-sucio' si hay cambios sin commitear), o '' fuera de git"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        sucio = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True, check=True).stdout.strip()
+        return f"{commit}-sucio" if sucio else commit
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def ejecutar(args) -> Dict:
+    """Siembra una base por tamaño y mide todos los escenarios"""
+    escenarios = args.escenarios.split(",") if args.escenarios else list(ESCENARIOS)
+    resultados = []
+    for gastos in [int(g) for g in args.gastos.split(",")]:
+        directorio = tempfile.mkdtemp(prefix="paseos_bench_")
+        db = Database(os.path.join(directorio, "paseos.db"))
+        inicio = time.perf_counter()
+        creados = generar_datos(db, args.usuarios, args.paseos, args.participantes, gastos, semilla=args.semilla)
+        print(f"{gastos} gastos por paseo: {creados['divisiones']} divisiones sembradas en "
+              f"{time.perf_counter() - inicio:.1f} s", file=sys.stderr)
+        casos = [(paseo_id, miembros[i % len(miembros)])
+                 for i, (paseo_id, miembros) in enumerate(creados['paseos'].items())]
+
+        for nombre in escenarios:
+            for modo in (MODO_FRIO, MODO_CACHE):
+                medicion = medir(db, ESCENARIOS[nombre], casos, modo, args.calentamiento, args.repeticiones)
+                resultados.append({"escenario": nombre, "modo": modo, "gastos_por_paseo": gastos, **medicion})
+        db.close()
+
+    return {
+        "commit": commit_actual(),
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "plataforma": platform.platform(),
+        "parametros": {
+            "usuarios": args.usuarios, "paseos": args.paseos, "participantes": args.participantes,
+            "calentamiento": args.calentamiento, "repeticiones": args.repeticiones, "semilla": args.semilla,
+        },
+        "resultados": resultados,
+    }
+
+def imprimir(reporte: Dict):
+    print(f"Commit {reporte['commit'] or '-'} · Python {reporte['python']} · SQLite {reporte['sqlite']}")
+    print(f"{'Escenario':<28} {'Modo':<6} {'Gastos':>7} {'p50':>9} {'p90':>9} {'p99':>9}")
+    for r in reporte['resultados']:
+        print(f"{r['escenario']:<28} {r['modo']:<6} {r['gastos_por_paseo']:>7} "
+              f"{r['p50_ms']:>7.3f}ms {r['p90_ms']:>7.3f}ms {r['p99_ms']:>7.3f}ms")
+
+def comparar(base: Dict, nuevo: Dict, umbral: float = UMBRAL_REGRESION,
+             diferencia_minima_ms: float = DIFERENCIA_MINIMA_MS) -> int:
+    """Compara las medianas de dos reportes; imprime la tabla y retorna cuántas regresiones hay"""
+    def clave(r):
+        return (r['escenario'], r['modo'], r['gastos_por_paseo'])
+
+    anteriores = {clave(r): r for r in base['resultados']}
+    regresiones = 0
+    print(f"Base {base['commit'] or '-'} ({base['fecha']}) → nuevo {nuevo['commit'] or '-'} ({nuevo['fecha']})")
+    print(f"{'Escenario':<28} {'Modo':<6} {'Gastos':>7} {'p50 base':>11} {'p50 nuevo':>11} {'cambio':>8}")
+    for r in nuevo['resultados']:
+        anterior = anteriores.get(clave(r))
+        if not anterior:
+            continue
+        cambio = r['p50_ms'] / anterior['p50_ms'] - 1 if anterior['p50_ms'] else 0.0
+        marca = ""
+        if cambio > umbral and r['p50_ms'] - anterior['p50_ms'] > diferencia_minima_ms:
+            marca = "  ⚠ regresión"
+            regresiones += 1
+        print(f"{r['escenario']:<28} {r['modo']:<6} {r['gastos_por_paseo']:>7} {anterior['p50_ms']:>9.3f}ms "
+              f"{r['p50_ms']:>9.3f}ms {cambio:>+8.0%}{marca}")
+    return regresiones
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--gastos", default="100,1000,10000", help="Gastos por paseo, separados por coma")
+    parser.add_argument("--usuarios", type=int, default=50)
+    parser.add_argument("--paseos", type=int, default=5)
+    parser.add_argument("--participantes", type=int, default=8, help="Participantes por paseo")
+    parser.add_argument("--escenarios", help=f"Subconjunto de: {', '.join(ESCENARIOS)}")
+    parser.add_argument("--calentamiento", type=int, default=5)
+    parser.add_argument("--repeticiones", type=int, default=50)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", help="Guardar los resultados en este JSON")
+    parser.add_argument("--comparar", nargs=2, metavar=("BASE", "NUEVO"),
+                        help="Comparar dos JSON guardados en vez de medir")
+    parser.add_argument("--umbral", type=float, default=UMBRAL_REGRESION,
+                        help="Empeoramiento de la mediana que cuenta como regresión (0.10 = 10%%)")
+    parser.add_argument("--diferencia-minima-ms", type=float, default=DIFERENCIA_MINIMA_MS,
+                        help="Diferencias menores a esta no cuentan como regresión")
+    args = parser.parse_args()
+
+    if args.comparar:
+        with open(args.comparar[0], encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.comparar[1], encoding="utf-8") as f:
+            nuevo = json.load(f)
+        # Código de salida distinto de cero si hay regresiones, para usarlo en CI
+        sys.exit(1 if comparar(base, nuevo, args.umbral, args.diferencia_minima_ms) else 0)
+
+    reporte = ejecutar(args)
+    imprimir(reporte)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en {args.salida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark del extractor local de gastos sobre un corpus de frases dictadas.
+Uso: python -m benchmarks.bench_extractor --repeticiones 1000
+
+Mide la tasa de aciertos del camino rápido (frases que se resuelven sin el
+modelo), la precisión de esas respuestas y el tiempo por frase. Las frases con
+valor esperado None son ambiguas: lo correcto es que vayan al modelo.
+"""
+import argparse
+import statistics
+import time
+
+from extractor_local import UMBRAL_CONFIANZA, extraer_local
+
+# (texto, concepto esperado, valor esperado)
+CORPUS = [
+    ("Almuerzo en Crepes cuarenta mil", "Almuerzo en Crepes", 40000),
+    ("Café en Juan Valdez quince mil", "Café en Juan Valdez", 15000),
+    ("Gasolina cincuenta mil", "Gasolina", 50000),
+    ("Uber al aeropuerto treinta mil", "Uber al aeropuerto", 30000),
+    ("Almuerzo en Crepes, 40.000 pesos.", "Almuerzo en Crepes", 40000),
+    ("Mercado en el Éxito $185.500", "Mercado en el Éxito", 185500),
+    ("Taxi al hotel 25k", "Taxi al hotel", 25000),
+    ("Cervezas en la playa 60 lucas", "Cervezas en la playa", 60000),
+    ("Peajes treinta y cinco mil", "Peajes", 35000),
+    ("Hotel en Cartagena un millón doscientos mil", "Hotel en Cartagena", 1200000),
+    ("Tiquetes de bus 1.5 millones", "Tiquetes de bus", 1500000),
+    ("Finca dos palos", "Finca", 2000000),
+    ("Pagué 50 lucas en el mercado", "Mercado", 50000),
+    ("Cena en Andrés Carne de Res 420.000", "Cena en Andrés Carne de Res", 420000),
+    ("Helados veintidós mil quinientos", "Helados", 22500),
+    ("Arepas en la esquina 12,000", "Arepas en la esquina", 12000),
+    ("Lancha a Barú: 300 mil", "Lancha a Barú", 300000),
+    ("Propina del guía diez mil pesos", "Propina del guía", 10000),
+    ("Fueron 80 mil de la pizza en Domino's", "Pizza en Domino's", 80000),
+    ("Tour a Guatapé ciento cincuenta mil", "Tour a Guatapé", 150000),
+    ("Un café en Oma cinco mil", "Café en Oma", 5000),
+    ("Parqueadero siete mil", "Parqueadero", 7000),
+    ("Desayuno novecientos mil", "Desayuno", 900000),
+    ("Hospedaje un millón y medio", "Hospedaje", 1500000),
+    ("Agua y hielo 9500", "Agua y hielo", 9500),
+    ("Entradas al parque 2.400.000", "Entradas al parque", 2400000),
+    ("Asado doscientos cincuenta y cinco mil", "Asado", 255000),
+    ("Almuerzo 1.000.000,50", "Almuerzo", 1000000),
+    ("Almuerzo cuarenta", None, None),
+    ("Dos cervezas de diez mil", None, None),
+    ("Hotel 2 noches 300 mil", None, None),
+    ("Compré de todo en el mercado", None, None),
+    ("120 mil", None, None),
+    # Números seguidos que no forman un solo valor: no se suman
+    ("Cena para dos ochenta mil", None, None),
+    ("Almuerzo para cuatro cien mil", None, None),
+    ("Pizza para seis 90.000", None, None),
+    ("Entradas para 3 60 mil", None, None),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeticiones", type=int, default=1000)
+    parser.add_argument("--detalle", action="store_true", help="Mostrar el resultado de cada frase")
+    args = parser.parse_args()
+
+    resueltas = correctas = ambiguas_al_modelo = 0
+    ambiguas = sum(1 for _, _, valor in CORPUS if valor is None)
+    for texto, concepto, valor in CORPUS:
+        resultado, confianza = extraer_local(texto)
+        rapido = confianza >= UMBRAL_CONFIANZA
+        if valor is None:
+            ambiguas_al_modelo += not rapido
+            ok = not rapido
+        else:
+            resueltas += rapido
+            ok = rapido and resultado['valor'] == valor and resultado['concepto'].lower() == concepto.lower()
+            correctas += ok
+        if args.detalle or not ok:
+            marca = "OK " if ok else "MAL"
+            print(f"{marca} {confianza:.1f} {texto!r} -> {resultado['concepto']!r}, {resultado['valor']}")
+
+    tiempos = []
+    for _ in range(args.repeticiones):
+        inicio = time.perf_counter()
+        for texto, _, _ in CORPUS:
+            extraer_local(texto)
+        tiempos.append((time.perf_counter() - inicio) / len(CORPUS))
+
+    claras = len(CORPUS) - ambiguas
+    print(f"Frases:                 {len(CORPUS)} ({ambiguas} ambiguas)")
+    print(f"Resueltas localmente:   {resueltas}/{claras} ({resueltas / claras:.0%})")
+    print(f"Correctas de esas:      {correctas}/{resueltas}" if resueltas else "Correctas de esas:      -")
+    print(f"Ambiguas al modelo:     {ambiguas_al_modelo}/{ambiguas}")
+    print(f"Tiempo por frase:       {statistics.median(tiempos) * 1e6:.1f} µs (mediana)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Benchmark del preprocesamiento de fotos de facturas: tamaño de la petición y
+latencia de gpt-4o contra la precisión de la extracción.
+Uso: python -m benchmarks.bench_imagenes
+     python -m benchmarks.bench_imagenes fotos/ --esperado fotos/esperado.json --con-modelo
+
+Sin directorio se usa un juego de fotos sintéticas que se genera en memoria
+(facturas sobre una mesa a resoluciones de celular, una con rotación EXIF y una
+captura PNG), así el tamaño de la petición y la latencia del preprocesamiento se
+reproducen sin datos. Sin --con-modelo solo se mide el preprocesamiento (no se
+llama a OpenAI).
+
+La precisión requiere facturas reales: el directorio contiene las fotos (.jpg,
+.jpeg, .png) y esperado.json tiene el total correcto de cada una:
+{"factura1.jpg": {"valor": 45000}, ...}.
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import tempfile
+import time
+from io import BytesIO
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from preprocesamiento import preparar_imagen
+
+EXTENSIONES_IMAGEN = (".jpg", ".jpeg", ".png")
+
+# Variantes a comparar: None es la foto original sin preprocesar
+VARIANTES = {
+    "original": None,
+    "1568px q80": {"max_lado": 1568, "calidad": 80},
+    "1024px q75": {"max_lado": 1024, "calidad": 75},
+    "1024px q75 gris+recorte": {"max_lado": 1024, "calidad": 75, "escala_grises": True, "recortar": True},
+    "768px q70": {"max_lado": 768, "calidad": 70},
+}
+
+# Fotos sintéticas: (nombre, ancho, alto, formato, orientación EXIF)
+FOTOS_SINTETICAS = [
+    ("factura_celular_vertical.jpg", 3024, 4032, "JPEG", 1),
+    ("factura_celular_exif_rotada.jpg", 3024, 4032, "JPEG", 6),
+    ("factura_celular_antiguo.jpg", 1536, 2048, "JPEG", 1),
+    ("factura_captura.png", 1080, 1920, "PNG", 1),
+]
+
+def generar_factura(ancho: int, alto: int, semilla: int) -> Image.Image:
+    """Factura de papel claro con texto sobre una mesa oscura con textura, como una foto de celular"""
+    rng = np.random.default_rng(semilla)
+    mesa = rng.integers(30, 90, (alto // 16, ancho // 16, 3), dtype=np.uint8)
+    imagen = Image.fromarray(mesa).resize((ancho, alto), Image.BILINEAR)
+
+    # El texto se dibuja a baja resolución con la fuente por defecto y se escala al papel
+    papel = Image.new("RGB", (240, 400), (245, 242, 235))
+    dibujo = ImageDraw.Draw(papel)
+    lineas = ["RESTAURANTE LA PLAYA", "NIT 900.123.456-7", "Mesa 4", ""]
+    total = 0
+    for i in range(int(rng.integers(4, 9))):
+        precio = int(rng.integers(3, 60)) * 1000
+        total += precio
+        lineas.append(f"Producto {i + 1:<12} ${precio:>9,}".replace(",", "."))
+    lineas += ["", f"TOTAL {'':<14} ${total:>9,}".replace(",", "."), "", "Gracias por su compra"]
+    for i, linea in enumerate(lineas):
+        dibujo.text((12, 12 + i * 16), linea, fill=(20, 20, 20))
+    papel = papel.resize((int(ancho * 0.55), int(alto * 0.75)), Image.BICUBIC).rotate(
+        float(rng.uniform(-4, 4)), expand=True, fillcolor=(0, 0, 0))
+    mascara = papel.convert("L").point(lambda v: 255 if v > 0 else 0)
+    imagen.paste(papel, ((ancho - papel.width) // 2, (alto - papel.height) // 2), mascara)
+
+    # Ruido de sensor para que el JPEG no se comprima de más
+    ruido = rng.normal(0, 6, (alto, ancho, 3))
+    return Image.fromarray(np.clip(np.asarray(imagen, dtype=np.float32) + ruido, 0, 255).astype(np.uint8))
+
+def generar_fotos_sinteticas() -> Dict[str, bytes]:
+    """Juego fijo de fotos de facturas generadas (siempre las mismas)"""
+    fotos = {}
+    for semilla, (nombre, ancho, alto, formato, orientacion) in enumerate(FOTOS_SINTETICAS):
+        imagen = generar_factura(ancho, alto, semilla)
+        salida = BytesIO()
+        if orientacion == 6:
+            # Guardada de lado con la orientación en el EXIF, como muchas cámaras
+            exif = Image.Exif()
+            exif[0x0112] = orientacion
+            imagen.rotate(90, expand=True).save(salida, format=formato, quality=92, exif=exif)
+        else:
+            imagen.save(salida, format=formato, **({"quality": 92} if formato == "JPEG" else {}))
+        fotos[nombre] = salida.getvalue()
+    return fotos
+
+def cargar_fotos(directorio: str) -> Dict[str, bytes]:
+    """Lee todas las fotos del directorio"""
+    fotos = {}
+    for nombre in sorted(os.listdir(directorio)):
+        if nombre.lower().endswith(EXTENSIONES_IMAGEN):
+            with open(os.path.join(directorio, nombre), "rb") as f:
+                fotos[nombre] = f.read()
+    return fotos
+
+def medir_variante(fotos: Dict[str, bytes], parametros: Dict, esperado: Dict,
+                   con_modelo: bool, detalle: str) -> Dict:
+    """Preprocesa (y opcionalmente analiza) todas las fotos con una variante"""
+    tamanos: List[int] = []
+    tiempos_prep: List[float] = []
+    latencias: List[float] = []
+    aciertos = 0
+    for nombre, datos in fotos.items():
+        inicio = time.perf_counter()
+        preparada = preparar_imagen(datos, **parametros) if parametros is not None else datos
+        tiempos_prep.append(time.perf_counter() - inicio)
+        imagen_base64 = base64.b64encode(preparada).decode('utf-8')
+        tamanos.append(len(imagen_base64))
+
+        if con_modelo:
+            from openai_helper import analizar_foto_factura
+            inicio = time.perf_counter()
+            resultado = analizar_foto_factura(imagen_base64, detalle)
+            latencias.append(time.perf_counter() - inicio)
+            if nombre in esperado and resultado.get('valor') == esperado[nombre]['valor']:
+                aciertos += 1
+
+    return {
+        "kb_mediana": statistics.median(tamanos) / 1024,
+        "prep_ms": statistics.median(tiempos_prep) * 1000,
+        "latencia_ms": statistics.median(latencias) * 1000 if latencias else None,
+        "aciertos": aciertos,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directorio", nargs="?",
+                        help="Directorio con fotos de facturas reales (por defecto, fotos sintéticas)")
+    parser.add_argument("--esperado", default=None, help="JSON con el valor correcto de cada foto")
+    parser.add_argument("--con-modelo", action="store_true",
+                        help="Llamar a gpt-4o (requiere OPENAI_API_KEY y fotos reales)")
+    parser.add_argument("--detalle", default="high", choices=["low", "high", "auto"])
+    parser.add_argument("--salida", help="Guardar los resultados en este JSON")
+    args = parser.parse_args()
+
+    if args.directorio:
+        fotos = cargar_fotos(args.directorio)
+        if not fotos:
+            parser.error(f"No hay fotos en {args.directorio}")
+    elif args.con_modelo:
+        parser.error("--con-modelo mide la precisión y necesita un directorio con facturas reales")
+    else:
+        fotos = generar_fotos_sinteticas()
+    esperado = {}
+    if args.esperado:
+        with open(args.esperado, encoding="utf-8") as f:
+            esperado = json.load(f)
+    if args.con_modelo:
+        # Medir la llamada real, no la cache de respuestas
+        os.environ["PASEOS_CACHE_IA"] = os.path.join(tempfile.mkdtemp(), "cache_ia.db")
+
+    origen = args.directorio or "sintéticas"
+    print(f"{len(fotos)} foto(s) ({origen}), detalle={args.detalle}")
+    print(f"{'Variante':<26}{'KB (b64)':>10}{'Prep ms':>10}{'Modelo ms':>11}{'Aciertos':>10}")
+    resultados = {}
+    for nombre, parametros in VARIANTES.items():
+        r = resultados[nombre] = medir_variante(fotos, parametros, esperado, args.con_modelo, args.detalle)
+        latencia = f"{r['latencia_ms']:.0f}" if r['latencia_ms'] is not None else "-"
+        aciertos = f"{r['aciertos']}/{len(esperado)}" if args.con_modelo and esperado else "-"
+        print(f"{nombre:<26}{r['kb_mediana']:>10.1f}{r['prep_ms']:>10.1f}{latencia:>11}{aciertos:>10}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"fotos": origen, "detalle": args.detalle, "variantes": resultados}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en {args.salida}")
+
+if __name__ == "__main__":
+    main()
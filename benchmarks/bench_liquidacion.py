@@ -0,0 +1,49 @@
+"""
+Benchmark del motor de liquidación sobre grupos sintéticos.
+Uso: python -m benchmarks.bench_liquidacion --participantes 1000 --repeticiones 20
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Dict
+
+from liquidacion import simplificar_deudas
+
+def generar_balances(participantes: int, semilla: int = 42) -> Dict[int, int]:
+    """Genera balances en pesos que suman cero, con montos típicos de un paseo"""
+    rng = random.Random(semilla)
+    balances = {uid: rng.randrange(-500_000, 500_000, 100) for uid in range(1, participantes + 1)}
+    # El último compensa para que la suma sea exactamente cero
+    balances[participantes] -= sum(balances.values())
+    return balances
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--participantes", type=int, default=1000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    balances = generar_balances(args.participantes, args.semilla)
+    tiempos = []
+    for _ in range(args.repeticiones):
+        inicio = time.perf_counter()
+        transferencias = simplificar_deudas(balances)
+        tiempos.append(time.perf_counter() - inicio)
+
+    # Verificar que las transferencias saldan exactamente a todos
+    saldo = dict(balances)
+    for deudor_id, acreedor_id, monto in transferencias:
+        saldo[deudor_id] += monto
+        saldo[acreedor_id] -= monto
+    assert all(v == 0 for v in saldo.values()), "La liquidación no deja a todos en cero"
+
+    con_saldo = sum(1 for b in balances.values() if b != 0)
+    print(f"Participantes:      {args.participantes} ({con_saldo} con saldo)")
+    print(f"Transferencias:     {len(transferencias)} (cota N-1 = {con_saldo - 1})")
+    print(f"Mediana:            {statistics.median(tiempos) * 1000:.2f} ms")
+    print(f"Mínimo / máximo:    {min(tiempos) * 1000:.2f} / {max(tiempos) * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark de memoria del manejo de audios y fotos por sesión concurrente.
+Uso: python -m benchmarks.bench_memoria --sesiones 8 --segundos 30
+
+Simula varias sesiones a la vez, cada una con una grabación y una foto de
+factura ya subidas (como las entrega Streamlit), y mide la memoria extra que usa
+el procesamiento hasta dejar el archivo guardado y la petición lista para OpenAI.
+Compara el manejo en memoria de antes (getvalue(), copias en la sesión, archivos
+leídos enteros) con el actual (lectura por bloques y solo referencias).
+
+Cada modo corre en un proceso aparte: tracemalloc mide lo que asigna Python y
+numpy; el pico de memoria del proceso (RSS) incluye además lo que decodifica Pillow.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+import wave
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from almacenamiento import TAMANO_BLOQUE, AlmacenamientoLocal
+from preprocesamiento import preparar_audio, preparar_imagen
+
+MODOS = ["anterior", "actual"]
+
+def generar_audio(segundos: float, frecuencia: int = 48000) -> bytes:
+    """WAV mono de 16 bits con voz simulada entre silencios, como los del navegador"""
+    rng = np.random.default_rng(1)
+    n = int(segundos * frecuencia)
+    senal = np.zeros(n, dtype=np.float32)
+    voz = slice(n // 10, n - n // 10)
+    senal[voz] = 0.3 * rng.standard_normal(voz.stop - voz.start).astype(np.float32)
+    salida = BytesIO()
+    with wave.open(salida, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(frecuencia)
+        wav.writeframes((senal * 32767).astype("<i2").tobytes())
+    return salida.getvalue()
+
+def generar_foto(ancho: int = 4000, alto: int = 3000, semilla: int = 2) -> bytes:
+    """JPEG del tamaño de una foto de celular, con textura para que no se comprima de más"""
+    rng = np.random.default_rng(semilla)
+    base = rng.integers(0, 255, (alto // 8, ancho // 8, 3), dtype=np.uint8)
+    imagen = Image.fromarray(base).resize((ancho, alto), Image.BILINEAR)
+    salida = BytesIO()
+    imagen.save(salida, format="JPEG", quality=90)
+    return salida.getvalue()
+
+def hash_por_bloques(archivo: BytesIO) -> str:
+    """Igual que app.hash_subida (no se importa app porque requiere Streamlit)"""
+    archivo.seek(0)
+    h = hashlib.sha256()
+    for bloque in iter(lambda: archivo.read(TAMANO_BLOQUE), b""):
+        h.update(bloque)
+    return h.hexdigest()
+
+def sesion_anterior(audio: BytesIO, foto: BytesIO, almacenamiento, sesion: dict):
+    """Como antes: getvalue(), contenidos copiados a la sesión y la foto leída entera para el base64"""
+    audio_bytes = audio.getvalue()
+    sesion['audio_hash'] = hashlib.sha256(audio_bytes).hexdigest()
+    sesion['audio_temp'] = audio_bytes
+    audio_preparado, extension = preparar_audio(audio_bytes)
+    sesion['audio_path'] = almacenamiento.guardar(audio_preparado, extension)
+
+    foto_bytes = foto.getvalue()
+    sesion['foto_hash'] = hashlib.sha256(foto_bytes).hexdigest()
+    sesion['foto_temp'] = foto_bytes
+    sesion['foto_path'] = almacenamiento.guardar(foto_bytes, "jpg")
+    peticion = base64.b64encode(preparar_imagen(almacenamiento.leer(sesion['foto_path']))).decode('utf-8')
+    sesion['peticion_bytes'] = len(peticion)
+
+def sesion_actual(audio: BytesIO, foto: BytesIO, almacenamiento, sesion: dict):
+    """Como ahora la app y la cola de trabajos: archivos leídos por bloques y solo referencias en la sesión"""
+    sesion['audio_hash'] = hash_por_bloques(audio)
+    audio_preparado, extension = preparar_audio(audio)
+    sesion['audio_path'] = almacenamiento.guardar(audio_preparado, extension)
+
+    sesion['foto_hash'] = hash_por_bloques(foto)
+    foto.seek(0)
+    sesion['foto_path'] = almacenamiento.guardar_archivo(foto, "jpg")
+    with open(sesion['foto_path'], "rb") as f:
+        peticion = base64.b64encode(preparar_imagen(f)).decode('utf-8')
+    # La petición se envía y se descarta; la sesión no la conserva
+    sesion['peticion_bytes'] = len(peticion)
+
+def medir(modo: str, sesiones: int, segundos: float) -> dict:
+    """Corre las sesiones en paralelo y retorna la memoria extra (en MB)"""
+    audio = generar_audio(segundos)
+    foto = generar_foto()
+    # Lo que Streamlit ya tiene en memoria por cada subida: no cuenta como gasto del procesamiento
+    subidas = [(BytesIO(audio), BytesIO(foto)) for _ in range(sesiones)]
+    almacenamiento = AlmacenamientoLocal(tempfile.mkdtemp())
+    procesar = sesion_anterior if modo == "anterior" else sesion_actual
+    estados = [{} for _ in range(sesiones)]
+    # Todas las sesiones terminan a la vez, así su estado coincide en memoria
+    barrera = threading.Barrier(sesiones)
+
+    def correr(i):
+        procesar(subidas[i][0], subidas[i][1], almacenamiento, estados[i])
+        barrera.wait()
+
+    rss_inicial = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    hilos = [threading.Thread(target=correr, args=(i,)) for i in range(sesiones)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    _, pico = tracemalloc.get_traced_memory()
+    retenido = sum(len(v) for e in estados for v in e.values() if isinstance(v, (bytes, str)))
+    tracemalloc.stop()
+    rss_final = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {
+        "modo": modo,
+        "sesiones": sesiones,
+        "audio_mb": len(audio) / 1e6,
+        "foto_mb": len(foto) / 1e6,
+        "pico_python_mb": pico / 1e6,
+        "pico_rss_mb": (rss_final - rss_inicial) / 1e3,  # ru_maxrss está en KB en Linux
+        "retenido_sesion_mb": retenido / 1e6,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sesiones", type=int, default=8)
+    parser.add_argument("--segundos", type=float, default=30, help="Duración de cada grabación")
+    parser.add_argument("--modo", choices=MODOS, help="Correr solo un modo en este proceso (uso interno)")
+    args = parser.parse_args()
+
+    if args.modo:
+        print(json.dumps(medir(args.modo, args.sesiones, args.segundos)))
+        return
+
+    resultados = []
+    for modo in MODOS:
+        proceso = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_memoria", "--modo", modo,
+             "--sesiones", str(args.sesiones), "--segundos", str(args.segundos)],
+            capture_output=True, text=True, check=True
+        )
+        resultados.append(json.loads(proceso.stdout.strip().splitlines()[-1]))
+
+    r = resultados[0]
+    print(f"Sesiones concurrentes: {r['sesiones']} (audio de {r['audio_mb']:.1f} MB, foto de {r['foto_mb']:.1f} MB)")
+    print(f"{'Modo':<10} {'Python/sesión':>14} {'RSS/sesión':>12} {'En la sesión':>13}")
+    for r in resultados:
+        print(f"{r['modo']:<10} {r['pico_python_mb'] / r['sesiones']:>11.1f} MB "
+              f"{r['pico_rss_mb'] / r['sesiones']:>9.1f} MB {r['retenido_sesion_mb'] / r['sesiones']:>10.2f} MB")
+
+if __name__ == "__main__":
+    main()
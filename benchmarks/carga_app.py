@@ -0,0 +1,390 @@
+"""
+Prueba de carga de la app de Streamlit con muchas sesiones simultáneas, sin navegador.
+Uso: python -m benchmarks.carga_app --sesiones 20 --iteraciones 5 --salida carga.json
+
+Cada sesión es un AppTest de Streamlit que ejecuta app.py en este mismo proceso
+(igual que `streamlit run`, que atiende todas las sesiones con un solo intérprete):
+entra con su usuario, selecciona un paseo y repite: tomar una foto de factura
+(que pasa por el almacenamiento, la cola de trabajos y OpenAI), esperar a que su
+resultado llegue al formulario, guardar el gasto, abrir Resumen (que regenera el
+análisis, porque el gasto cambió el paseo) y abrir Deudas. La IA la responde
+benchmarks.openai_falso con una latencia fija, y la base, los archivos y el cache
+de IA viven en un directorio temporal con datos de benchmarks.datos_sinteticos.
+
+Reporta percentiles de latencia por paso (cada paso es un rerun completo del
+script, salvo esperar_foto: desde que se sube la foto hasta que el formulario
+muestra su valor), reruns por segundo y la memoria que agrega cada sesión. No
+incluye el costo del websocket ni del navegador: mide lo que hace el servidor por
+sesión. Las grabaciones de audio no se simulan: usan la misma cola y el mismo
+almacenamiento que las fotos y solo cambian el preprocesamiento y Whisper.
+
+Sale con código 1 si una sesión falla, si Resumen no muestra el análisis del
+servidor falso, si los helpers de OpenAI imprimen errores (los atrapan y no los
+lanzan) o si no llegó ninguna petición al servidor falso.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path:
+    sys.path.insert(0, RAIZ)
+
+from benchmarks.bench_database import commit_actual, percentil
+from benchmarks.bench_memoria import generar_foto
+from benchmarks.datos_sinteticos import generar_datos
+from benchmarks.openai_falso import GASTO_JSON, ManejadorOpenAI, iniciar_servidor
+from database import Database
+
+# Pasos de cada sesión, en el orden en que se ejecutan
+PASO_INICIO = "inicio"
+PASO_LOGIN = "login"
+PASO_PASEO = "seleccionar_paseo"
+PASO_GASTOS = "gastos"
+PASO_FOTO = "subir_foto"
+PASO_ESPERA_FOTO = "esperar_foto"
+PASO_GUARDAR = "guardar_gasto"
+PASO_RESUMEN = "resumen"
+PASO_DEUDAS = "deudas"
+PASOS = [PASO_INICIO, PASO_LOGIN, PASO_PASEO, PASO_GASTOS, PASO_FOTO, PASO_ESPERA_FOTO,
+         PASO_GUARDAR, PASO_RESUMEN, PASO_DEUDAS]
+
+SECCION_GASTOS = "💳 Gastos"
+SECCION_RESUMEN = "📊 Resumen"
+SECCION_DEUDAS = "💸 Deudas"
+TIPO_FOTO = "📸 Foto"
+
+# Texto del análisis del servidor falso que Resumen debe mostrar
+MARCA_ANALISIS = "Respuesta de prueba del servidor falso"
+# Cada cuánto se vuelve a ejecutar el script mientras se procesa la foto (como el fragmento de la app)
+ESPERA_ENTRE_RERUNS = 0.1
+
+class SalidaVigilada(io.TextIOBase):
+    """
+    Reenvía la salida estándar y guarda las líneas de error que imprimen los helpers
+    de OpenAI ("Error generando análisis: ..."), que atrapan las excepciones.
+    """
+
+    def __init__(self, destino):
+        self.destino = destino
+        self.errores = Counter()
+        self._candado = threading.Lock()
+
+    def write(self, texto: str) -> int:
+        with self._candado:
+            self.errores.update(linea for linea in texto.splitlines() if linea.startswith("Error"))
+        return self.destino.write(texto)
+
+    def flush(self):
+        self.destino.flush()
+
+def rss_mb() -> float:
+    """Memoria residente actual del proceso en MB (en Linux; en otros sistemas, el pico)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss viene en KB en Linux y en bytes en macOS
+        return pico / 2**20 if sys.platform == "darwin" else pico / 1024
+
+def compartir_runtime():
+    """
+    Hace que todas las sesiones compartan un Runtime simulado y el bytecode de app.py,
+    como en el servidor. AppTest crea ambos en cada run y borra el Runtime al terminar
+    (Runtime._instance es global), así que dos sesiones ejecutándose a la vez se lo
+    quitarían una a la otra, y cada rerun volvería a compilar el script.
+    """
+    from unittest.mock import MagicMock
+
+    from streamlit import config
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test, local_script_runner
+
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    script_cache = ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: script_cache
+    # AppTest lo activa y lo restaura en cada run; fijo evita que una sesión se lo quite a otra
+    config.set_option("global.appTest", True)
+
+class Sesion:
+    """Una sesión simulada: un AppTest con su propio session_state"""
+
+    def __init__(self, app_path: str, username: str, paseo_id: int, timeout: float,
+                 fotos: bool = True, semilla: int = 0):
+        from streamlit.testing.v1 import AppTest
+
+        self.app = AppTest.from_file(app_path, default_timeout=timeout)
+        self.username = username
+        self.paseo_id = paseo_id
+        self.timeout = timeout
+        self.fotos = fotos
+        self.semilla = semilla
+        self.tiempos: Dict[str, List[float]] = {paso: [] for paso in PASOS}
+        self.errores: List[str] = []
+
+    def _rerun(self, paso: str, accion=None, medir: bool = True):
+        """Aplica la acción sobre los widgets y ejecuta el script, midiendo el rerun completo"""
+        if self.errores:
+            # Tras un error la sesión queda en un estado desconocido: no se sigue
+            return
+        inicio = time.perf_counter()
+        try:
+            if accion:
+                accion(self.app)
+            self.app.run()
+        except Exception:
+            self.errores.append(f"{paso}: {traceback.format_exc(limit=3)}")
+            return
+        if medir:
+            self.tiempos[paso].append((time.perf_counter() - inicio) * 1000)
+        if self.app.exception:
+            self.errores.append(f"{paso}: {self.app.exception[0].message}")
+
+    def _valor_formulario(self) -> float:
+        return next(n for n in self.app.number_input if n.label == "💵 Valor (COP)").value
+
+    def subir_foto(self, numero: int):
+        """Toma una foto de factura distinta en cada iteración y espera a que su resultado llegue al formulario"""
+        tipo = next(s for s in self.app.selectbox if s.label == "📎 Tipo")
+        if tipo.value != TIPO_FOTO:
+            self._rerun(PASO_GASTOS, lambda app: tipo.select(TIPO_FOTO))
+        if self.errores:
+            return
+
+        # Contenido distinto por sesión e iteración: ni el almacenamiento ni el cache de IA lo reutilizan
+        foto = generar_foto(1600, 1200, semilla=self.semilla * 10000 + numero)
+        inicio = time.perf_counter()
+        self._rerun(PASO_FOTO, lambda app: app.camera_input(key="camera_factura").upload("factura.jpg", foto))
+        limite = time.monotonic() + self.timeout
+        while not self.errores:
+            borrador = self.app.session_state["trabajo_borrador"] if "trabajo_borrador" in self.app.session_state else None
+            if borrador and borrador['aplicado']:
+                break
+            if time.monotonic() > limite:
+                self.errores.append(f"{PASO_ESPERA_FOTO}: la foto no se procesó en {self.timeout:.0f} s")
+                return
+            time.sleep(ESPERA_ENTRE_RERUNS)
+            self._rerun(PASO_ESPERA_FOTO, medir=False)
+        if self.errores:
+            return
+        self.tiempos[PASO_ESPERA_FOTO].append((time.perf_counter() - inicio) * 1000)
+        if self._valor_formulario() != GASTO_JSON['valor']:
+            self.errores.append(f"{PASO_ESPERA_FOTO}: el formulario muestra {self._valor_formulario():.0f} "
+                                f"en vez del valor de la factura ({GASTO_JSON['valor']})")
+
+    def entrar(self):
+        self._rerun(PASO_INICIO)
+
+        def login(app):
+            app.text_input(key="login_username").input(self.username)
+            app.text_input(key="login_password").input("bench")
+            app.button(key="btn_login").click()
+        self._rerun(PASO_LOGIN, login)
+
+        def seleccionar(app):
+            selector = app.selectbox(key="selector_paseo")
+            opcion = next(o for o in selector.options if o.endswith(f"(ID: {self.paseo_id})"))
+            selector.select(opcion)
+        self._rerun(PASO_PASEO, seleccionar)
+
+    def iteracion(self, numero: int):
+        if self.errores:
+            return
+        # El formulario solo existe en el árbol cuando la sección Gastos está activa
+        if self.app.session_state["seccion_paseo"] != SECCION_GASTOS:
+            self._rerun(PASO_GASTOS, lambda app: app.radio(key="seccion_paseo").set_value(SECCION_GASTOS))
+
+        if self.fotos:
+            self.subir_foto(numero)
+
+        def guardar(app):
+            app.text_input(key="concepto_input").input(f"Gasto de carga {numero}")
+            if not self.fotos:
+                next(n for n in app.number_input if n.label == "💵 Valor (COP)").set_value(25000 + numero * 1000)
+            app.button(key="btn_guardar_gasto").click()
+        self._rerun(PASO_GUARDAR, guardar)
+        self._rerun(PASO_RESUMEN, lambda app: app.radio(key="seccion_paseo").set_value(SECCION_RESUMEN))
+        # El gasto recién guardado cambió el paseo: el análisis se generó de nuevo (o lo generó otra sesión)
+        if not self.errores and not any(MARCA_ANALISIS in m.value for m in self.app.markdown):
+            self.errores.append(f"{PASO_RESUMEN}: no se mostró el análisis de la IA")
+        self._rerun(PASO_DEUDAS, lambda app: app.radio(key="seccion_paseo").set_value(SECCION_DEUDAS))
+
+    def ejecutar(self, iteraciones: int, barrera: threading.Barrier = None):
+        if barrera:
+            barrera.wait()
+        self.entrar()
+        for i in range(iteraciones):
+            self.iteracion(i)
+
+def resumen_tiempos(tiempos: List[float]) -> Dict:
+    if not tiempos:
+        return {"reruns": 0}
+    return {
+        "reruns": len(tiempos),
+        "p50_ms": percentil(tiempos, 50),
+        "p90_ms": percentil(tiempos, 90),
+        "p99_ms": percentil(tiempos, 99),
+        "media_ms": statistics.fmean(tiempos),
+        "max_ms": max(tiempos),
+    }
+
+def ejecutar(args) -> Dict:
+    """Prepara el entorno, corre una sesión de calentamiento y luego todas las sesiones a la vez"""
+    commit = commit_actual()
+    directorio = tempfile.mkdtemp(prefix="paseos_carga_")
+    servidor = iniciar_servidor(0, args.latencia_ia_ms / 1000)
+    # app.py usa rutas relativas (paseos.db, uploads/, cache_ia.db, exportaciones/)
+    os.chdir(directorio)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{servidor.server_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "falsa"
+
+    db = Database("paseos.db")
+    creados = generar_datos(db, args.usuarios, args.paseos, args.participantes, args.gastos, semilla=args.semilla)
+    db.close()
+    # Cada sesión entra con un participante distinto (rotando) de un paseo distinto
+    casos = []
+    paseos = list(creados['paseos'].items())
+    for i in range(args.sesiones + 1):
+        paseo_id, miembros = paseos[i % len(paseos)]
+        usuario_id = miembros[(i // len(paseos)) % len(miembros)]
+        casos.append((f"bench_{args.semilla}_{creados['usuarios'].index(usuario_id)}", paseo_id))
+
+    app_path = os.path.join(RAIZ, "app.py")
+    compartir_runtime()
+    salida = SalidaVigilada(sys.stdout)
+    sys.stdout = salida
+    # Calentamiento: importa app.py y crea los recursos compartidos (base, cola, almacenamiento)
+    calentamiento = Sesion(app_path, *casos[-1], args.timeout, fotos=args.fotos, semilla=args.sesiones)
+    calentamiento.ejecutar(1)
+    if calentamiento.errores or salida.errores:
+        sys.stdout = salida.destino
+        raise RuntimeError("La sesión de calentamiento falló:\n" + "\n".join(calentamiento.errores + list(salida.errores)))
+    del calentamiento
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_inicial = rss_mb()
+    sesiones = [Sesion(app_path, *casos[i], args.timeout, fotos=args.fotos, semilla=i) for i in range(args.sesiones)]
+    barrera = threading.Barrier(args.sesiones)
+    hilos = [threading.Thread(target=s.ejecutar, args=(args.iteraciones, barrera), name=f"sesion-{i}")
+             for i, s in enumerate(sesiones)]
+    peticiones_ia = ManejadorOpenAI.peticiones
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    # Las sesiones siguen vivas (como en el servidor mientras el teléfono está conectado)
+    memoria = {"rss_inicial_mb": rss_inicial, "rss_final_mb": rss_mb(),
+               "rss_por_sesion_mb": (rss_mb() - rss_inicial) / args.sesiones}
+    if args.tracemalloc:
+        actual, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memoria["python_por_sesion_mb"] = actual / 2**20 / args.sesiones
+        memoria["python_pico_mb"] = pico / 2**20
+
+    sys.stdout = salida.destino
+    # esperar_foto no es un rerun sino la espera completa de la foto
+    todos = [t for s in sesiones for paso in PASOS if paso != PASO_ESPERA_FOTO for t in s.tiempos[paso]]
+    errores = [e for s in sesiones for e in s.errores]
+    peticiones = ManejadorOpenAI.peticiones - peticiones_ia
+    if peticiones == 0 and any(s.tiempos[PASO_RESUMEN] for s in sesiones):
+        errores.append("Ninguna petición llegó al servidor falso de OpenAI aunque se guardaron gastos")
+    servidor.shutdown()
+    return {
+        "commit": commit,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": {
+            "sesiones": args.sesiones, "iteraciones": args.iteraciones, "usuarios": args.usuarios,
+            "paseos": args.paseos, "participantes": args.participantes, "gastos": args.gastos,
+            "latencia_ia_ms": args.latencia_ia_ms, "semilla": args.semilla, "fotos": args.fotos,
+        },
+        "duracion_s": duracion,
+        "reruns": len(todos),
+        "reruns_por_segundo": len(todos) / duracion,
+        "peticiones_ia": peticiones,
+        "errores_ia": dict(salida.errores),
+        "pasos": {paso: resumen_tiempos([t for s in sesiones for t in s.tiempos[paso]]) for paso in PASOS},
+        "total": resumen_tiempos(todos),
+        "memoria": memoria,
+        "errores": errores,
+    }
+
+def imprimir(reporte: Dict):
+    p = reporte['parametros']
+    print(f"Commit {reporte['commit'] or '-'} · {p['sesiones']} sesiones × {p['iteraciones']} iteraciones · "
+          f"{p['gastos']} gastos por paseo · IA {p['latencia_ia_ms']:.0f} ms")
+    print(f"{'Paso':<18} {'Reruns':>7} {'p50':>10} {'p90':>10} {'p99':>10}")
+    for paso, r in list(reporte['pasos'].items()) + [("total", reporte['total'])]:
+        if r['reruns']:
+            print(f"{paso:<18} {r['reruns']:>7} {r['p50_ms']:>8.0f}ms {r['p90_ms']:>8.0f}ms {r['p99_ms']:>8.0f}ms")
+    memoria = reporte['memoria']
+    print(f"{reporte['reruns_por_segundo']:.1f} reruns/s en {reporte['duracion_s']:.1f} s · "
+          f"{reporte['peticiones_ia']} peticiones a la IA")
+    linea = f"Memoria: {memoria['rss_por_sesion_mb']:.2f} MB de RSS por sesión"
+    if "python_por_sesion_mb" in memoria:
+        linea += f", {memoria['python_por_sesion_mb']:.2f} MB de objetos Python por sesión"
+    print(f"{linea} ({memoria['rss_inicial_mb']:.0f} → {memoria['rss_final_mb']:.0f} MB)")
+    for mensaje, veces in sorted(reporte['errores_ia'].items(), key=lambda e: -e[1]):
+        print(f"⚠ {veces} × {mensaje}")
+    if reporte['errores']:
+        print(f"⚠ {len(reporte['errores'])} errores; el primero:\n{reporte['errores'][0]}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sesiones", type=int, default=20, help="Sesiones simultáneas")
+    parser.add_argument("--iteraciones", type=int, default=5, help="Veces que cada sesión guarda y consulta")
+    parser.add_argument("--usuarios", type=int, default=50)
+    parser.add_argument("--paseos", type=int, default=5)
+    parser.add_argument("--participantes", type=int, default=8, help="Participantes por paseo")
+    parser.add_argument("--gastos", type=int, default=200, help="Gastos por paseo antes de la prueba")
+    parser.add_argument("--latencia-ia-ms", type=float, default=300, help="Latencia del servidor falso de OpenAI")
+    parser.add_argument("--sin-fotos", dest="fotos", action="store_false",
+                        help="Escribir los gastos a mano en vez de tomar una foto de factura en cada iteración")
+    parser.add_argument("--timeout", type=float, default=60, help="Tiempo máximo de cada rerun, en segundos")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Medir también los objetos Python por sesión (hace más lentos los reruns)")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", help="Guardar los resultados en este JSON")
+    args = parser.parse_args()
+    if args.salida:
+        args.salida = os.path.abspath(args.salida)
+
+    reporte = ejecutar(args)
+    imprimir(reporte)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, ensure_ascii=False, indent=2)
+        print(f"Resultados guardados en {args.salida}")
+    sys.exit(1 if reporte['errores'] or reporte['errores_ia'] else 0)
+
+if __name__ == "__main__":
+    main()
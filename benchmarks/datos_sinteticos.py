@@ -0,0 +1,130 @@
+"""
+Generador de datos sintéticos para los benchmarks de la base de datos.
+Uso: python -m benchmarks.datos_sinteticos --db paseos_bench.db --paseos 20 --gastos 5000
+
+Crea usuarios, paseos con sus participantes y gastos con divisiones. Los valores
+siguen distribuciones log-normales por categoría en pesos colombianos (un café
+ronda los $12.000, una noche de hotel los $350.000) y se redondean como se pagan
+en la práctica. Los gastos se insertan en una sola transacción por paseo, con la
+misma conversión a pesos y el mismo reparto de crear_gasto_con_divisiones.
+"""
+import argparse
+import math
+import random
+from datetime import datetime, timedelta
+from typing import Dict
+
+from database import Database
+from liquidacion import a_pesos, repartir_monto
+
+# Categoría (como las crea crear_paseo): (conceptos, mediana en pesos, redondeo, peso relativo)
+PERFILES = {
+    "🍽️ Restaurante": (["Almuerzo en Crepes", "Cena en Andrés Carne de Res", "Bandeja paisa", "Almuerzo corrientazo"], 45000, 1000, 25),
+    "☕ Cafetería": (["Café en Juan Valdez", "Tinto y pandebono", "Desayuno en Oma"], 12000, 500, 12),
+    "🚗 Transporte": (["Uber al aeropuerto", "Taxi al hotel", "Peajes", "Bus intermunicipal"], 25000, 1000, 15),
+    "🏨 Hospedaje": (["Hotel en Cartagena", "Finca en Guatapé", "Hostal en Salento"], 350000, 10000, 4),
+    "🎫 Entradas": (["Tour a Guatapé", "Entrada al parque", "Lancha a Barú"], 60000, 5000, 6),
+    "🛒 Supermercado": (["Mercado en el Éxito", "D1", "Tienda de la esquina"], 120000, 100, 10),
+    "⛽ Gasolina": (["Gasolina", "Tanqueada"], 90000, 1000, 6),
+    "🎉 Entretenimiento": (["Cervezas en la playa", "Discoteca", "Karaoke"], 80000, 5000, 10),
+    "💊 Farmacia": (["Droguería", "Bloqueador solar"], 30000, 100, 3),
+    "📦 Otros": (["Propina del guía", "Hielo", "Parqueadero"], 15000, 1000, 9),
+}
+
+# Dispersión de la log-normal: con 0.6 el 90% de los valores queda entre ~0.4x y ~2.7x la mediana
+DISPERSION = 0.6
+
+# Cómo se dividen los gastos: (entre todos, entre algunos, solo quien pagó)
+REPARTO = (0.7, 0.25, 0.05)
+
+# Gastos sin categoría (la app los crea así desde el formulario)
+SIN_CATEGORIA = 0.2
+
+NOMBRES = ["Ana", "Carlos", "Valentina", "Andrés", "Camila", "Juan", "Laura", "Santiago", "Daniela",
+           "Felipe", "Mariana", "Sebastián", "Natalia", "Mateo", "Paula", "Julián", "Sara", "Diego"]
+
+def valor_aleatorio(rng: random.Random, mediana: int, redondeo: int) -> int:
+    """Un valor en pesos con distribución log-normal, redondeado (mínimo un redondeo)"""
+    valor = rng.lognormvariate(math.log(mediana), DISPERSION)
+    return max(redondeo, int(round(valor / redondeo)) * redondeo)
+
+def generar_datos(db: Database, usuarios: int = 50, paseos: int = 10, participantes: int = 8,
+                  gastos_por_paseo: int = 1000, dias: int = 7, semilla: int = 42) -> Dict:
+    """
+    Llena la base con datos sintéticos y retorna lo creado:
+    {'usuarios': [ids], 'paseos': {paseo_id: [ids de participantes]}, 'gastos': total, 'divisiones': total}
+    """
+    rng = random.Random(semilla)
+    participantes = min(participantes, usuarios)
+
+    usuario_ids = []
+    for i in range(usuarios):
+        username = f"bench_{semilla}_{i}"
+        db.crear_usuario(username, "bench", f"{NOMBRES[i % len(NOMBRES)]} {i}")
+        usuario_ids.append(db.buscar_usuario_por_username(username)['id'])
+
+    categorias = list(PERFILES)
+    pesos_categorias = [PERFILES[c][3] for c in categorias]
+    creados = {'usuarios': usuario_ids, 'paseos': {}, 'gastos': 0, 'divisiones': 0}
+    for p in range(paseos):
+        miembros = rng.sample(usuario_ids, participantes)
+        paseo_id = db.crear_paseo(f"Paseo sintético {p + 1}", "Generado para benchmarks", miembros[0])
+        for usuario_id in miembros[1:]:
+            db.agregar_participante(paseo_id, usuario_id)
+        categoria_ids = {c['nombre']: c['id'] for c in db.get_categorias_paseo(paseo_id)}
+        inicio = datetime(2024, 1, 1) + timedelta(days=rng.randrange(365))
+
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            for _ in range(gastos_por_paseo):
+                categoria = rng.choices(categorias, pesos_categorias)[0]
+                conceptos, mediana, redondeo, _ = PERFILES[categoria]
+                pagador = rng.choice(miembros)
+                valor = a_pesos(valor_aleatorio(rng, mediana, redondeo))
+                fecha = inicio + timedelta(seconds=rng.randrange(dias * 24 * 3600))
+                categoria_id = None if rng.random() < SIN_CATEGORIA else categoria_ids.get(categoria)
+
+                reparto = rng.choices(["todos", "algunos", "solo"], REPARTO)[0]
+                if reparto == "todos" or len(miembros) < 3:
+                    deudores = miembros
+                elif reparto == "algunos":
+                    deudores = rng.sample(miembros, rng.randint(2, len(miembros) - 1))
+                else:
+                    deudores = [pagador]
+                porcentajes = [100 / len(deudores)] * len(deudores)
+                montos = repartir_monto(valor, porcentajes)
+
+                cursor.execute("""
+                    INSERT INTO gastos (paseo_id, usuario_id, categoria_id, concepto, valor, fecha)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, (paseo_id, pagador, categoria_id, rng.choice(conceptos), valor, fecha))
+                gasto_id = cursor.lastrowid
+                cursor.executemany("""
+                    INSERT INTO gasto_divisiones (gasto_id, usuario_id, porcentaje, monto)
+                    VALUES (?, ?, ?, ?)
+                """, [(gasto_id, u, pct, monto) for u, pct, monto in zip(deudores, porcentajes, montos)])
+                creados['divisiones'] += len(deudores)
+            conn.commit()
+        creados['gastos'] += gastos_por_paseo
+        creados['paseos'][paseo_id] = miembros
+        db.cache.invalidar(('paseo', paseo_id))
+    return creados
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="paseos_bench.db", help="Base a llenar (se crea si no existe)")
+    parser.add_argument("--usuarios", type=int, default=50)
+    parser.add_argument("--paseos", type=int, default=10)
+    parser.add_argument("--participantes", type=int, default=8, help="Participantes por paseo")
+    parser.add_argument("--gastos", type=int, default=1000, help="Gastos por paseo")
+    parser.add_argument("--dias", type=int, default=7, help="Duración de cada paseo")
+    parser.add_argument("--semilla", type=int, default=42)
+    args = parser.parse_args()
+
+    creados = generar_datos(Database(args.db), args.usuarios, args.paseos, args.participantes,
+                            args.gastos, args.dias, args.semilla)
+    print(f"{len(creados['usuarios'])} usuarios, {len(creados['paseos'])} paseos, "
+          f"{creados['gastos']} gastos y {creados['divisiones']} divisiones en {args.db}")
+
+if __name__ == "__main__":
+    main()
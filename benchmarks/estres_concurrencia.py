@@ -0,0 +1,127 @@
+"""
+Prueba de estrés de escrituras y lecturas concurrentes sobre la misma base SQLite.
+Uso: python -m benchmarks.estres_concurrencia --escritores 8 --lectores 8 --segundos 10
+
+Varios hilos guardan gastos con crear_gasto_con_divisiones mientras otros leen
+gastos y saldos del mismo paseo. Con --instancias mayor a 1 los hilos se reparten
+entre varias instancias de Database sobre el mismo archivo (cada una con su pool),
+como varios procesos de la app. Las lecturas no pasan por el cache de consultas.
+
+Sale con código 1 si alguna operación terminó en "database is locked" (o en un
+pool agotado), o si al final los saldos no cuadran con los gastos.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from database import Database, StorageProfile
+
+def es_error_de_bloqueo(error: Exception) -> bool:
+    """"database is locked" (o busy) que llegó hasta el llamador, o el pool agotado esperando conexión"""
+    mensaje = str(error).lower()
+    return isinstance(error, TimeoutError) or (
+        isinstance(error, sqlite3.OperationalError) and ("locked" in mensaje or "busy" in mensaje))
+
+def ejecutar(args) -> int:
+    """Corre los hilos durante el tiempo pedido, imprime el resumen y retorna el código de salida"""
+    ruta = args.db or os.path.join(tempfile.mkdtemp(prefix="paseos_estres_"), "paseos.db")
+    perfil = StorageProfile(busy_timeout_ms=args.busy_timeout_ms, max_retries=args.reintentos)
+    # cache_size=0: cada lectura va a SQLite
+    bases = [Database(ruta, pool_size=args.pool, profile=perfil, cache_size=0) for _ in range(args.instancias)]
+    db = bases[0]
+
+    usuario_ids = []
+    for i in range(args.participantes):
+        username = f"estres_{os.getpid()}_{i}"
+        db.crear_usuario(username, "estres", f"Estrés {i}")
+        usuario_ids.append(db.buscar_usuario_por_username(username)['id'])
+    paseo_id = db.crear_paseo("Paseo de estrés", "Escrituras y lecturas concurrentes", usuario_ids[0])
+    for usuario_id in usuario_ids[1:]:
+        db.agregar_participante(paseo_id, usuario_id)
+    divisiones = [{'usuario_id': u, 'porcentaje': 100 / len(usuario_ids)} for u in usuario_ids]
+
+    fin = time.monotonic() + args.segundos
+    conteo = Counter()
+    errores = Counter()
+    bloqueos = Counter()
+    candado = threading.Lock()
+
+    def escritor(indice: int):
+        base = bases[indice % len(bases)]
+        rng = random.Random(indice)
+        while time.monotonic() < fin:
+            try:
+                base.crear_gasto_con_divisiones(paseo_id, rng.choice(usuario_ids), f"Gasto {indice}",
+                                                rng.randrange(1000, 200000, 100), datetime.now(), divisiones)
+                clave, es_error, bloqueo = "escrituras", False, False
+            except Exception as e:
+                clave, es_error, bloqueo = f"{type(e).__name__}: {e}", True, es_error_de_bloqueo(e)
+            with candado:
+                (errores if es_error else conteo)[clave] += 1
+                if bloqueo:
+                    bloqueos[clave] += 1
+
+    def lector(indice: int):
+        base = bases[indice % len(bases)]
+        while time.monotonic() < fin:
+            try:
+                base.get_gastos_paseo_pagina(paseo_id, limite=20)
+                base.get_resumenes_paseo(paseo_id)
+                base.calcular_transferencias_paseo(paseo_id)
+                clave, es_error, bloqueo = "lecturas", False, False
+            except Exception as e:
+                clave, es_error, bloqueo = f"{type(e).__name__}: {e}", True, es_error_de_bloqueo(e)
+            with candado:
+                (errores if es_error else conteo)[clave] += 1
+                if bloqueo:
+                    bloqueos[clave] += 1
+
+    hilos = [threading.Thread(target=escritor, args=(i,)) for i in range(args.escritores)]
+    hilos += [threading.Thread(target=lector, args=(i,)) for i in range(args.lectores)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    diferencias = db.verificar_saldos(paseo_id)
+    for base in bases:
+        base.close()
+
+    print(f"{args.escritores} escritores y {args.lectores} lectores en {args.instancias} instancia(s), "
+          f"{duracion:.1f} s sobre {ruta}")
+    print(f"{conteo['escrituras']} escrituras ({conteo['escrituras'] / duracion:.0f}/s), "
+          f"{conteo['lecturas']} lecturas ({conteo['lecturas'] / duracion:.0f}/s)")
+    for mensaje, veces in errores.most_common():
+        print(f"⚠ {veces} × {mensaje}")
+    if diferencias:
+        print(f"⚠ {len(diferencias)} saldo(s) no cuadran con los gastos")
+
+    return 1 if bloqueos or diferencias else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--escritores", type=int, default=8)
+    parser.add_argument("--lectores", type=int, default=8)
+    parser.add_argument("--instancias", type=int, default=2, help="Instancias de Database sobre el mismo archivo")
+    parser.add_argument("--pool", type=int, default=5, help="Conexiones por instancia")
+    parser.add_argument("--participantes", type=int, default=6)
+    parser.add_argument("--segundos", type=float, default=10)
+    parser.add_argument("--busy-timeout-ms", type=int, default=StorageProfile.busy_timeout_ms,
+                        help="Espera de SQLite por el candado (bajarla muestra cuándo aparecen los bloqueos)")
+    parser.add_argument("--reintentos", type=int, default=StorageProfile.max_retries,
+                        help="Reintentos de las escrituras bloqueadas")
+    parser.add_argument("--db", help="Base a usar (por defecto una temporal)")
+    args = parser.parse_args()
+    sys.exit(ejecutar(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Servidor local que imita la API de OpenAI, para pruebas de carga sin costo.
+Uso: python -m benchmarks.openai_falso --puerto 8765 --latencia-ms 800
+     OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=falsa streamlit run app.py
+
+Responde chat/completions (con y sin streaming) y audio/transcriptions con
+respuestas fijas y una latencia configurable: las extracciones (de frases y de
+fotos de facturas) reciben un JSON de gasto y el resto un análisis en Markdown
+que se entrega por partes.
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRANSCRIPCION = "Almuerzo en la playa cuarenta mil"
+GASTO_JSON = {"concepto": "Almuerzo en la playa", "valor": 40000, "categoria": None}
+ANALISIS = """## 📊 Resumen del Paseo
+
+**Total gastado:** según los datos enviados
+
+## 🏪 Gastos por Concepto/Lugar
+- Respuesta de prueba del servidor falso
+
+## 💰 Lo que debe cada persona
+- Cada quien paga su parte
+
+## 💡 Recomendación de pago
+- Usar las transferencias mínimas calculadas"""
+
+# Cuántas partes tiene la respuesta en streaming
+PARTES_STREAMING = 20
+
+class ManejadorOpenAI(BaseHTTPRequestHandler):
+    # Latencia total de cada respuesta (en streaming se reparte entre las partes)
+    latencia = 0.0
+    peticiones = 0
+    _candado = threading.Lock()
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, cuerpo: dict):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _completion(self, peticion: dict):
+        # La extracción de texto pide JSON en el mensaje de sistema y la de facturas en la parte
+        # de texto que acompaña la imagen; el análisis no lo pide
+        mensajes = peticion.get("messages", [])
+        sistema = " ".join(m.get("content", "") for m in mensajes if m.get("role") == "system"
+                           and isinstance(m.get("content"), str))
+        partes_usuario = " ".join(p.get("text", "") for m in mensajes if isinstance(m.get("content"), list)
+                                  for p in m["content"] if p.get("type") == "text")
+        es_extraccion = "JSON" in sistema or "JSON" in partes_usuario or peticion.get("response_format")
+        texto = json.dumps(GASTO_JSON) if es_extraccion else ANALISIS
+        modelo = peticion.get("model", "gpt-4o-mini")
+
+        if not peticion.get("stream"):
+            time.sleep(self.latencia)
+            self._json({
+                "id": "chatcmpl-falso", "object": "chat.completion", "created": int(time.time()), "model": modelo,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": texto}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        tamano = max(1, len(texto) // PARTES_STREAMING)
+        partes = [texto[i:i + tamano] for i in range(0, len(texto), tamano)]
+        for i, parte in enumerate(partes + [None]):
+            time.sleep(self.latencia / (len(partes) + 1))
+            delta = {"content": parte} if parte is not None else {}
+            if i == 0:
+                delta["role"] = "assistant"
+            evento = {
+                "id": "chatcmpl-falso", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": modelo,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if parte is not None else "stop"}],
+            }
+            self.wfile.write(f"data: {json.dumps(evento)}\n\n".encode())
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+    def do_POST(self):
+        with self._candado:
+            ManejadorOpenAI.peticiones += 1
+        cuerpo = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.endswith("/chat/completions"):
+            self._completion(json.loads(cuerpo or b"{}"))
+        elif self.path.endswith("/audio/transcriptions"):
+            time.sleep(self.latencia)
+            self._json({"text": TRANSCRIPCION})
+        else:
+            self.send_error(404)
+
+def iniciar_servidor(puerto: int = 0, latencia: float = 0.0) -> ThreadingHTTPServer:
+    """Inicia el servidor en un hilo; con puerto 0 se elige uno libre (ver servidor.server_port)"""
+    ManejadorOpenAI.latencia = latencia
+    servidor = ThreadingHTTPServer(("127.0.0.1", puerto), ManejadorOpenAI)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True, name="openai-falso").start()
+    return servidor
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia-ms", type=float, default=500, help="Latencia de cada respuesta")
+    args = parser.parse_args()
+
+    servidor = iniciar_servidor(args.puerto, args.latencia_ms / 1000)
+    print(f"OPENAI_BASE_URL=http://127.0.0.1:{servidor.server_port}/v1 (Ctrl+C para terminar)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Verifica con EXPLAIN QUERY PLAN que las consultas más usadas de Database usan índices.
+Uso: python -m benchmarks.planes_consultas
+     python -m benchmarks.planes_consultas --db paseos.db --paseo 3
+
+Ejecuta los escenarios de benchmarks.bench_database (get_gastos_paseo,
+calcular_deudas_paseo, get_resumen_usuario_paseo y get_gastos_por_categoria),
+captura el SQL que realmente corren y revisa su plan: cada tabla debe leerse con
+SEARCH ... USING (COVERING) INDEX o por clave primaria, nunca con SCAN. Sale con
+código 1 si alguna no cumple. Al final lista los índices que ninguna de estas
+consultas usó, como pista de índices que sobran.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+from typing import Dict, List, Set
+
+from benchmarks.bench_database import ESCENARIOS
+from benchmarks.datos_sinteticos import generar_datos
+from database import Database
+
+# Acceso aceptado a una tabla: búsqueda por índice (cubriente o no) o por clave primaria
+ACCESO_CON_INDICE = re.compile(r"^SEARCH \w+ USING (COVERING INDEX|INDEX|PRIMARY KEY|INTEGER PRIMARY KEY)")
+INDICE_USADO = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+def capturar_sql(db: Database, escenario, paseo_id: int, usuario_id: int) -> List[str]:
+    """Ejecuta un escenario y retorna las consultas SELECT que corrió, con los parámetros ya expandidos"""
+    sentencias = []
+    # El pool es reentrante: el método usa la misma conexión que se prestó aquí
+    with db.connection() as conn:
+        conn.set_trace_callback(sentencias.append)
+        try:
+            escenario(db, paseo_id, usuario_id)
+        finally:
+            conn.set_trace_callback(None)
+    return [s for s in sentencias if s.lstrip().upper().startswith(("SELECT", "WITH"))]
+
+def plan(db: Database, sql: str) -> List[str]:
+    with db.connection() as conn:
+        return [row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+def verificar(db: Database, paseo_id: int, usuario_id: int) -> Dict[str, Dict]:
+    """Plan de cada escenario: {'consultas': [(sql, [detalle])], 'problemas': [detalle]}"""
+    resultados = {}
+    for nombre, escenario in ESCENARIOS.items():
+        consultas = [(sql, plan(db, sql)) for sql in capturar_sql(db, escenario, paseo_id, usuario_id)]
+        problemas = [detalle for _, detalles in consultas for detalle in detalles
+                     if detalle.startswith(("SCAN", "SEARCH")) and not ACCESO_CON_INDICE.match(detalle)
+                     and detalle != "SCAN CONSTANT ROW"]
+        if not consultas:
+            problemas.append("No se ejecutó ninguna consulta (¿respuesta desde el cache?)")
+        resultados[nombre] = {'consultas': consultas, 'problemas': problemas}
+    return resultados
+
+def indices_sin_usar(db: Database, resultados: Dict[str, Dict]) -> Set[str]:
+    """Índices creados por las migraciones que ningún plan verificado usó"""
+    usados = {m for r in resultados.values() for _, detalles in r['consultas']
+              for detalle in detalles for m in INDICE_USADO.findall(detalle)}
+    with db.connection() as conn:
+        creados = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'")}
+    return creados - usados
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="Base a revisar (por defecto una temporal con datos sintéticos)")
+    parser.add_argument("--paseo", type=int, help="Paseo a consultar (con --db)")
+    parser.add_argument("--gastos", type=int, default=500, help="Gastos por paseo de la base temporal")
+    args = parser.parse_args()
+
+    if args.db:
+        # cache_size=0: cada llamada va a SQLite
+        db = Database(args.db, cache_size=0)
+        with db.connection() as conn:
+            fila = conn.execute("""
+                SELECT paseo_id, usuario_id FROM paseo_participantes
+                WHERE ? IS NULL OR paseo_id = ? ORDER BY paseo_id LIMIT 1
+            """, (args.paseo, args.paseo)).fetchone()
+        if not fila:
+            sys.exit("No hay paseos con participantes en la base")
+        paseo_id, usuario_id = fila
+    else:
+        db = Database(os.path.join(tempfile.mkdtemp(prefix="paseos_planes_"), "paseos.db"), cache_size=0)
+        creados = generar_datos(db, usuarios=20, paseos=3, participantes=6, gastos_por_paseo=args.gastos)
+        paseo_id, miembros = next(iter(creados['paseos'].items()))
+        usuario_id = miembros[0]
+
+    resultados = verificar(db, paseo_id, usuario_id)
+    fallas = 0
+    for nombre, r in resultados.items():
+        print(f"{'⚠' if r['problemas'] else '✓'} {nombre}")
+        for _, detalles in r['consultas']:
+            for detalle in detalles:
+                print(f"    {detalle}")
+        for problema in r['problemas']:
+            print(f"  ⚠ sin índice: {problema}")
+        fallas += bool(r['problemas'])
+
+    sobrantes = indices_sin_usar(db, resultados)
+    if sobrantes:
+        print(f"Índices que estas consultas no usan (pueden servir a otras): {', '.join(sorted(sobrantes))}")
+    db.close()
+    sys.exit(1 if fallas else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Cache persistente de respuestas de OpenAI.
+Las respuestas se guardan en SQLite bajo el SHA-256 de la entrada (bytes del audio o
+de la foto, o el texto) junto con el modelo y la versión del prompt, así una misma
+factura o un mismo audio no se vuelve a pagar. Las entradas vencen por TTL y, si la
+cache supera su tamaño máximo, se desalojan las usadas hace más tiempo.
+"""
+import hashlib
+import json
+import time
+from typing import Any, Optional
+
+from database import ConnectionPool
+
+def clave_cache(modelo: str, version_prompt: str, *partes) -> str:
+    """Calcula la clave de cache a partir del modelo, la versión del prompt y la entrada (str o bytes)"""
+    h = hashlib.sha256()
+    for parte in (modelo, version_prompt) + partes:
+        datos = parte if isinstance(parte, (bytes, bytearray, memoryview)) else str(parte).encode("utf-8")
+        # Prefijo de longitud para que ("ab", "c") y ("a", "bc") no colisionen
+        h.update(len(datos).to_bytes(8, "big"))
+        h.update(datos)
+    return h.hexdigest()
+
+def hash_archivo(path: str, tamano_bloque: int = 1024 * 1024) -> str:
+    """SHA-256 de un archivo leído por bloques"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+class CacheRespuestas:
+    def __init__(self, db_path: str = "cache_ia.db", ttl_segundos: float = 30 * 24 * 3600,
+                 max_bytes: int = 50 * 1024 * 1024):
+        self.ttl_segundos = ttl_segundos
+        self.max_bytes = max_bytes
+        self.pool = ConnectionPool(db_path, max_size=2)
+        with self.pool.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS respuestas (
+                    clave TEXT PRIMARY KEY,
+                    valor TEXT NOT NULL,
+                    tamano INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_respuestas_accessed ON respuestas(accessed_at)")
+            conn.commit()
+
+    def get(self, clave: str) -> Optional[Any]:
+        """Retorna la respuesta guardada, o None si no existe o ya venció"""
+        ahora = time.time()
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT valor, created_at FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+            if row is None:
+                return None
+            if ahora - row['created_at'] > self.ttl_segundos:
+                conn.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE respuestas SET accessed_at = ? WHERE clave = ?", (ahora, clave))
+            conn.commit()
+        return json.loads(row['valor'])
+
+    def set(self, clave: str, valor: Any):
+        """Guarda una respuesta y desaloja las más viejas si la cache supera max_bytes"""
+        texto = json.dumps(valor, ensure_ascii=False)
+        ahora = time.time()
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO respuestas (clave, valor, tamano, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (clave, texto, len(texto.encode("utf-8")), ahora, ahora))
+            self._desalojar(conn, ahora)
+            conn.commit()
+
+    def _desalojar(self, conn, ahora: float):
+        conn.execute("DELETE FROM respuestas WHERE created_at < ?", (ahora - self.ttl_segundos,))
+        total = conn.execute("SELECT COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Borrar desde la menos usada recientemente hasta volver al límite
+        sobrante = total - self.max_bytes
+        claves = []
+        for row in conn.execute("SELECT clave, tamano FROM respuestas ORDER BY accessed_at"):
+            if sobrante <= 0:
+                break
+            claves.append((row['clave'],))
+            sobrante -= row['tamano']
+        conn.executemany("DELETE FROM respuestas WHERE clave = ?", claves)
+
+    def clear(self):
+        """Elimina todas las respuestas guardadas"""
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM respuestas")
+            conn.commit()
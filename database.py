@@ -1,360 +1,1086 @@
 import sqlite3
 import hashlib
+import functools
+import inspect
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Iterator, List, Dict, Optional, Set, Tuple
 import json
+from liquidacion import MODO_PARES, MODO_SIMPLIFICADO, a_pesos, repartir_monto, simplificar_deudas
 
-class Database:
-    def __init__(self, db_path: str = "paseos.db"):
+@dataclass
+class StorageProfile:
+    """
+    PRAGMAs que se aplican a cada conexión nueva.
+    Por defecto usa WAL para que los lectores no bloqueen a los escritores
+    (y viceversa) cuando varios participantes guardan gastos a la vez.
+    """
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"  # En WAL, NORMAL es seguro ante caídas de la app
+    mmap_size: int = 128 * 1024 * 1024
+    cache_size: int = -16000  # Negativo = KiB (unos 16 MB por conexión)
+    temp_store: str = "MEMORY"
+    busy_timeout_ms: int = 5000
+    # Reintentos cuando aun así la base responde "database is locked"
+    max_retries: int = 5
+    retry_backoff: float = 0.05
+    
+    def aplicar(self, conn: sqlite3.Connection):
+        """Aplica el perfil a una conexión"""
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        conn.execute(f"PRAGMA temp_store = {self.temp_store}")
+
+def _es_error_de_bloqueo(error: sqlite3.OperationalError) -> bool:
+    mensaje = str(error).lower()
+    return "locked" in mensaje or "busy" in mensaje
+
+def reintentar_si_bloqueada(metodo):
+    """Reintenta una escritura de Database con backoff exponencial si la base está bloqueada"""
+    @functools.wraps(metodo)
+    def envoltura(self, *args, **kwargs):
+        perfil = self.profile
+        intento = 0
+        while True:
+            try:
+                return metodo(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                # Dentro de otra operación no se reintenta: la transacción es del llamador
+                if (not _es_error_de_bloqueo(e) or intento >= perfil.max_retries
+                        or self.pool.en_uso()):
+                    raise
+                time.sleep(perfil.retry_backoff * (2 ** intento))
+                intento += 1
+    return envoltura
+
+def cacheado(ambito: str, argumento: str = 'paseo_id'):
+    """
+    Cachea el resultado de una consulta de Database en self.cache.
+    El resultado queda asociado al ámbito (ambito, valor del argumento), por ejemplo
+    ('paseo', 3); cualquier escritura que invalide ese ámbito hace que la próxima
+    llamada vuelva a consultar la base. Los resultados cacheados se comparten entre
+    sesiones: no se deben modificar.
+    """
+    def decorador(metodo):
+        firma = inspect.signature(metodo)
+        
+        @functools.wraps(metodo)
+        def envoltura(self, *args, **kwargs):
+            argumentos = firma.bind(self, *args, **kwargs)
+            argumentos.apply_defaults()
+            valores = tuple(argumentos.arguments.values())[1:]
+            return self.cache.get_or_load(
+                (ambito, argumentos.arguments[argumento]),
+                (metodo.__name__,) + valores,
+                lambda: metodo(self, *args, **kwargs)
+            )
+        return envoltura
+    return decorador
+
+# Migraciones del esquema: (versión, descripción, función que recibe el cursor).
+# Se aplican en orden al iniciar, cada una en su propia transacción, y quedan
+# registradas en schema_version para no repetirse. Nunca editar una ya publicada:
+# agregar una nueva al final.
+def _migracion_indices_gastos(cursor):
+    # get_gastos_paseo: filtra por paseo y ordena por fecha
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gastos_paseo_fecha ON gastos(paseo_id, fecha, id)")
+    # get_resumen_usuario_paseo: SUM(valor) por paseo y pagador sin leer la tabla
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gastos_paseo_usuario ON gastos(paseo_id, usuario_id, valor)")
+    # get_gastos_por_categoria: LEFT JOIN desde categorias
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gastos_categoria ON gastos(categoria_id, valor)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gastos_usuario ON gastos(usuario_id)")
+
+def _migracion_indices_divisiones(cursor):
+    # calcular_deudas_paseo: divisiones de cada gasto, sin leer la tabla
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_divisiones_gasto ON gasto_divisiones(gasto_id, usuario_id, monto)")
+    # get_resumen_usuario_paseo: SUM(monto) de lo que debe un usuario
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_divisiones_usuario ON gasto_divisiones(usuario_id, gasto_id, monto)")
+    # get_paseos_usuario: paseos en los que participa un usuario
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_participantes_usuario ON paseo_participantes(usuario_id, paseo_id)")
+
+# Saldos materializados: los triggers mantienen total_pagado y total_debe por
+# (paseo, usuario) con cada INSERT/UPDATE/DELETE sobre gastos y gasto_divisiones,
+# así que cualquier método que escriba esas tablas los deja al día.
+TRIGGERS_SALDOS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_saldos_gasto_insert AFTER INSERT ON gastos
+    BEGIN
+        INSERT INTO saldos (paseo_id, usuario_id, total_pagado)
+        VALUES (NEW.paseo_id, NEW.usuario_id, NEW.valor)
+        ON CONFLICT(paseo_id, usuario_id) DO UPDATE SET total_pagado = total_pagado + excluded.total_pagado;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_saldos_gasto_update AFTER UPDATE OF valor, usuario_id ON gastos
+    BEGIN
+        UPDATE saldos SET total_pagado = total_pagado - OLD.valor
+        WHERE paseo_id = OLD.paseo_id AND usuario_id = OLD.usuario_id;
+        INSERT INTO saldos (paseo_id, usuario_id, total_pagado)
+        VALUES (NEW.paseo_id, NEW.usuario_id, NEW.valor)
+        ON CONFLICT(paseo_id, usuario_id) DO UPDATE SET total_pagado = total_pagado + excluded.total_pagado;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_saldos_gasto_delete AFTER DELETE ON gastos
+    BEGIN
+        UPDATE saldos SET total_pagado = total_pagado - OLD.valor
+        WHERE paseo_id = OLD.paseo_id AND usuario_id = OLD.usuario_id;
+        -- Divisiones que sigan existiendo dejan de contar (eliminar_gasto ya las borra antes)
+        UPDATE saldos SET total_debe = total_debe - (
+            SELECT SUM(gd.monto) FROM gasto_divisiones gd
+            WHERE gd.gasto_id = OLD.id AND gd.usuario_id = saldos.usuario_id
+        )
+        WHERE paseo_id = OLD.paseo_id
+          AND usuario_id IN (SELECT usuario_id FROM gasto_divisiones WHERE gasto_id = OLD.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_saldos_division_insert AFTER INSERT ON gasto_divisiones
+    BEGIN
+        INSERT INTO saldos (paseo_id, usuario_id, total_debe)
+        SELECT paseo_id, NEW.usuario_id, NEW.monto FROM gastos WHERE id = NEW.gasto_id
+        ON CONFLICT(paseo_id, usuario_id) DO UPDATE SET total_debe = total_debe + excluded.total_debe;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_saldos_division_update AFTER UPDATE OF monto, usuario_id, gasto_id ON gasto_divisiones
+    BEGIN
+        UPDATE saldos SET total_debe = total_debe - OLD.monto
+        WHERE usuario_id = OLD.usuario_id
+          AND paseo_id = (SELECT paseo_id FROM gastos WHERE id = OLD.gasto_id);
+        INSERT INTO saldos (paseo_id, usuario_id, total_debe)
+        SELECT paseo_id, NEW.usuario_id, NEW.monto FROM gastos WHERE id = NEW.gasto_id
+        ON CONFLICT(paseo_id, usuario_id) DO UPDATE SET total_debe = total_debe + excluded.total_debe;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_saldos_division_delete AFTER DELETE ON gasto_divisiones
+    BEGIN
+        UPDATE saldos SET total_debe = total_debe - OLD.monto
+        WHERE usuario_id = OLD.usuario_id
+          AND paseo_id = (SELECT paseo_id FROM gastos WHERE id = OLD.gasto_id);
+    END
+    """,
+]
+
+# Saldos calculados desde cero a partir de gastos y divisiones (filtro opcional por paseo)
+SQL_SALDOS_CALCULADOS = """
+    SELECT paseo_id, usuario_id, SUM(pagado) as total_pagado, SUM(debe) as total_debe
+    FROM (
+        SELECT paseo_id, usuario_id, valor as pagado, 0 as debe
+        FROM gastos
+        WHERE :paseo_id IS NULL OR paseo_id = :paseo_id
+        UNION ALL
+        SELECT g.paseo_id, gd.usuario_id, 0 as pagado, gd.monto as debe
+        FROM gasto_divisiones gd
+        JOIN gastos g ON gd.gasto_id = g.id
+        WHERE :paseo_id IS NULL OR g.paseo_id = :paseo_id
+    )
+    GROUP BY paseo_id, usuario_id
+"""
+
+def _migracion_saldos(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS saldos (
+            paseo_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            total_pagado REAL NOT NULL DEFAULT 0,
+            total_debe REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (paseo_id, usuario_id)
+        ) WITHOUT ROWID
+    """)
+    for trigger in TRIGGERS_SALDOS:
+        cursor.execute(trigger)
+    # Cargar los saldos de los datos que ya existen
+    cursor.execute("DELETE FROM saldos")
+    cursor.execute(f"INSERT INTO saldos (paseo_id, usuario_id, total_pagado, total_debe) {SQL_SALDOS_CALCULADOS}",
+                   {'paseo_id': None})
+
+def _migracion_montos_enteros(cursor):
+    # Los montos pasan de REAL a pesos enteros. SQLite no permite cambiar el tipo de una
+    # columna, así que las tablas se reconstruyen. Los triggers de saldos referencian
+    # gastos y gasto_divisiones, por eso se eliminan antes y se recrean al final.
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_saldos_%'")
+    for (nombre,) in cursor.fetchall():
+        cursor.execute(f"DROP TRIGGER {nombre}")
+    
+    cursor.execute("""
+        CREATE TABLE gastos_nueva (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            paseo_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            categoria_id INTEGER,
+            concepto TEXT NOT NULL,
+            valor INTEGER NOT NULL,
+            fecha TIMESTAMP NOT NULL,
+            tipo_archivo TEXT,
+            archivo_path TEXT,
+            transcripcion TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (paseo_id) REFERENCES paseos(id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+            FOREIGN KEY (categoria_id) REFERENCES categorias(id)
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO gastos_nueva (id, paseo_id, usuario_id, categoria_id, concepto, valor, fecha,
+                                  tipo_archivo, archivo_path, transcripcion, created_at)
+        SELECT id, paseo_id, usuario_id, categoria_id, concepto, CAST(ROUND(valor) AS INTEGER), fecha,
+               tipo_archivo, archivo_path, transcripcion, created_at
+        FROM gastos
+    """)
+    cursor.execute("DROP TABLE gastos")
+    cursor.execute("ALTER TABLE gastos_nueva RENAME TO gastos")
+    
+    cursor.execute("""
+        CREATE TABLE gasto_divisiones_nueva (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            gasto_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            porcentaje REAL NOT NULL,
+            monto INTEGER NOT NULL,
+            FOREIGN KEY (gasto_id) REFERENCES gastos(id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+            UNIQUE(gasto_id, usuario_id)
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO gasto_divisiones_nueva (id, gasto_id, usuario_id, porcentaje, monto)
+        SELECT id, gasto_id, usuario_id, porcentaje, 0 FROM gasto_divisiones
+    """)
+    cursor.execute("DROP TABLE gasto_divisiones")
+    cursor.execute("ALTER TABLE gasto_divisiones_nueva RENAME TO gasto_divisiones")
+    
+    # Recalcular los montos de cada gasto para que sumen exactamente su valor
+    cursor.execute("""
+        SELECT gd.id, gd.gasto_id, gd.porcentaje, g.valor
+        FROM gasto_divisiones gd
+        JOIN gastos g ON gd.gasto_id = g.id
+        ORDER BY gd.gasto_id, gd.id
+    """)
+    por_gasto = {}
+    for division_id, gasto_id, porcentaje, valor in cursor.fetchall():
+        por_gasto.setdefault(gasto_id, (valor, []))[1].append((division_id, porcentaje))
+    actualizaciones = []
+    for valor, divisiones in por_gasto.values():
+        montos = repartir_monto(valor, [porcentaje for _, porcentaje in divisiones])
+        actualizaciones.extend((monto, division_id) for (division_id, _), monto in zip(divisiones, montos))
+    cursor.executemany("UPDATE gasto_divisiones SET monto = ? WHERE id = ?", actualizaciones)
+    
+    cursor.execute("DROP TABLE saldos")
+    cursor.execute("""
+        CREATE TABLE saldos (
+            paseo_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            total_pagado INTEGER NOT NULL DEFAULT 0,
+            total_debe INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (paseo_id, usuario_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute(f"INSERT INTO saldos (paseo_id, usuario_id, total_pagado, total_debe) {SQL_SALDOS_CALCULADOS}",
+                   {'paseo_id': None})
+    
+    # Los índices se eliminaron junto con las tablas viejas
+    _migracion_indices_gastos(cursor)
+    _migracion_indices_divisiones(cursor)
+    for trigger in TRIGGERS_SALDOS:
+        cursor.execute(trigger)
+
+def _migracion_indices_paginacion(cursor):
+    # get_gastos_paseo_pagina: recorrer por (fecha, id) dentro de cada filtro sin ordenar en memoria
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gastos_paseo_categoria_fecha ON gastos(paseo_id, categoria_id, fecha, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gastos_paseo_usuario_fecha ON gastos(paseo_id, usuario_id, fecha, id)")
+
+def _migracion_trabajos(cursor):
+    # Cola persistente de transcripciones y análisis de facturas (ver trabajos.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS trabajos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            paseo_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            estado TEXT NOT NULL DEFAULT 'pendiente',
+            archivo_path TEXT NOT NULL,
+            resultado TEXT,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id),
+            FOREIGN KEY (paseo_id) REFERENCES paseos (id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_usuario ON trabajos(usuario_id, paseo_id, estado)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos(estado)")
+
+def _migracion_analisis_ia(cursor):
+    # Último análisis de IA de cada paseo, válido mientras el digest del paseo no cambie
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS analisis_ia (
+            paseo_id INTEGER PRIMARY KEY,
+            digest TEXT NOT NULL,
+            contenido TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (paseo_id) REFERENCES paseos (id)
+        )
+    """)
+
+def _migracion_indices_archivos(cursor):
+    # almacenamiento.py: contar cuántos gastos y trabajos referencian un archivo antes de borrarlo
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_gastos_archivo ON gastos(archivo_path) WHERE archivo_path IS NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trabajos_archivo ON trabajos(archivo_path)")
+
+def _migracion_quitar_indices_sin_uso(cursor):
+    # get_resumen_usuario_paseo ya lee la tabla saldos, e idx_gastos_paseo_usuario_fecha
+    # cubre los filtros por paseo y pagador: estos índices solo encarecían cada escritura.
+    # Ninguna consulta filtra gastos o divisiones solo por usuario, y no hacen falta para
+    # las llaves foráneas: no se activan (PRAGMA foreign_keys) y nunca se borran usuarios
+    cursor.execute("DROP INDEX IF EXISTS idx_gastos_paseo_usuario")
+    cursor.execute("DROP INDEX IF EXISTS idx_gastos_usuario")
+    cursor.execute("DROP INDEX IF EXISTS idx_divisiones_usuario")
+
+# Trabajos que retienen su archivo: uno guardado ya no (lo retiene el gasto) ni uno descartado.
+# Uno usado está en un borrador sin guardar; si lleva una semana así, el borrador se abandonó.
+SQL_TRABAJOS_CON_ARCHIVO = """
+    SELECT archivo_path FROM trabajos
+    WHERE estado NOT IN ('guardado', 'descartado')
+      AND NOT (estado = 'usado' AND updated_at < datetime('now', '-7 days'))
+"""
+
+MIGRACIONES = [
+    (1, "Índices de gastos por paseo, pagador y categoría", _migracion_indices_gastos),
+    (2, "Índices de divisiones y participantes por usuario", _migracion_indices_divisiones),
+    (3, "Tabla saldos mantenida por triggers", _migracion_saldos),
+    (4, "Montos de gastos, divisiones y saldos en pesos enteros", _migracion_montos_enteros),
+    (5, "Índices para paginar gastos filtrados por categoría o pagador", _migracion_indices_paginacion),
+    (6, "Tabla trabajos para procesar audios y fotos en segundo plano", _migracion_trabajos),
+    (7, "Tabla analisis_ia con el último análisis de cada paseo", _migracion_analisis_ia),
+    (8, "Índices de gastos y trabajos por archivo", _migracion_indices_archivos),
+    (9, "Quitar los índices sin uso de gastos y divisiones por usuario", _migracion_quitar_indices_sin_uso),
+]
+
+# Diferencia admitida entre la suma de los porcentajes de un gasto y 100 (p. ej. 3 × 33.33)
+TOLERANCIA_PORCENTAJES = 0.05
+
+class ConnectionPool:
+    """
+    Pool de conexiones SQLite de larga vida.
+    Cada hilo reutiliza la misma conexión mientras la tenga prestada (llamadas anidadas
+    no abren otra), y al devolverla queda disponible para cualquier otro hilo.
+    """
+    def __init__(self, db_path: str, max_size: int = 5, timeout: float = 30.0,
+                 health_check_interval: float = 60.0, profile: StorageProfile = None):
         self.db_path = db_path
-        self.init_database()
+        self.profile = profile or StorageProfile()
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._local = threading.local()
     
-    def get_connection(self):
-        conn = sqlite3.connect(self.db_path)
+    def _crear_conexion(self) -> sqlite3.Connection:
+        # check_same_thread=False: el pool garantiza que una conexión solo la usa un hilo a la vez.
+        # IMMEDIATE: las escrituras toman el candado al empezar la transacción, así dos
+        # escritores no se bloquean mutuamente al intentar pasar de lectura a escritura.
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.profile.busy_timeout_ms / 1000,
+            isolation_level="IMMEDIATE",
+            check_same_thread=False
+        )
         conn.row_factory = sqlite3.Row
+        self.profile.aplicar(conn)
         return conn
     
-    def init_database(self):
-        """Inicializa las tablas de la base de datos"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Tabla de usuarios
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS usuarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                nombre TEXT NOT NULL,
-                email TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+    def _esta_sana(self, conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def en_uso(self) -> bool:
+        """Indica si el hilo actual tiene una conexión prestada"""
+        return getattr(self._local, 'depth', 0) > 0
+    
+    def acquire(self) -> sqlite3.Connection:
+        """Presta una conexión al hilo actual (la misma si ya tiene una prestada)"""
+        if self.en_uso():
+            self._local.depth += 1
+            return self._local.conn
         
-        # Tabla de paseos
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS paseos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nombre TEXT NOT NULL,
-                descripcion TEXT,
-                created_by INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (created_by) REFERENCES usuarios(id)
-            )
-        """)
+        conn = self._tomar()
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+    
+    def _tomar(self) -> sqlite3.Connection:
+        """Ocupa un cupo del pool y entrega una conexión libre (o una nueva)"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(f"No hay conexiones disponibles en el pool ({self.max_size} en uso)")
         
-        # Tabla de participantes en paseos
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS paseo_participantes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                paseo_id INTEGER NOT NULL,
-                usuario_id INTEGER NOT NULL,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (paseo_id) REFERENCES paseos(id),
-                FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
-                UNIQUE(paseo_id, usuario_id)
-            )
-        """)
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    candidata, ultimo_uso = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._crear_conexion()
+                    break
+                # Verificar conexiones que llevan un rato sin usarse
+                if time.monotonic() - ultimo_uso < self.health_check_interval or self._esta_sana(candidata):
+                    conn = candidata
+                else:
+                    candidata.close()
+        except BaseException:
+            self._slots.release()
+            raise
+        return conn
+    
+    def release(self, conn: sqlite3.Connection):
+        """Devuelve la conexión al pool cuando el hilo termina de usarla"""
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+        self._devolver(conn)
+    
+    def _devolver(self, conn: sqlite3.Connection):
+        """Deja la conexión libre y el cupo disponible"""
+        try:
+            # Nunca devolver una conexión con una transacción a medias
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put((conn, time.monotonic()))
+        except sqlite3.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+    
+    @contextmanager
+    def connection(self):
+        """Context manager que presta una conexión y la devuelve al salir"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    @contextmanager
+    def connection_dedicada(self):
+        """
+        Presta una conexión propia, sin pasar por el préstamo del hilo: se devuelve bien
+        desde cualquier hilo. Para generadores que la retienen entre yields y que pueden
+        cerrarse (o recolectarse sin terminar) en otro hilo.
+        """
+        conn = self._tomar()
+        try:
+            yield conn
+        finally:
+            self._devolver(conn)
+    
+    def close(self):
+        """Cierra todas las conexiones libres del pool"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+class QueryCache:
+    """
+    Cache LRU de resultados de consultas, compartida por todas las sesiones.
+    Cada ámbito (un paseo, un usuario) tiene un contador de versión que forma parte de
+    la clave; invalidar un ámbito solo incrementa su versión, y las entradas viejas
+    quedan inalcanzables hasta que el LRU las desaloja.
+    """
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def version(self, ambito: Tuple) -> int:
+        """Versión actual de un ámbito, p. ej. ('paseo', 3)"""
+        with self._lock:
+            return self._versions.get(ambito, 0)
+    
+    def invalidar(self, *ambitos: Tuple):
+        """Incrementa la versión de los ámbitos (llamar después del commit)"""
+        with self._lock:
+            for ambito in ambitos:
+                self._versions[ambito] = self._versions.get(ambito, 0) + 1
+    
+    def get_or_load(self, ambito: Tuple, key: Tuple, cargar):
+        """Retorna el valor cacheado para la versión actual del ámbito, o lo carga y lo guarda"""
+        if self.max_entries <= 0:
+            return cargar()
         
-        # Tabla de categorías de gastos
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS categorias (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                paseo_id INTEGER NOT NULL,
-                nombre TEXT NOT NULL,
-                icono TEXT DEFAULT '📦',
-                color TEXT DEFAULT '#6366f1',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (paseo_id) REFERENCES paseos(id),
-                UNIQUE(paseo_id, nombre)
-            )
-        """)
+        with self._lock:
+            version = self._versions.get(ambito, 0)
+            clave = (ambito, version) + key
+            if clave in self._entries:
+                self._entries.move_to_end(clave)
+                self.hits += 1
+                return self._entries[clave]
+            self.misses += 1
         
-        # Tabla de gastos
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS gastos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                paseo_id INTEGER NOT NULL,
-                usuario_id INTEGER NOT NULL,
-                categoria_id INTEGER,
-                concepto TEXT NOT NULL,
-                valor REAL NOT NULL,
-                fecha TIMESTAMP NOT NULL,
-                tipo_archivo TEXT,
-                archivo_path TEXT,
-                transcripcion TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (paseo_id) REFERENCES paseos(id),
-                FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
-                FOREIGN KEY (categoria_id) REFERENCES categorias(id)
-            )
-        """)
+        # La consulta se hace sin el candado; si mientras tanto hubo una escritura,
+        # el valor queda guardado bajo la versión vieja y nadie lo volverá a leer
+        valor = cargar()
         
-        # Tabla de división de gastos
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS gasto_divisiones (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                gasto_id INTEGER NOT NULL,
-                usuario_id INTEGER NOT NULL,
-                porcentaje REAL NOT NULL,
-                monto REAL NOT NULL,
-                FOREIGN KEY (gasto_id) REFERENCES gastos(id),
-                FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
-                UNIQUE(gasto_id, usuario_id)
-            )
-        """)
+        with self._lock:
+            self._entries[clave] = valor
+            self._entries.move_to_end(clave)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return valor
+    
+    def clear(self):
+        """Vacía la cache e invalida todos los ámbitos"""
+        with self._lock:
+            self._entries.clear()
+            for ambito in self._versions:
+                self._versions[ambito] += 1
+    
+    def stats(self) -> Dict:
+        """Estadísticas de aciertos y fallos"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries
+            }
+
+class Database:
+    def __init__(self, db_path: str = "paseos.db", pool_size: int = 5,
+                 profile: StorageProfile = None, cache_size: int = 512):
+        self.db_path = db_path
+        self.profile = profile or StorageProfile()
+        self.pool = ConnectionPool(db_path, max_size=pool_size, profile=self.profile)
+        self.cache = QueryCache(max_entries=cache_size)
+        self.init_database()
+    
+    def connection(self):
+        """Presta una conexión del pool: usar como `with self.connection() as conn:`"""
+        return self.pool.connection()
+    
+    def close(self):
+        """Cierra las conexiones abiertas de la base de datos"""
+        self.pool.close()
+    
+    def version_paseo(self, paseo_id: int) -> int:
+        """Versión de los datos de un paseo en esta instancia; cambia con cada escritura"""
+        return self.cache.version(('paseo', paseo_id))
+    
+    def _paseo_de_gasto(self, cursor: sqlite3.Cursor, gasto_id: int) -> Optional[int]:
+        cursor.execute("SELECT paseo_id FROM gastos WHERE id = ?", (gasto_id,))
+        row = cursor.fetchone()
+        return row['paseo_id'] if row else None
+    
+    def init_database(self):
+        """Inicializa las tablas de la base de datos"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Tabla de usuarios
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS usuarios (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    nombre TEXT NOT NULL,
+                    email TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Tabla de paseos
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS paseos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nombre TEXT NOT NULL,
+                    descripcion TEXT,
+                    created_by INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (created_by) REFERENCES usuarios(id)
+                )
+            """)
+            
+            # Tabla de participantes en paseos
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS paseo_participantes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    paseo_id INTEGER NOT NULL,
+                    usuario_id INTEGER NOT NULL,
+                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (paseo_id) REFERENCES paseos(id),
+                    FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+                    UNIQUE(paseo_id, usuario_id)
+                )
+            """)
+            
+            # Tabla de categorías de gastos
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS categorias (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    paseo_id INTEGER NOT NULL,
+                    nombre TEXT NOT NULL,
+                    icono TEXT DEFAULT '📦',
+                    color TEXT DEFAULT '#6366f1',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (paseo_id) REFERENCES paseos(id),
+                    UNIQUE(paseo_id, nombre)
+                )
+            """)
+            
+            # Tabla de gastos
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS gastos (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    paseo_id INTEGER NOT NULL,
+                    usuario_id INTEGER NOT NULL,
+                    categoria_id INTEGER,
+                    concepto TEXT NOT NULL,
+                    valor REAL NOT NULL,
+                    fecha TIMESTAMP NOT NULL,
+                    tipo_archivo TEXT,
+                    archivo_path TEXT,
+                    transcripcion TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (paseo_id) REFERENCES paseos(id),
+                    FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+                    FOREIGN KEY (categoria_id) REFERENCES categorias(id)
+                )
+            """)
+            
+            # Tabla de división de gastos
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS gasto_divisiones (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    gasto_id INTEGER NOT NULL,
+                    usuario_id INTEGER NOT NULL,
+                    porcentaje REAL NOT NULL,
+                    monto REAL NOT NULL,
+                    FOREIGN KEY (gasto_id) REFERENCES gastos(id),
+                    FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+                    UNIQUE(gasto_id, usuario_id)
+                )
+            """)
+            
+            conn.commit()
         
-        conn.commit()
-        conn.close()
+        self.aplicar_migraciones()
+    
+    def aplicar_migraciones(self) -> List[int]:
+        """Aplica las migraciones pendientes en orden y retorna las versiones aplicadas"""
+        aplicadas = []
+        with self.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    descripcion TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.commit()
+            
+            for version, descripcion, migracion in MIGRACIONES:
+                cursor = conn.cursor()
+                # BEGIN IMMEDIATE: si otro proceso está migrando, esperar y volver a verificar
+                cursor.execute("BEGIN IMMEDIATE")
+                try:
+                    cursor.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))
+                    if cursor.fetchone() is None:
+                        migracion(cursor)
+                        cursor.execute("""
+                            INSERT INTO schema_version (version, descripcion)
+                            VALUES (?, ?)
+                        """, (version, descripcion))
+                        aplicadas.append(version)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+            
+            if aplicadas:
+                conn.execute("PRAGMA optimize")
+        return aplicadas
+    
+    def get_schema_version(self) -> int:
+        """Obtiene la versión actual del esquema"""
+        with self.connection() as conn:
+            row = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()
+        return row[0]
     
     # Métodos de usuarios
+    @reintentar_si_bloqueada
     def crear_usuario(self, username: str, password: str, nombre: str, email: str = None) -> bool:
         """Crea un nuevo usuario"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            password_hash = hashlib.sha256(password.encode()).hexdigest()
-            cursor.execute("""
-                INSERT INTO usuarios (username, password_hash, nombre, email)
-                VALUES (?, ?, ?, ?)
-            """, (username, password_hash, nombre, email))
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                password_hash = hashlib.sha256(password.encode()).hexdigest()
+                cursor.execute("""
+                    INSERT INTO usuarios (username, password_hash, nombre, email)
+                    VALUES (?, ?, ?, ?)
+                """, (username, password_hash, nombre, email))
+                conn.commit()
             return True
         except sqlite3.IntegrityError:
             return False
     
     def verificar_usuario(self, username: str, password: str) -> Optional[Dict]:
         """Verifica las credenciales del usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        password_hash = hashlib.sha256(password.encode()).hexdigest()
-        cursor.execute("""
-            SELECT id, username, nombre, email FROM usuarios
-            WHERE username = ? AND password_hash = ?
-        """, (username, password_hash))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            password_hash = hashlib.sha256(password.encode()).hexdigest()
+            cursor.execute("""
+                SELECT id, username, nombre, email FROM usuarios
+                WHERE username = ? AND password_hash = ?
+            """, (username, password_hash))
+            row = cursor.fetchone()
         if row:
             return dict(row)
         return None
     
     def get_usuario(self, usuario_id: int) -> Optional[Dict]:
         """Obtiene información de un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, username, nombre, email FROM usuarios WHERE id = ?", (usuario_id,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, username, nombre, email FROM usuarios WHERE id = ?", (usuario_id,))
+            row = cursor.fetchone()
         if row:
             return dict(row)
         return None
     
     def buscar_usuario_por_username(self, username: str) -> Optional[Dict]:
         """Busca un usuario por su nombre de usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, username, nombre, email FROM usuarios WHERE username = ?", (username,))
-        row = cursor.fetchone()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, username, nombre, email FROM usuarios WHERE username = ?", (username,))
+            row = cursor.fetchone()
         if row:
             return dict(row)
         return None
     
     # Métodos de paseos
+    @reintentar_si_bloqueada
     def crear_paseo(self, nombre: str, descripcion: str, created_by: int) -> int:
         """Crea un nuevo paseo"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO paseos (nombre, descripcion, created_by)
-            VALUES (?, ?, ?)
-        """, (nombre, descripcion, created_by))
-        paseo_id = cursor.lastrowid
-        # Agregar el creador como participante
-        cursor.execute("""
-            INSERT INTO paseo_participantes (paseo_id, usuario_id)
-            VALUES (?, ?)
-        """, (paseo_id, created_by))
-        
-        # Crear categorías predeterminadas
-        categorias_default = [
-            ("🍽️ Restaurante", "🍽️", "#ef4444"),
-            ("☕ Cafetería", "☕", "#f59e0b"),
-            ("🚗 Transporte", "🚗", "#3b82f6"),
-            ("🏨 Hospedaje", "🏨", "#8b5cf6"),
-            ("🎫 Entradas", "🎫", "#ec4899"),
-            ("🛒 Supermercado", "🛒", "#10b981"),
-            ("⛽ Gasolina", "⛽", "#6366f1"),
-            ("🎉 Entretenimiento", "🎉", "#f97316"),
-            ("💊 Farmacia", "💊", "#14b8a6"),
-            ("📦 Otros", "📦", "#94a3b8"),
-        ]
-        for cat_nombre, icono, color in categorias_default:
+        with self.connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO categorias (paseo_id, nombre, icono, color)
-                VALUES (?, ?, ?, ?)
-            """, (paseo_id, cat_nombre, icono, color))
-        
-        conn.commit()
-        conn.close()
+                INSERT INTO paseos (nombre, descripcion, created_by)
+                VALUES (?, ?, ?)
+            """, (nombre, descripcion, created_by))
+            paseo_id = cursor.lastrowid
+            # Agregar el creador como participante
+            cursor.execute("""
+                INSERT INTO paseo_participantes (paseo_id, usuario_id)
+                VALUES (?, ?)
+            """, (paseo_id, created_by))
+            
+            # Crear categorías predeterminadas
+            categorias_default = [
+                ("🍽️ Restaurante", "🍽️", "#ef4444"),
+                ("☕ Cafetería", "☕", "#f59e0b"),
+                ("🚗 Transporte", "🚗", "#3b82f6"),
+                ("🏨 Hospedaje", "🏨", "#8b5cf6"),
+                ("🎫 Entradas", "🎫", "#ec4899"),
+                ("🛒 Supermercado", "🛒", "#10b981"),
+                ("⛽ Gasolina", "⛽", "#6366f1"),
+                ("🎉 Entretenimiento", "🎉", "#f97316"),
+                ("💊 Farmacia", "💊", "#14b8a6"),
+                ("📦 Otros", "📦", "#94a3b8"),
+            ]
+            for cat_nombre, icono, color in categorias_default:
+                cursor.execute("""
+                    INSERT INTO categorias (paseo_id, nombre, icono, color)
+                    VALUES (?, ?, ?, ?)
+                """, (paseo_id, cat_nombre, icono, color))
+            
+            conn.commit()
+        self.cache.invalidar(('usuario', created_by))
         return paseo_id
     
     # Métodos de categorías
+    @cacheado('paseo')
     def get_categorias_paseo(self, paseo_id: int) -> List[Dict]:
         """Obtiene todas las categorías de un paseo"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT * FROM categorias WHERE paseo_id = ? ORDER BY nombre
-        """, (paseo_id,))
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT * FROM categorias WHERE paseo_id = ? ORDER BY nombre
+            """, (paseo_id,))
+            rows = cursor.fetchall()
         return [dict(row) for row in rows]
     
+    @reintentar_si_bloqueada
     def crear_categoria(self, paseo_id: int, nombre: str, icono: str = "📦", color: str = "#6366f1") -> int:
         """Crea una nueva categoría"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO categorias (paseo_id, nombre, icono, color)
-                VALUES (?, ?, ?, ?)
-            """, (paseo_id, nombre, icono, color))
-            categoria_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO categorias (paseo_id, nombre, icono, color)
+                    VALUES (?, ?, ?, ?)
+                """, (paseo_id, nombre, icono, color))
+                categoria_id = cursor.lastrowid
+                conn.commit()
+            self.cache.invalidar(('paseo', paseo_id))
             return categoria_id
         except sqlite3.IntegrityError:
             return -1
     
+    @reintentar_si_bloqueada
     def eliminar_categoria(self, categoria_id: int) -> bool:
         """Elimina una categoría"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        # Primero quitar la categoría de los gastos
-        cursor.execute("UPDATE gastos SET categoria_id = NULL WHERE categoria_id = ?", (categoria_id,))
-        cursor.execute("DELETE FROM categorias WHERE id = ?", (categoria_id,))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT paseo_id FROM categorias WHERE id = ?", (categoria_id,))
+            row = cursor.fetchone()
+            # Primero quitar la categoría de los gastos
+            cursor.execute("UPDATE gastos SET categoria_id = NULL WHERE categoria_id = ?", (categoria_id,))
+            cursor.execute("DELETE FROM categorias WHERE id = ?", (categoria_id,))
+            conn.commit()
+        if row:
+            self.cache.invalidar(('paseo', row['paseo_id']))
         return True
     
+    @cacheado('usuario', 'usuario_id')
     def get_paseos_usuario(self, usuario_id: int) -> List[Dict]:
         """Obtiene todos los paseos de un usuario"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT DISTINCT p.*, u.nombre as creador_nombre
-            FROM paseos p
-            JOIN paseo_participantes pp ON p.id = pp.paseo_id
-            JOIN usuarios u ON p.created_by = u.id
-            WHERE pp.usuario_id = ?
-            ORDER BY p.created_at DESC
-        """, (usuario_id,))
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT DISTINCT p.*, u.nombre as creador_nombre
+                FROM paseos p
+                JOIN paseo_participantes pp ON p.id = pp.paseo_id
+                JOIN usuarios u ON p.created_by = u.id
+                WHERE pp.usuario_id = ?
+                ORDER BY p.created_at DESC
+            """, (usuario_id,))
+            rows = cursor.fetchall()
         return [dict(row) for row in rows]
     
+    @reintentar_si_bloqueada
     def agregar_participante(self, paseo_id: int, usuario_id: int) -> bool:
         """Agrega un participante a un paseo"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO paseo_participantes (paseo_id, usuario_id)
-                VALUES (?, ?)
-            """, (paseo_id, usuario_id))
-            conn.commit()
-            conn.close()
+            with self.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO paseo_participantes (paseo_id, usuario_id)
+                    VALUES (?, ?)
+                """, (paseo_id, usuario_id))
+                conn.commit()
+            self.cache.invalidar(('paseo', paseo_id), ('usuario', usuario_id))
             return True
         except sqlite3.IntegrityError:
             return False
     
+    @cacheado('paseo')
     def get_participantes_paseo(self, paseo_id: int) -> List[Dict]:
         """Obtiene todos los participantes de un paseo"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT u.id, u.username, u.nombre, u.email
-            FROM usuarios u
-            JOIN paseo_participantes pp ON u.id = pp.usuario_id
-            WHERE pp.paseo_id = ?
-        """, (paseo_id,))
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT u.id, u.username, u.nombre, u.email
+                FROM usuarios u
+                JOIN paseo_participantes pp ON u.id = pp.usuario_id
+                WHERE pp.paseo_id = ?
+            """, (paseo_id,))
+            rows = cursor.fetchall()
         return [dict(row) for row in rows]
     
     # Métodos de gastos
+    @reintentar_si_bloqueada
     def crear_gasto(self, paseo_id: int, usuario_id: int, concepto: str, 
                    valor: float, fecha: datetime, tipo_archivo: str = None, 
                    archivo_path: str = None, transcripcion: str = None,
                    categoria_id: int = None) -> int:
-        """Crea un nuevo gasto"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO gastos (paseo_id, usuario_id, categoria_id, concepto, valor, fecha, 
-                              tipo_archivo, archivo_path, transcripcion)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (paseo_id, usuario_id, categoria_id, concepto, valor, fecha, tipo_archivo, archivo_path, transcripcion))
-        gasto_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        """Crea un nuevo gasto (el valor se guarda en pesos enteros)"""
+        valor = a_pesos(valor)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO gastos (paseo_id, usuario_id, categoria_id, concepto, valor, fecha, 
+                                  tipo_archivo, archivo_path, transcripcion)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (paseo_id, usuario_id, categoria_id, concepto, valor, fecha, tipo_archivo, archivo_path, transcripcion))
+            gasto_id = cursor.lastrowid
+            conn.commit()
+        self.cache.invalidar(('paseo', paseo_id))
+        return gasto_id
+    
+    @reintentar_si_bloqueada
+    def crear_gasto_con_divisiones(self, paseo_id: int, usuario_id: int, concepto: str,
+                                   valor: float, fecha: datetime, divisiones: List[Dict],
+                                   tipo_archivo: str = None, archivo_path: str = None,
+                                   transcripcion: str = None, categoria_id: int = None) -> int:
+        """
+        Crea un gasto con todas sus divisiones en una sola transacción.
+        Cada división solo necesita usuario_id y porcentaje: los montos se calculan en
+        pesos enteros y siempre suman exactamente el valor del gasto.
+        Lanza ValueError si no hay divisiones, si los porcentajes no suman 100 o si algún
+        usuario no existe o se repite: un gasto mal dividido descuadra los saldos del paseo.
+        """
+        if not divisiones:
+            raise ValueError("El gasto debe dividirse entre al menos un participante")
+        usuario_ids = {d['usuario_id'] for d in divisiones}
+        if len(usuario_ids) != len(divisiones):
+            raise ValueError("Un usuario aparece en más de una división")
+        total_porcentajes = sum(d['porcentaje'] for d in divisiones)
+        if abs(total_porcentajes - 100) > TOLERANCIA_PORCENTAJES:
+            raise ValueError("Los porcentajes de las divisiones deben sumar 100")
+        valor = a_pesos(valor)
+        # Se reparte sobre el total real para que los montos sumen el valor aunque haya redondeo
+        montos = repartir_monto(valor, [d['porcentaje'] * 100 / total_porcentajes for d in divisiones])
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            # La verificación va dentro de la transacción de escritura: nadie borra un usuario en medio
+            if not conn.in_transaction:
+                cursor.execute("BEGIN IMMEDIATE")
+            marcadores = ", ".join("?" for _ in usuario_ids)
+            cursor.execute(f"SELECT COUNT(*) FROM usuarios WHERE id IN ({marcadores})", tuple(usuario_ids))
+            if cursor.fetchone()[0] != len(usuario_ids):
+                raise ValueError("Alguna división es de un usuario que no existe")
+            cursor.execute("""
+                INSERT INTO gastos (paseo_id, usuario_id, categoria_id, concepto, valor, fecha, 
+                                  tipo_archivo, archivo_path, transcripcion)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (paseo_id, usuario_id, categoria_id, concepto, valor, fecha, tipo_archivo, archivo_path, transcripcion))
+            gasto_id = cursor.lastrowid
+            cursor.executemany("""
+                INSERT INTO gasto_divisiones (gasto_id, usuario_id, porcentaje, monto)
+                VALUES (?, ?, ?, ?)
+            """, [(gasto_id, d['usuario_id'], d['porcentaje'], monto) for d, monto in zip(divisiones, montos)])
+            # Si algo falla antes de este punto el pool hace rollback: no quedan gastos sin dividir
+            conn.commit()
+        self.cache.invalidar(('paseo', paseo_id))
         return gasto_id
     
+    @cacheado('paseo')
     def get_gastos_paseo(self, paseo_id: int, categoria_id: int = None) -> List[Dict]:
         """Obtiene todos los gastos de un paseo, opcionalmente filtrados por categoría"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            if categoria_id:
+                cursor.execute("""
+                    SELECT g.*, u.nombre as usuario_nombre,
+                           c.nombre as categoria_nombre, c.icono as categoria_icono, c.color as categoria_color
+                    FROM gastos g
+                    JOIN usuarios u ON g.usuario_id = u.id
+                    LEFT JOIN categorias c ON g.categoria_id = c.id
+                    WHERE g.paseo_id = ? AND g.categoria_id = ?
+                    ORDER BY g.fecha DESC
+                """, (paseo_id, categoria_id))
+            else:
+                cursor.execute("""
+                    SELECT g.*, u.nombre as usuario_nombre,
+                           c.nombre as categoria_nombre, c.icono as categoria_icono, c.color as categoria_color
+                    FROM gastos g
+                    JOIN usuarios u ON g.usuario_id = u.id
+                    LEFT JOIN categorias c ON g.categoria_id = c.id
+                    WHERE g.paseo_id = ?
+                    ORDER BY g.fecha DESC
+                """, (paseo_id,))
+            
+            rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+    
+    @cacheado('paseo')
+    def get_gastos_paseo_pagina(self, paseo_id: int, limite: int = 20, cursor: Tuple = None,
+                                categoria_id: int = None, usuario_id: int = None,
+                                fecha_desde: datetime = None, fecha_hasta: datetime = None
+                                ) -> Tuple[List[Dict], Optional[Tuple]]:
+        """
+        Obtiene una página de gastos de un paseo, del más reciente al más antiguo.
+        Paginación por keyset: `cursor` es el (fecha, id) del último gasto de la página
+        anterior, así cada página cuesta lo mismo sin importar cuántos gastos haya antes.
+        fecha_desde es inclusiva y fecha_hasta exclusiva.
+        Retorna: (gastos, cursor de la página siguiente o None si no hay más)
+        """
+        condiciones = ["g.paseo_id = ?"]
+        params = [paseo_id]
         
         if categoria_id:
-            cursor.execute("""
-                SELECT g.*, u.nombre as usuario_nombre,
-                       c.nombre as categoria_nombre, c.icono as categoria_icono, c.color as categoria_color
-                FROM gastos g
-                JOIN usuarios u ON g.usuario_id = u.id
-                LEFT JOIN categorias c ON g.categoria_id = c.id
-                WHERE g.paseo_id = ? AND g.categoria_id = ?
-                ORDER BY g.fecha DESC
-            """, (paseo_id, categoria_id))
-        else:
-            cursor.execute("""
+            condiciones.append("g.categoria_id = ?")
+            params.append(categoria_id)
+        if usuario_id:
+            condiciones.append("g.usuario_id = ?")
+            params.append(usuario_id)
+        if fecha_desde is not None:
+            condiciones.append("g.fecha >= ?")
+            params.append(fecha_desde)
+        if fecha_hasta is not None:
+            condiciones.append("g.fecha < ?")
+            params.append(fecha_hasta)
+        if cursor is not None:
+            condiciones.append("(g.fecha, g.id) < (?, ?)")
+            params.extend(cursor)
+        
+        # Se pide un gasto de más para saber si existe una página siguiente
+        params.append(limite + 1)
+        with self.connection() as conn:
+            cur = conn.cursor()
+            cur.execute(f"""
                 SELECT g.*, u.nombre as usuario_nombre,
                        c.nombre as categoria_nombre, c.icono as categoria_icono, c.color as categoria_color
                 FROM gastos g
                 JOIN usuarios u ON g.usuario_id = u.id
                 LEFT JOIN categorias c ON g.categoria_id = c.id
-                WHERE g.paseo_id = ?
-                ORDER BY g.fecha DESC
-            """, (paseo_id,))
+                WHERE {' AND '.join(condiciones)}
+                ORDER BY g.fecha DESC, g.id DESC
+                LIMIT ?
+            """, params)
+            rows = cur.fetchall()
         
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        gastos = [dict(row) for row in rows[:limite]]
+        siguiente = (gastos[-1]['fecha'], gastos[-1]['id']) if len(rows) > limite else None
+        return gastos, siguiente
     
+    @cacheado('paseo')
     def get_gastos_por_categoria(self, paseo_id: int) -> List[Dict]:
         """Obtiene el resumen de gastos agrupados por categoría"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT c.id, c.nombre, c.icono, c.color,
-                   COUNT(g.id) as cantidad_gastos,
-                   COALESCE(SUM(g.valor), 0) as total
-            FROM categorias c
-            LEFT JOIN gastos g ON c.id = g.categoria_id
-            WHERE c.paseo_id = ?
-            GROUP BY c.id, c.nombre, c.icono, c.color
-            ORDER BY total DESC
-        """, (paseo_id,))
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT c.id, c.nombre, c.icono, c.color,
+                       COUNT(g.id) as cantidad_gastos,
+                       COALESCE(SUM(g.valor), 0) as total
+                FROM categorias c
+                LEFT JOIN gastos g ON c.id = g.categoria_id
+                WHERE c.paseo_id = ?
+                GROUP BY c.id, c.nombre, c.icono, c.color
+                ORDER BY total DESC
+            """, (paseo_id,))
+            rows = cursor.fetchall()
         return [dict(row) for row in rows]
     
+    @reintentar_si_bloqueada
     def actualizar_gasto(self, gasto_id: int, concepto: str = None, 
                         valor: float = None, fecha: datetime = None) -> bool:
         """Actualiza un gasto y recalcula las divisiones si cambia el valor"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
         updates = []
         params = []
         
@@ -362,6 +1088,7 @@ class Database:
             updates.append("concepto = ?")
             params.append(concepto)
         if valor is not None:
+            valor = a_pesos(valor)
             updates.append("valor = ?")
             params.append(valor)
         if fecha is not None:
@@ -369,85 +1096,106 @@ class Database:
             params.append(fecha)
         
         if not updates:
-            conn.close()
             return False
         
-        params.append(gasto_id)
-        query = f"UPDATE gastos SET {', '.join(updates)} WHERE id = ?"
-        cursor.execute(query, params)
-        
-        # Si cambió el valor, recalcular los montos de las divisiones
-        if valor is not None:
-            cursor.execute("""
-                UPDATE gasto_divisiones 
-                SET monto = ? * (porcentaje / 100.0)
-                WHERE gasto_id = ?
-            """, (valor, gasto_id))
-        
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            paseo_id = self._paseo_de_gasto(cursor, gasto_id)
+            params.append(gasto_id)
+            query = f"UPDATE gastos SET {', '.join(updates)} WHERE id = ?"
+            cursor.execute(query, params)
+            
+            # Si cambió el valor, repartirlo de nuevo entre las divisiones
+            if valor is not None:
+                cursor.execute("""
+                    SELECT id, porcentaje FROM gasto_divisiones
+                    WHERE gasto_id = ? ORDER BY id
+                """, (gasto_id,))
+                divisiones = cursor.fetchall()
+                montos = repartir_monto(valor, [d['porcentaje'] for d in divisiones])
+                cursor.executemany("""
+                    UPDATE gasto_divisiones SET monto = ? WHERE id = ?
+                """, [(monto, d['id']) for d, monto in zip(divisiones, montos)])
+            
+            conn.commit()
+        self.cache.invalidar(('paseo', paseo_id))
         return True
     
+    @reintentar_si_bloqueada
     def eliminar_gasto(self, gasto_id: int) -> bool:
         """Elimina un gasto y sus divisiones"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM gasto_divisiones WHERE gasto_id = ?", (gasto_id,))
-        cursor.execute("DELETE FROM gastos WHERE id = ?", (gasto_id,))
-        conn.commit()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            paseo_id = self._paseo_de_gasto(cursor, gasto_id)
+            cursor.execute("DELETE FROM gasto_divisiones WHERE gasto_id = ?", (gasto_id,))
+            cursor.execute("DELETE FROM gastos WHERE id = ?", (gasto_id,))
+            conn.commit()
+        self.cache.invalidar(('paseo', paseo_id))
         return True
     
     # Métodos de división de gastos
+    @reintentar_si_bloqueada
     def crear_division_gasto(self, gasto_id: int, divisiones: List[Dict]) -> bool:
-        """Crea las divisiones de un gasto"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        # Eliminar divisiones existentes
-        cursor.execute("DELETE FROM gasto_divisiones WHERE gasto_id = ?", (gasto_id,))
-        # Crear nuevas divisiones
-        for division in divisiones:
-            cursor.execute("""
+        """Crea las divisiones de un gasto (usuario_id y porcentaje; los montos se reparten del valor)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT paseo_id, valor FROM gastos WHERE id = ?", (gasto_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return False
+            montos = repartir_monto(row['valor'], [d['porcentaje'] for d in divisiones])
+            # Eliminar divisiones existentes
+            cursor.execute("DELETE FROM gasto_divisiones WHERE gasto_id = ?", (gasto_id,))
+            # Crear nuevas divisiones
+            cursor.executemany("""
                 INSERT INTO gasto_divisiones (gasto_id, usuario_id, porcentaje, monto)
                 VALUES (?, ?, ?, ?)
-            """, (gasto_id, division['usuario_id'], division['porcentaje'], division['monto']))
-        conn.commit()
-        conn.close()
+            """, [(gasto_id, d['usuario_id'], d['porcentaje'], monto) for d, monto in zip(divisiones, montos)])
+            conn.commit()
+        self.cache.invalidar(('paseo', row['paseo_id']))
         return True
     
     def get_divisiones_gasto(self, gasto_id: int) -> List[Dict]:
         """Obtiene las divisiones de un gasto"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT gd.*, u.nombre as usuario_nombre
-            FROM gasto_divisiones gd
-            JOIN usuarios u ON gd.usuario_id = u.id
-            WHERE gd.gasto_id = ?
-        """, (gasto_id,))
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT gd.*, u.nombre as usuario_nombre
+                FROM gasto_divisiones gd
+                JOIN usuarios u ON gd.usuario_id = u.id
+                WHERE gd.gasto_id = ?
+            """, (gasto_id,))
+            rows = cursor.fetchall()
         return [dict(row) for row in rows]
     
-    def calcular_deudas_paseo(self, paseo_id: int) -> List[Dict]:
-        """Calcula las deudas entre usuarios en un paseo (con neteo de deudas cruzadas)"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Obtener todos los gastos y sus divisiones
-        cursor.execute("""
-            SELECT g.id as gasto_id, g.usuario_id as pagador_id, u1.nombre as pagador_nombre,
-                   gd.usuario_id as deudor_id, u2.nombre as deudor_nombre,
-                   gd.monto, g.concepto
-            FROM gastos g
-            JOIN usuarios u1 ON g.usuario_id = u1.id
-            JOIN gasto_divisiones gd ON g.id = gd.gasto_id
-            JOIN usuarios u2 ON gd.usuario_id = u2.id
-            WHERE g.paseo_id = ? AND g.usuario_id != gd.usuario_id
-        """, (paseo_id,))
+    @cacheado('paseo')
+    def calcular_deudas_paseo(self, paseo_id: int, modo: str = MODO_PARES) -> List[Dict]:
+        """
+        Calcula las deudas entre usuarios en un paseo.
+        modo=MODO_PARES: deudas entre cada pagador y deudor, con neteo de deudas cruzadas.
+        modo=MODO_SIMPLIFICADO: mínimo de transferencias a partir del balance neto de cada uno.
+        """
+        if modo == MODO_SIMPLIFICADO:
+            return self.calcular_transferencias_paseo(paseo_id)
+        if modo != MODO_PARES:
+            raise ValueError(f"Modo de cálculo de deudas desconocido: {modo}")
         
-        rows = cursor.fetchall()
-        conn.close()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            
+            # Obtener todos los gastos y sus divisiones
+            cursor.execute("""
+                SELECT g.id as gasto_id, g.usuario_id as pagador_id, u1.nombre as pagador_nombre,
+                       gd.usuario_id as deudor_id, u2.nombre as deudor_nombre,
+                       gd.monto, g.concepto
+                FROM gastos g
+                JOIN usuarios u1 ON g.usuario_id = u1.id
+                JOIN gasto_divisiones gd ON g.id = gd.gasto_id
+                JOIN usuarios u2 ON gd.usuario_id = u2.id
+                WHERE g.paseo_id = ? AND g.usuario_id != gd.usuario_id
+            """, (paseo_id,))
+            
+            rows = cursor.fetchall()
         
         # Agrupar deudas brutas (antes de netear)
         deudas_brutas = {}
@@ -500,7 +1248,7 @@ class Database:
             # Calcular deuda neta
             neto = deuda_a_b - deuda_b_a
             
-            if abs(neto) > 0.01:  # Solo si hay deuda significativa
+            if neto != 0:
                 if neto > 0:
                     # deudor le debe a pagador
                     deudas_netas[(pagador_id, deudor_id)] = {
@@ -524,33 +1272,353 @@ class Database:
         
         return list(deudas_netas.values())
     
-    def get_resumen_usuario_paseo(self, usuario_id: int, paseo_id: int) -> Dict:
-        """Obtiene el resumen de gastos de un usuario en un paseo"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    @cacheado('paseo')
+    def calcular_transferencias_paseo(self, paseo_id: int) -> List[Dict]:
+        """Calcula el mínimo de transferencias que salda un paseo, con el mismo formato de calcular_deudas_paseo"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT s.usuario_id, u.nombre, s.total_pagado - s.total_debe as balance
+                FROM saldos s
+                JOIN usuarios u ON s.usuario_id = u.id
+                WHERE s.paseo_id = ?
+            """, (paseo_id,))
+            rows = cursor.fetchall()
         
-        # Gastos pagados por el usuario
-        cursor.execute("""
-            SELECT COALESCE(SUM(valor), 0) as total_pagado
-            FROM gastos
-            WHERE paseo_id = ? AND usuario_id = ?
-        """, (paseo_id, usuario_id))
-        total_pagado = cursor.fetchone()['total_pagado']
+            balances = {row['usuario_id']: row['balance'] for row in rows}
+            if sum(balances.values()) != 0:
+                # Hay gastos sin dividir (o divididos a medias): lo que nadie debe no se
+                # liquida, así que los balances se arman solo con los montos divididos
+                cursor.execute("""
+                    SELECT usuario_id, SUM(balance) as balance
+                    FROM (
+                        SELECT g.usuario_id, gd.monto as balance
+                        FROM gastos g
+                        JOIN gasto_divisiones gd ON gd.gasto_id = g.id
+                        WHERE g.paseo_id = ?
+                        UNION ALL
+                        SELECT gd.usuario_id, -gd.monto as balance
+                        FROM gastos g
+                        JOIN gasto_divisiones gd ON gd.gasto_id = g.id
+                        WHERE g.paseo_id = ?
+                    )
+                    GROUP BY usuario_id
+                """, (paseo_id, paseo_id))
+                balances = {row['usuario_id']: row['balance'] for row in cursor.fetchall()}
         
-        # Gastos que debe el usuario
-        cursor.execute("""
-            SELECT COALESCE(SUM(gd.monto), 0) as total_debe
-            FROM gasto_divisiones gd
-            JOIN gastos g ON gd.gasto_id = g.id
-            WHERE g.paseo_id = ? AND gd.usuario_id = ?
-        """, (paseo_id, usuario_id))
-        total_debe = cursor.fetchone()['total_debe']
+        nombres = {row['usuario_id']: row['nombre'] for row in rows}
         
-        conn.close()
+        return [{
+            'pagador_id': acreedor_id,
+            'pagador_nombre': nombres[acreedor_id],
+            'deudor_id': deudor_id,
+            'deudor_nombre': nombres[deudor_id],
+            'total': monto,
+            'conceptos': []
+        } for deudor_id, acreedor_id, monto in simplificar_deudas(balances)]
+    
+    @cacheado('paseo')
+    def get_resumen_usuario_paseo(self, usuario_id: int, paseo_id: int) -> Dict:
+        """Obtiene el resumen de gastos de un usuario en un paseo"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT total_pagado, total_debe FROM saldos
+                WHERE paseo_id = ? AND usuario_id = ?
+            """, (paseo_id, usuario_id))
+            row = cursor.fetchone()
         
+        total_pagado = row['total_pagado'] if row else 0
+        total_debe = row['total_debe'] if row else 0
         return {
             'total_pagado': total_pagado,
             'total_debe': total_debe,
             'balance': total_pagado - total_debe
         }
+    
+    @cacheado('paseo')
+    def get_resumenes_paseo(self, paseo_id: int) -> List[Dict]:
+        """Obtiene pagado, debe y balance de todos los participantes de un paseo en una sola consulta"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT u.id, u.nombre,
+                       COALESCE(s.total_pagado, 0) as total_pagado,
+                       COALESCE(s.total_debe, 0) as total_debe,
+                       COALESCE(s.total_pagado, 0) - COALESCE(s.total_debe, 0) as balance
+                FROM paseo_participantes pp
+                JOIN usuarios u ON pp.usuario_id = u.id
+                LEFT JOIN saldos s ON s.paseo_id = pp.paseo_id AND s.usuario_id = pp.usuario_id
+                WHERE pp.paseo_id = ?
+                ORDER BY pp.id
+            """, (paseo_id,))
+            rows = cursor.fetchall()
+        return [dict(row) for row in rows]
+    
+    # Mantenimiento de saldos
+    def verificar_saldos(self, paseo_id: int = None) -> List[Dict]:
+        """Compara la tabla saldos con los totales calculados desde los gastos y retorna las diferencias"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SQL_SALDOS_CALCULADOS, {'paseo_id': paseo_id})
+            esperados = {(r['paseo_id'], r['usuario_id']): r for r in cursor.fetchall()}
+            cursor.execute("""
+                SELECT * FROM saldos WHERE ? IS NULL OR paseo_id = ?
+            """, (paseo_id, paseo_id))
+            guardados = {(r['paseo_id'], r['usuario_id']): r for r in cursor.fetchall()}
+        
+        diferencias = []
+        for key in sorted(set(esperados) | set(guardados)):
+            esperado = esperados.get(key)
+            guardado = guardados.get(key)
+            esperado_pagado = esperado['total_pagado'] if esperado else 0
+            esperado_debe = esperado['total_debe'] if esperado else 0
+            guardado_pagado = guardado['total_pagado'] if guardado else 0
+            guardado_debe = guardado['total_debe'] if guardado else 0
+            if esperado_pagado != guardado_pagado or esperado_debe != guardado_debe:
+                diferencias.append({
+                    'paseo_id': key[0],
+                    'usuario_id': key[1],
+                    'total_pagado': guardado_pagado,
+                    'total_pagado_esperado': esperado_pagado,
+                    'total_debe': guardado_debe,
+                    'total_debe_esperado': esperado_debe
+                })
+        return diferencias
+    
+    @reintentar_si_bloqueada
+    def reconstruir_saldos(self, paseo_id: int = None) -> int:
+        """Recalcula la tabla saldos desde cero (de un paseo o de todos) y retorna las filas escritas"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM saldos WHERE ? IS NULL OR paseo_id = ?", (paseo_id, paseo_id))
+            cursor.execute(f"INSERT INTO saldos (paseo_id, usuario_id, total_pagado, total_debe) {SQL_SALDOS_CALCULADOS}",
+                           {'paseo_id': paseo_id})
+            filas = cursor.rowcount
+            conn.commit()
+        if paseo_id is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidar(('paseo', paseo_id))
+        return filas
+    
+    # Exportación: filas leídas directamente del cursor, sin cargar el paseo completo en memoria
+    def _iterar_filas(self, sql: str, params: Tuple) -> Iterator[Tuple]:
+        """
+        Recorre el resultado de una consulta fila por fila. Usa una conexión dedicada que
+        queda prestada hasta terminar o cerrar el generador, aunque eso pase en otro hilo.
+        """
+        with self.pool.connection_dedicada() as conn:
+            for row in conn.execute(sql, params):
+                yield tuple(row)
+    
+    def iterar_gastos_exportacion(self, paseo_id: int) -> Iterator[Tuple]:
+        """Gastos del paseo en orden cronológico: (id, fecha, concepto, valor, pagador, tipo)"""
+        return self._iterar_filas("""
+            SELECT g.id, g.fecha, g.concepto, g.valor, u.nombre, COALESCE(g.tipo_archivo, 'Manual')
+            FROM gastos g
+            JOIN usuarios u ON g.usuario_id = u.id
+            WHERE g.paseo_id = ?
+            ORDER BY g.fecha, g.id
+        """, (paseo_id,))
+    
+    def iterar_divisiones_exportacion(self, paseo_id: int) -> Iterator[Tuple]:
+        """Divisiones de los gastos del paseo: (gasto_id, fecha, concepto, pagador, participante, porcentaje, monto)"""
+        return self._iterar_filas("""
+            SELECT g.id, g.fecha, g.concepto, u1.nombre, u2.nombre, gd.porcentaje, gd.monto
+            FROM gastos g
+            JOIN gasto_divisiones gd ON gd.gasto_id = g.id
+            JOIN usuarios u1 ON g.usuario_id = u1.id
+            JOIN usuarios u2 ON gd.usuario_id = u2.id
+            WHERE g.paseo_id = ?
+            ORDER BY g.fecha, g.id, gd.usuario_id
+        """, (paseo_id,))
+    
+    def iterar_deudas_exportacion(self, paseo_id: int) -> Iterator[Tuple]:
+        """
+        Deudas netas entre cada par (las mismas de calcular_deudas_paseo en MODO_PARES):
+        (deudor, acreedor, monto). Se agregan en SQL, sin recorrer las divisiones en Python.
+        """
+        return self._iterar_filas("""
+            WITH brutas AS (
+                SELECT g.usuario_id as acreedor_id, gd.usuario_id as deudor_id, SUM(gd.monto) as total
+                FROM gastos g
+                JOIN gasto_divisiones gd ON gd.gasto_id = g.id
+                WHERE g.paseo_id = ? AND g.usuario_id != gd.usuario_id
+                GROUP BY g.usuario_id, gd.usuario_id
+            )
+            SELECT ud.nombre, ua.nombre, b.total - COALESCE(inv.total, 0) as neto
+            FROM brutas b
+            LEFT JOIN brutas inv ON inv.acreedor_id = b.deudor_id AND inv.deudor_id = b.acreedor_id
+            JOIN usuarios ud ON b.deudor_id = ud.id
+            JOIN usuarios ua ON b.acreedor_id = ua.id
+            WHERE b.total - COALESCE(inv.total, 0) > 0
+            ORDER BY neto DESC, ud.nombre, ua.nombre
+        """, (paseo_id,))
+    
+    # Análisis de IA
+    @cacheado('paseo')
+    def digest_paseo(self, paseo_id: int) -> str:
+        """SHA-256 de los participantes, gastos y divisiones del paseo: cambia con cualquier edición"""
+        consultas = [
+            """SELECT pp.usuario_id, u.nombre FROM paseo_participantes pp
+               JOIN usuarios u ON u.id = pp.usuario_id
+               WHERE pp.paseo_id = ? ORDER BY pp.usuario_id""",
+            """SELECT id, usuario_id, categoria_id, concepto, valor, fecha FROM gastos
+               WHERE paseo_id = ? ORDER BY id""",
+            """SELECT d.gasto_id, d.usuario_id, d.monto FROM gasto_divisiones d
+               JOIN gastos g ON g.id = d.gasto_id
+               WHERE g.paseo_id = ? ORDER BY d.gasto_id, d.usuario_id""",
+        ]
+        h = hashlib.sha256()
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            for i, sql in enumerate(consultas):
+                h.update(f"#{i}\n".encode())
+                for row in cursor.execute(sql, (paseo_id,)):
+                    h.update(json.dumps(tuple(row), ensure_ascii=False, default=str).encode("utf-8"))
+                    h.update(b"\n")
+        return h.hexdigest()
+    
+    def get_analisis(self, paseo_id: int, digest: str, max_edad_segundos: int = None) -> Optional[Dict]:
+        """
+        Obtiene el análisis guardado del paseo si corresponde al digest dado y no es
+        más viejo que max_edad_segundos. Incluye su edad en 'edad_segundos'.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT contenido, created_at,
+                       CAST((julianday('now') - julianday(created_at)) * 86400 AS INTEGER) AS edad_segundos
+                FROM analisis_ia
+                WHERE paseo_id = ? AND digest = ?
+            """, (paseo_id, digest))
+            row = cursor.fetchone()
+        if not row or (max_edad_segundos is not None and row['edad_segundos'] > max_edad_segundos):
+            return None
+        return dict(row)
+    
+    @reintentar_si_bloqueada
+    def guardar_analisis(self, paseo_id: int, digest: str, contenido: str):
+        """Guarda el análisis del paseo reemplazando el anterior"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT OR REPLACE INTO analisis_ia (paseo_id, digest, contenido)
+                VALUES (?, ?, ?)
+            """, (paseo_id, digest, contenido))
+            conn.commit()
+    
+    # Referencias a archivos (ver almacenamiento.py)
+    def contar_referencias_archivo(self, archivo_path: str) -> int:
+        """Cuenta los gastos y trabajos sin guardar que usan un archivo"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT (SELECT COUNT(*) FROM gastos WHERE archivo_path = ?)
+                     + (SELECT COUNT(*) FROM ({SQL_TRABAJOS_CON_ARCHIVO}) WHERE archivo_path = ?)
+            """, (archivo_path, archivo_path))
+            return cursor.fetchone()[0]
+    
+    def get_archivos_referenciados(self) -> Set[str]:
+        """Obtiene todos los archivos que usa algún gasto o trabajo sin guardar"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT archivo_path FROM gastos WHERE archivo_path IS NOT NULL
+                UNION
+                {SQL_TRABAJOS_CON_ARCHIVO}
+            """)
+            return {row[0] for row in cursor.fetchall()}
+    
+    # Métodos de trabajos en segundo plano
+    # No pasan por la cache: los actualizan los hilos de la cola y la app los consulta para ver su estado
+    @reintentar_si_bloqueada
+    def crear_trabajo(self, usuario_id: int, paseo_id: int, tipo: str, archivo_path: str) -> int:
+        """Registra un trabajo pendiente y retorna su id"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO trabajos (usuario_id, paseo_id, tipo, archivo_path)
+                VALUES (?, ?, ?, ?)
+            """, (usuario_id, paseo_id, tipo, archivo_path))
+            trabajo_id = cursor.lastrowid
+            conn.commit()
+        return trabajo_id
+    
+    @reintentar_si_bloqueada
+    def actualizar_trabajo(self, trabajo_id: int, estado: str, resultado: Dict = None, error: str = None,
+                           estado_anterior: str = None) -> bool:
+        """
+        Cambia el estado de un trabajo y guarda su resultado (como JSON) o su error.
+        Con estado_anterior solo se actualiza si el trabajo sigue en ese estado.
+        Retorna si se actualizó.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE trabajos
+                SET estado = ?, resultado = COALESCE(?, resultado), error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND (? IS NULL OR estado = ?)
+            """, (estado, json.dumps(resultado, ensure_ascii=False) if resultado is not None else None,
+                  error, trabajo_id, estado_anterior, estado_anterior))
+            actualizado = cursor.rowcount > 0
+            conn.commit()
+        return actualizado
+    
+    def get_trabajo(self, trabajo_id: int) -> Optional[Dict]:
+        """Obtiene un trabajo con su resultado ya decodificado"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM trabajos WHERE id = ?", (trabajo_id,))
+            row = cursor.fetchone()
+        return self._trabajo_a_dict(row) if row else None
+    
+    def get_trabajos_usuario(self, usuario_id: int, paseo_id: int, estados: List[str]) -> List[Dict]:
+        """Obtiene los trabajos de un usuario en un paseo con alguno de los estados dados (más recientes primero)"""
+        marcadores = ", ".join("?" for _ in estados)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT * FROM trabajos
+                WHERE usuario_id = ? AND paseo_id = ? AND estado IN ({marcadores})
+                ORDER BY id DESC
+            """, (usuario_id, paseo_id, *estados))
+            rows = cursor.fetchall()
+        return [self._trabajo_a_dict(row) for row in rows]
+    
+    def get_trabajos_por_estado(self, estados: List[str]) -> List[Dict]:
+        """Obtiene todos los trabajos con alguno de los estados dados (más antiguos primero)"""
+        marcadores = ", ".join("?" for _ in estados)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM trabajos WHERE estado IN ({marcadores}) ORDER BY id", tuple(estados))
+            rows = cursor.fetchall()
+        return [self._trabajo_a_dict(row) for row in rows]
+    
+    @staticmethod
+    def _trabajo_a_dict(row: sqlite3.Row) -> Dict:
+        trabajo = dict(row)
+        trabajo['resultado'] = json.loads(trabajo['resultado']) if trabajo['resultado'] else None
+        return trabajo
 
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base de datos de Paseos")
+    parser.add_argument("comando", choices=["migrar", "verificar-saldos", "reconstruir-saldos"])
+    parser.add_argument("--db", default="paseos.db", help="Ruta de la base de datos")
+    parser.add_argument("--paseo", type=int, default=None, help="Limitar a un paseo")
+    args = parser.parse_args()
+    
+    # Crear la instancia ya aplica las migraciones pendientes
+    db = Database(args.db)
+    if args.comando == "migrar":
+        print(f"Esquema en versión {db.get_schema_version()}")
+    elif args.comando == "verificar-saldos":
+        diferencias = db.verificar_saldos(args.paseo)
+        for d in diferencias:
+            print(json.dumps(d, ensure_ascii=False))
+        print(f"{len(diferencias)} saldo(s) inconsistente(s)")
+    elif args.comando == "reconstruir-saldos":
+        print(f"{db.reconstruir_saldos(args.paseo)} saldo(s) reconstruido(s)")
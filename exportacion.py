@@ -0,0 +1,195 @@
+"""
+Exportación de los gastos de un paseo a Excel, CSV o Parquet.
+Las filas se leen directamente de los cursores de SQLite y se escriben a medida
+que llegan (openpyxl en modo write-only, csv.writer, grupos de filas de Parquet),
+así exportar un paseo de cien mil gastos usa la misma memoria que uno de diez.
+El archivo generado se guarda en disco bajo el digest del paseo y se reutiliza
+mientras no cambien sus gastos, divisiones o participantes.
+
+Hojas: Gastos, Divisiones, Participantes (pagado, debe y balance), Deudas (netas
+entre cada par) y Liquidación (transferencias mínimas). En CSV y Parquet cada
+hoja es un archivo dentro de un .zip. Parquet requiere pyarrow.
+"""
+import csv
+import importlib.util
+import io
+import os
+import tempfile
+import zipfile
+from itertools import islice
+from typing import BinaryIO, Iterable, Iterator, List, Tuple
+
+from database import Database
+
+# Formatos de exportación
+FORMATO_XLSX = "xlsx"
+FORMATO_CSV = "csv"
+FORMATO_PARQUET = "parquet"
+
+# Formato: (nombre para mostrar, extensión del archivo, tipo MIME)
+FORMATOS = {
+    FORMATO_XLSX: ("Excel", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    FORMATO_CSV: ("CSV (.zip)", "zip", "application/zip"),
+    FORMATO_PARQUET: ("Parquet (.zip)", "zip", "application/zip"),
+}
+
+# Cambiar al modificar las hojas o columnas: invalida los archivos ya generados
+VERSION_EXPORTACION = "1"
+
+DIRECTORIO_EXPORTACIONES = os.getenv("PASEOS_EXPORTACIONES_DIR", "exportaciones")
+
+# Filas por grupo de Parquet (y por lote en memoria al escribirlo)
+FILAS_POR_GRUPO = 10000
+
+# Tipos de columna, para Parquet (Excel y CSV los toman del valor)
+TEXTO = "texto"
+ENTERO = "entero"
+DECIMAL = "decimal"
+
+# Una hoja: (nombre de la hoja, nombre del archivo en el .zip, [(columna, tipo)], filas)
+Hoja = Tuple[str, str, List[Tuple[str, str]], Iterable[Tuple]]
+
+def _hojas(db: Database, paseo_id: int) -> Iterator[Hoja]:
+    """Hojas de la exportación; las de gastos y divisiones se leen de la base mientras se escriben"""
+    yield ("Gastos", "gastos",
+           [("ID", ENTERO), ("Fecha", TEXTO), ("Concepto", TEXTO), ("Valor", ENTERO),
+            ("Pagado por", TEXTO), ("Tipo", TEXTO)],
+           db.iterar_gastos_exportacion(paseo_id))
+    yield ("Divisiones", "divisiones",
+           [("Gasto", ENTERO), ("Fecha", TEXTO), ("Concepto", TEXTO), ("Pagado por", TEXTO),
+            ("Participante", TEXTO), ("Porcentaje", DECIMAL), ("Monto", ENTERO)],
+           db.iterar_divisiones_exportacion(paseo_id))
+    yield ("Participantes", "participantes",
+           [("Nombre", TEXTO), ("Pagó", ENTERO), ("Debe", ENTERO), ("Balance", ENTERO)],
+           ((r['nombre'], r['total_pagado'], r['total_debe'], r['balance'])
+            for r in db.get_resumenes_paseo(paseo_id)))
+    yield ("Deudas", "deudas",
+           [("Deudor", TEXTO), ("Acreedor", TEXTO), ("Monto", ENTERO)],
+           db.iterar_deudas_exportacion(paseo_id))
+    yield ("Liquidación", "liquidacion",
+           [("Paga", TEXTO), ("Recibe", TEXTO), ("Monto", ENTERO)],
+           ((t['deudor_nombre'], t['pagador_nombre'], t['total'])
+            for t in db.calcular_transferencias_paseo(paseo_id)))
+
+def escribir_xlsx(hojas: Iterable[Hoja], destino: BinaryIO):
+    """Escribe un libro de Excel en modo write-only: las filas van a disco a medida que llegan"""
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    libro = Workbook(write_only=True)
+    negrita = Font(bold=True)
+    for nombre, _, columnas, filas in hojas:
+        hoja = libro.create_sheet(nombre)
+        encabezado = []
+        for columna, _ in columnas:
+            celda = WriteOnlyCell(hoja, value=columna)
+            celda.font = negrita
+            encabezado.append(celda)
+        hoja.append(encabezado)
+        for fila in filas:
+            hoja.append(fila)
+    libro.save(destino)
+
+def escribir_csv(hojas: Iterable[Hoja], destino: BinaryIO):
+    """Escribe un .zip con un CSV por hoja (UTF-8 con BOM, para que Excel respete las tildes)"""
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED) as archivo_zip:
+        for _, archivo, columnas, filas in hojas:
+            with io.TextIOWrapper(archivo_zip.open(f"{archivo}.csv", "w"), encoding="utf-8-sig", newline="") as f:
+                escritor = csv.writer(f)
+                escritor.writerow([columna for columna, _ in columnas])
+                escritor.writerows(filas)
+
+def escribir_parquet(hojas: Iterable[Hoja], destino: BinaryIO):
+    """Escribe un .zip con un Parquet por hoja, en grupos de FILAS_POR_GRUPO filas"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("La exportación a Parquet requiere pyarrow (pip install pyarrow)") from e
+
+    tipos = {TEXTO: pa.string(), ENTERO: pa.int64(), DECIMAL: pa.float64()}
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_STORED) as archivo_zip:
+        for _, archivo, columnas, filas in hojas:
+            esquema = pa.schema([(columna, tipos[tipo]) for columna, tipo in columnas])
+            filas = iter(filas)
+            # Parquet ya viene comprimido: se guarda en el .zip sin volver a comprimir
+            with archivo_zip.open(f"{archivo}.parquet", "w") as f:
+                with pq.ParquetWriter(f, esquema, compression="zstd") as escritor:
+                    while True:
+                        lote = list(islice(filas, FILAS_POR_GRUPO))
+                        if not lote:
+                            break
+                        escritor.write_table(pa.Table.from_arrays(
+                            [pa.array(valores, type=tipo) for valores, tipo in zip(zip(*lote), esquema.types)],
+                            schema=esquema
+                        ))
+
+ESCRITORES = {
+    FORMATO_XLSX: escribir_xlsx,
+    FORMATO_CSV: escribir_csv,
+    FORMATO_PARQUET: escribir_parquet,
+}
+
+def formatos_disponibles() -> List[str]:
+    """Formatos que se pueden generar con las librerías instaladas"""
+    disponibles = [FORMATO_XLSX, FORMATO_CSV]
+    if importlib.util.find_spec("pyarrow") is not None:
+        disponibles.append(FORMATO_PARQUET)
+    return disponibles
+
+def nombre_descarga(paseo_id: int, formato: str) -> str:
+    """Nombre de archivo sugerido para descargar la exportación"""
+    extension = FORMATOS[formato][1]
+    sufijo = "" if extension == formato else f"_{formato}"
+    return f"paseo_{paseo_id}_gastos{sufijo}.{extension}"
+
+def exportar_paseo(db: Database, paseo_id: int, formato: str = FORMATO_XLSX, directorio: str = None) -> str:
+    """
+    Genera la exportación de un paseo y retorna la ruta del archivo.
+    Si ya existe una generada con los mismos datos (mismo digest del paseo) se
+    reutiliza; al generar una nueva se borran las anteriores del mismo paseo y formato.
+    """
+    if formato not in ESCRITORES:
+        raise ValueError(f"Formato de exportación desconocido: {formato}")
+    directorio = directorio or DIRECTORIO_EXPORTACIONES
+    extension = FORMATOS[formato][1]
+    prefijo = f"paseo_{paseo_id}_{formato}_v{VERSION_EXPORTACION}_"
+    ruta = os.path.join(directorio, f"{prefijo}{db.digest_paseo(paseo_id)[:32]}.{extension}")
+    if os.path.exists(ruta):
+        return ruta
+
+    os.makedirs(directorio, exist_ok=True)
+    # Escribir aparte y renombrar: una descarga nunca ve un archivo a medio generar
+    fd, tmp = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as destino:
+            ESCRITORES[formato](_hojas(db, paseo_id), destino)
+        os.replace(tmp, ruta)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    for nombre in os.listdir(directorio):
+        anterior = os.path.join(directorio, nombre)
+        if nombre.startswith(f"paseo_{paseo_id}_{formato}_") and anterior != ruta:
+            os.remove(anterior)
+    return ruta
+
+if __name__ == "__main__":
+    import argparse
+    import shutil
+
+    parser = argparse.ArgumentParser(description="Exporta los gastos de un paseo")
+    parser.add_argument("paseo_id", type=int)
+    parser.add_argument("--formato", choices=list(FORMATOS), default=FORMATO_XLSX)
+    parser.add_argument("--db", default="paseos.db", help="Ruta de la base de datos")
+    parser.add_argument("--salida", help="Copiar la exportación a esta ruta")
+    args = parser.parse_args()
+
+    ruta = exportar_paseo(Database(args.db), args.paseo_id, args.formato)
+    if args.salida:
+        shutil.copyfile(ruta, args.salida)
+        ruta = args.salida
+    print(ruta)
@@ -0,0 +1,228 @@
+"""
+Extractor local de gastos dictados en español.
+Resuelve sin llamar a OpenAI los casos comunes como "almuerzo en Crepes cuarenta
+mil", "Uber 25k" o "pagué 50 lucas en el mercado": encuentra el valor (números en
+cifras o en palabras, con "mil", "k", "lucas", "millones" o "palos") y deja el
+resto del texto como concepto. Junto con el resultado retorna una confianza; si
+es baja (varios valores, un valor sospechosamente pequeño o sin concepto) el
+texto se envía al modelo como antes.
+"""
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+# Por debajo de esta confianza se usa el modelo
+UMBRAL_CONFIANZA = float(os.getenv("PASEOS_EXTRACTOR_UMBRAL", "0.8"))
+
+# Un valor menor probablemente se dijo sin "mil" ("almuerzo cuarenta") y es ambiguo
+VALOR_MINIMO_CONFIABLE = 500
+
+UNIDADES = {
+    "cero": 0, "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "once": 11, "doce": 12,
+    "trece": 13, "catorce": 14, "quince": 15, "dieciseis": 16, "diecisiete": 17,
+    "dieciocho": 18, "diecinueve": 19, "veinte": 20, "veintiun": 21, "veintiuno": 21,
+    "veintiuna": 21, "veintidos": 22, "veintitres": 23, "veinticuatro": 24,
+    "veinticinco": 25, "veintiseis": 26, "veintisiete": 27, "veintiocho": 28,
+    "veintinueve": 29, "treinta": 30, "cuarenta": 40, "cincuenta": 50, "sesenta": 60,
+    "setenta": 70, "ochenta": 80, "noventa": 90, "cien": 100, "ciento": 100,
+    "doscientos": 200, "doscientas": 200, "trescientos": 300, "trescientas": 300,
+    "cuatrocientos": 400, "cuatrocientas": 400, "quinientos": 500, "quinientas": 500,
+    "seiscientos": 600, "seiscientas": 600, "setecientos": 700, "setecientas": 700,
+    "ochocientos": 800, "ochocientas": 800, "novecientos": 900, "novecientas": 900,
+}
+
+# "lucas" es como se dice mil pesos en Colombia y "palo" un millón
+MILES = {"mil", "k", "lucas", "luca", "luquitas"}
+MILLONES = {"millon", "millones", "palo", "palos", "melones"}
+MEDIO = {"medio", "media"}
+
+# Palabras que acompañan al valor y no hacen parte del concepto
+RELLENO_ANTES = {"por", "de", "a", "fueron", "fue", "son", "costo", "valio", "vale", "total",
+                 "valor", "pague", "gaste", "me", "en", "como"}
+RELLENO_DESPUES = {"pesos", "peso", "cop", "colombianos", "en", "total"}
+PREFIJOS_CONCEPTO = {"pague", "gaste", "me", "compre", "fueron", "fue", "son", "el", "la", "los", "las", "un", "una",
+                     "por", "de", "en", "y"}
+
+_TOKEN = re.compile(r"\d[\d.,]*|[^\W\d_]+|\S", re.UNICODE)
+
+def _normalizar(palabra: str) -> str:
+    """Minúsculas y sin tildes, para comparar con las tablas"""
+    return "".join(c for c in unicodedata.normalize("NFD", palabra.lower()) if unicodedata.category(c) != "Mn")
+
+def _cifra_a_numero(texto: str, antes_de_multiplicador: bool) -> Optional[float]:
+    """
+    Interpreta una cifra con separadores: "40.000", "40,000" y "2.500.000" son miles;
+    "1.5" o "1,5" antes de "millones"/"mil" es decimal, y en "1.000.000,50" el último
+    separador es el decimal. None si los grupos no se leen como miles ("1.00.000").
+    """
+    texto = texto.strip(".,")
+    separadores = re.findall(r"[.,]", texto)
+    partes = re.split(r"[.,]", texto)
+    if len(set(separadores)) > 1:
+        # Los dos separadores: el último (una sola vez) es el decimal y el otro marca los miles
+        enteros = partes[:-1]
+        if separadores.count(separadores[-1]) > 1 or any(len(p) != 3 for p in enteros[1:]):
+            return None
+        return float(f"{''.join(enteros)}.{partes[-1]}")
+    if len(partes) > 1 and all(len(p) == 3 for p in partes[1:]) and not antes_de_multiplicador:
+        return float("".join(partes))
+    if len(partes) == 2:
+        return float(f"{partes[0]}.{partes[1]}")
+    if len(partes) > 2:
+        return None
+    return float(partes[0])
+
+def _es_numero(palabra: str) -> bool:
+    return palabra in UNIDADES or palabra in MILES or palabra in MILLONES or palabra[0].isdigit()
+
+def _multiplicador(palabra: str) -> int:
+    return 1000 if palabra in MILES else 1_000_000 if palabra in MILLONES else 0
+
+def _lugar(palabra: str) -> int:
+    """Lugar de una palabra numérica dentro de un grupo de tres cifras: 3 centenas, 2 decenas, 1 unidades"""
+    valor = UNIDADES[palabra]
+    if valor >= 100:
+        return 3
+    if valor >= 30 and valor % 10 == 0:
+        return 2
+    return 1
+
+def _valor_de_tramo(palabras: List[str]) -> Optional[int]:
+    """Calcula el valor de una secuencia de palabras numéricas; None si no es un valor válido"""
+    total = 0.0
+    actual = 0.0
+    multiplicador = 1
+    hubo_numero = False
+    for i, palabra in enumerate(palabras):
+        siguiente = palabras[i + 1] if i + 1 < len(palabras) else ""
+        if palabra[0].isdigit():
+            cifra = _cifra_a_numero(palabra, siguiente in MILES or siguiente in MILLONES)
+            if cifra is None:
+                return None
+            actual += cifra
+            hubo_numero = True
+        elif palabra in UNIDADES:
+            actual += UNIDADES[palabra]
+            hubo_numero = True
+        elif palabra in MILES:
+            actual = (actual or 1) * 1000
+            total += actual
+            actual = 0
+            multiplicador = 1000
+        elif palabra in MILLONES:
+            total = (total + (actual or 1)) * 1_000_000
+            actual = 0
+            multiplicador = 1_000_000
+        elif palabra in MEDIO:
+            # "un millón y medio", "dos mil y medio"
+            total += multiplicador / 2
+        elif palabra != "y":
+            return None
+    if not hubo_numero and total == 0:
+        return None
+    return int(round(total + actual))
+
+def _fin_de_tramo(tokens: List[Tuple[str, int, int]], i: int) -> int:
+    """
+    Extiende desde tokens[i] el tramo que se lee como un solo número en español: las
+    palabras van de mayor a menor lugar ("ciento cincuenta", "treinta y cinco"), una
+    cifra solo se une al multiplicador que la sigue ("60 mil") y cada multiplicador es
+    menor que el anterior ("un millón doscientos mil"). Así "para dos ochenta mil" o
+    "para seis 90.000" quedan como dos valores y no se suman.
+    """
+    palabra = tokens[i][0]
+    cifra = palabra[0].isdigit()
+    # Lugar de la última palabra del grupo actual (None al empezar un grupo tras un multiplicador)
+    lugar = None if cifra or _multiplicador(palabra) else _lugar(palabra)
+    ultimo_multiplicador = _multiplicador(palabra) or float("inf")
+    cien = palabra == "cien"
+    j = i + 1
+    while j < len(tokens):
+        palabra = tokens[j][0]
+        siguiente = tokens[j + 1][0] if j + 1 < len(tokens) else ""
+        multiplicador = _multiplicador(palabra)
+        if multiplicador:
+            if not (cifra or lugar) or multiplicador >= ultimo_multiplicador:
+                break
+            ultimo_multiplicador = multiplicador
+            cifra, lugar, cien = False, None, False
+        elif palabra in UNIDADES:
+            # Tras un multiplicador empieza un grupo nuevo; dentro de un grupo solo se baja de lugar
+            if cifra or cien or (lugar is None and ultimo_multiplicador == float("inf")):
+                break
+            if lugar is not None and (lugar != 3 or _lugar(palabra) == 3):
+                break
+            lugar, cien = _lugar(palabra), palabra == "cien"
+        elif palabra == "y" and lugar == 2 and siguiente in UNIDADES and UNIDADES[siguiente] < 10:
+            # "treinta y cinco": se toman la "y" y la unidad
+            lugar = 1
+            j += 1
+        elif palabra == "y" and lugar is None and not cifra and siguiente in MEDIO:
+            # "un millón y medio", "dos mil y medio": nada puede seguir al "medio"
+            return j + 2
+        else:
+            break
+        j += 1
+    return j
+
+def _tramos_numericos(tokens: List[Tuple[str, int, int]]) -> List[Tuple[int, int]]:
+    """Encuentra los tramos [inicio, fin) de tokens que forman un valor"""
+    tramos = []
+    i = 0
+    while i < len(tokens):
+        if not _es_numero(tokens[i][0]):
+            i += 1
+            continue
+        j = _fin_de_tramo(tokens, i)
+        # "un"/"una" sueltos son artículos ("un café"), no valores
+        if not (j == i + 1 and tokens[i][0] in ("un", "una", "uno")):
+            tramos.append((i, j))
+        i = j
+    return tramos
+
+def _limpiar_concepto(texto: str) -> str:
+    """Quita puntuación y palabras de relleno en los extremos del concepto"""
+    palabras = texto.split()
+    while palabras and _normalizar(palabras[0].strip(",.:;-$")) in PREFIJOS_CONCEPTO | {""}:
+        palabras.pop(0)
+    while palabras and _normalizar(palabras[-1].strip(",.:;-$")) in RELLENO_ANTES | RELLENO_DESPUES | {""}:
+        palabras.pop()
+    concepto = " ".join(palabras).strip(" ,.:;-$")
+    return concepto[:1].upper() + concepto[1:]
+
+def extraer_local(texto: str) -> Tuple[Dict, float]:
+    """
+    Extrae concepto y valor de un texto sin usar el modelo.
+    Retorna ({concepto, valor, categoria}, confianza entre 0 y 1).
+    """
+    vacio = {"concepto": texto.strip(), "valor": 0, "categoria": None}
+    tokens = [(_normalizar(m.group()), m.start(), m.end()) for m in _TOKEN.finditer(texto)]
+    tramos = []
+    for inicio, fin in _tramos_numericos(tokens):
+        valor = _valor_de_tramo([t[0] for t in tokens[inicio:fin]])
+        if valor is not None:
+            tramos.append((inicio, fin, valor))
+
+    if not tramos:
+        return vacio, 0.0
+    if len({valor for _, _, valor in tramos}) > 1:
+        # Varios valores ("dos cervezas de diez mil"): mejor que decida el modelo
+        return vacio, 0.3
+
+    inicio, fin, valor = tramos[-1]
+    # Incluir "$" y "pesos" en el tramo para sacarlos del concepto
+    while fin < len(tokens) and tokens[fin][0] in RELLENO_DESPUES - {"en"}:
+        fin += 1
+    desde, hasta = tokens[inicio][1], tokens[fin - 1][2]
+    if inicio > 0 and tokens[inicio - 1][0] == "$":
+        desde = tokens[inicio - 1][1]
+    concepto = _limpiar_concepto(f"{texto[:desde]} {texto[hasta:]}")
+
+    resultado = {"concepto": concepto, "valor": valor, "categoria": None}
+    if not concepto:
+        return resultado, 0.4
+    if valor < VALOR_MINIMO_CONFIABLE:
+        return resultado, 0.5
+    return resultado, 0.9
@@ -0,0 +1,68 @@
+"""
+Dinero y liquidación de deudas de un paseo.
+Reparte el valor de un gasto entre participantes y calcula, a partir del balance
+neto de cada persona, un conjunto mínimo de transferencias que deja a todos en
+cero. Los montos se manejan siempre en pesos enteros.
+"""
+import heapq
+import math
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Tuple
+
+# Modos de cálculo de deudas
+MODO_PARES = "pares"                # Deudas entre cada par pagador/deudor, neteando las cruzadas
+MODO_SIMPLIFICADO = "simplificado"  # Mínimo de transferencias a partir del balance neto
+
+def a_pesos(valor) -> int:
+    """Convierte un valor (float, str o Decimal) a pesos enteros, redondeando la mitad hacia arriba"""
+    return int(Decimal(str(valor)).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+def repartir_monto(valor: int, porcentajes: List[float]) -> List[int]:
+    """
+    Reparte un valor en pesos enteros según porcentajes, sin perder ni crear pesos.
+    Usa el método del mayor residuo: cada parte recibe la porción truncada y los
+    pesos que sobran van a las partes con mayor residuo (empates por orden).
+    Si los porcentajes suman 100, las partes suman exactamente el valor.
+    """
+    exactos = [valor * porcentaje / 100 for porcentaje in porcentajes]
+    montos = [math.floor(x) for x in exactos]
+    faltante = round(sum(exactos)) - sum(montos)
+    orden = sorted(range(len(montos)), key=lambda i: (-(exactos[i] - montos[i]), i))
+    for i in orden[:max(faltante, 0)]:
+        montos[i] += 1
+    return montos
+
+def simplificar_deudas(balances: Dict[int, int]) -> List[Tuple[int, int, int]]:
+    """
+    Calcula las transferencias para saldar un paseo.
+    balances: {usuario_id: balance en pesos} (positivo = le deben, negativo = debe).
+    Retorna: [(deudor_id, acreedor_id, monto)], con a lo sumo N-1 transferencias.
+
+    En cada paso el mayor deudor le paga al mayor acreedor lo que alcance; así al
+    menos uno de los dos queda en cero. Los empates se resuelven por id para que el
+    resultado sea siempre el mismo.
+    """
+    if sum(balances.values()) != 0:
+        raise ValueError("Los balances deben sumar cero")
+
+    # heapq es un min-heap: se guardan los montos en negativo para sacar primero el mayor
+    acreedores = [(-balance, uid) for uid, balance in balances.items() if balance > 0]
+    deudores = [(balance, uid) for uid, balance in balances.items() if balance < 0]
+    heapq.heapify(acreedores)
+    heapq.heapify(deudores)
+
+    transferencias = []
+    while acreedores and deudores:
+        credito, acreedor_id = heapq.heappop(acreedores)
+        deuda, deudor_id = heapq.heappop(deudores)
+        credito, deuda = -credito, -deuda
+
+        monto = min(credito, deuda)
+        transferencias.append((deudor_id, acreedor_id, monto))
+
+        if credito > monto:
+            heapq.heappush(acreedores, (-(credito - monto), acreedor_id))
+        if deuda > monto:
+            heapq.heappush(deudores, (-(deuda - monto), deudor_id))
+
+    return transferencias
@@ -1,12 +1,62 @@
+import importlib
 import openai
 import os
 import streamlit as st
-from typing import Optional, Dict
+from typing import Iterator, Optional, Dict
 import json
 import re
+import threading
+from cache_respuestas import CacheRespuestas, clave_cache, hash_archivo
+from extractor_local import UMBRAL_CONFIANZA, extraer_local
+from prompt_analisis import construir_prompt_analisis
+
+# Versiones de los prompts: cambiarlas al editar un prompt invalida sus respuestas cacheadas
+VERSION_PROMPT_TRANSCRIPCION = "1"
+VERSION_PROMPT_EXTRACCION = "1"
+VERSION_PROMPT_FACTURA = "1"
+VERSION_PROMPT_ANALISIS = "2"
+
+# Cliente HTTP de OpenAI (ajustable por variables de entorno)
+OPENAI_TIMEOUT = float(os.getenv("PASEOS_OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("PASEOS_OPENAI_CONNECT_TIMEOUT", "10"))
+OPENAI_MAX_RETRIES = int(os.getenv("PASEOS_OPENAI_MAX_RETRIES", "3"))
+OPENAI_MAX_CONEXIONES = int(os.getenv("PASEOS_OPENAI_MAX_CONEXIONES", "20"))
+OPENAI_MAX_CONEXIONES_LIBRES = int(os.getenv("PASEOS_OPENAI_MAX_CONEXIONES_LIBRES", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("PASEOS_OPENAI_KEEPALIVE_EXPIRY", "60"))
+
+# Nivel de detalle con que gpt-4o mira las facturas ("low", "high" o "auto")
+IMAGEN_DETALLE = os.getenv("PASEOS_IMAGEN_DETALLE", "high")
+
+_openai_client = None
+_openai_client_key = None
+_client_lock = threading.Lock()
+
+_cache_respuestas = None
+_cache_lock = threading.Lock()
+
+def get_cache_respuestas() -> CacheRespuestas:
+    """Obtiene la cache de respuestas compartida por todo el proceso"""
+    global _cache_respuestas
+    with _cache_lock:
+        if _cache_respuestas is None:
+            _cache_respuestas = CacheRespuestas(os.getenv("PASEOS_CACHE_IA", "cache_ia.db"))
+        return _cache_respuestas
+
+def _libreria_http():
+    """
+    Librería HTTP sobre la que corre el SDK instalado (httpx en openai 1.x, httpx2 en
+    versiones recientes): sus Limits son los únicos que acepta DefaultHttpxClient.
+    """
+    base = next(c for c in openai.DefaultHttpxClient.__mro__[1:] if c.__name__ == "Client")
+    return importlib.import_module(base.__module__.split(".")[0])
 
 def get_openai_client():
-    """Obtiene el cliente de OpenAI con la API key"""
+    """
+    Obtiene el cliente de OpenAI compartido por todo el proceso.
+    Se crea una sola vez (y de nuevo solo si cambia la API key), así las llamadas
+    reutilizan las conexiones HTTP abiertas en vez de repetir el handshake TLS.
+    """
+    global _openai_client, _openai_client_key
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         try:
@@ -17,11 +67,38 @@ def get_openai_client():
     if not api_key:
         return None
     
-    return openai.OpenAI(api_key=api_key)
+    with _client_lock:
+        if _openai_client is None or _openai_client_key != api_key:
+            # Cerrar el cliente de la key anterior para no dejar abierto su pool de conexiones
+            if _openai_client is not None:
+                _openai_client.close()
+            # DefaultHttpxClient conserva los ajustes del SDK (redirecciones, etc.) con nuestros límites
+            http_client = openai.DefaultHttpxClient(
+                limits=_libreria_http().Limits(
+                    max_connections=OPENAI_MAX_CONEXIONES,
+                    max_keepalive_connections=OPENAI_MAX_CONEXIONES_LIBRES,
+                    keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY
+                )
+            )
+            # El SDK reintenta errores de red, 429 y 5xx con backoff exponencial
+            _openai_client = openai.OpenAI(
+                api_key=api_key,
+                timeout=openai.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                http_client=http_client,
+                max_retries=OPENAI_MAX_RETRIES
+            )
+            _openai_client_key = api_key
+        return _openai_client
 
 def transcribir_audio(audio_file_path: str) -> Optional[str]:
     """Transcribe un archivo de audio usando OpenAI Whisper"""
     try:
+        cache = get_cache_respuestas()
+        clave = clave_cache("whisper-1", VERSION_PROMPT_TRANSCRIPCION, "es", hash_archivo(audio_file_path))
+        cacheada = cache.get(clave)
+        if cacheada is not None:
+            return cacheada
+        
         client = get_openai_client()
         if not client:
             return None
@@ -33,6 +110,7 @@ def transcribir_audio(audio_file_path: str) -> Optional[str]:
                 language="es"
             )
         
+        cache.set(clave, transcript.text)
         return transcript.text
     except Exception as e:
         print(f"Error en transcripción: {e}")
@@ -43,11 +121,23 @@ def extraer_info_gasto(texto: str, categorias: list = None) -> Dict:
     Extrae concepto y valor de un texto usando GPT.
     El concepto debe incluir el nombre del lugar si se menciona.
     Ejemplo: "Almuerzo en Crepes cuarenta mil" -> {concepto: "Almuerzo en Crepes", valor: 40000}
+    Los casos comunes se resuelven localmente (extractor_local) sin llamar al modelo.
     """
+    local, confianza = extraer_local(texto)
+    if confianza >= UMBRAL_CONFIANZA:
+        return local
+    
     try:
+        cache = get_cache_respuestas()
+        clave = clave_cache("gpt-4o-mini", VERSION_PROMPT_EXTRACCION, texto)
+        cacheada = cache.get(clave)
+        if cacheada is not None:
+            return cacheada
+        
         client = get_openai_client()
         if not client:
-            return {"concepto": texto, "valor": 0, "categoria": None}
+            # Sin modelo, lo que haya encontrado el extractor local es mejor que nada
+            return local
         
         prompt = f"""Analiza el siguiente texto que describe un gasto y extrae la información.
 El texto está en español y puede contener números escritos en palabras.
@@ -108,11 +198,12 @@ Si el texto menciona "50k" o "50 lucas", interpreta que son miles de pesos."""
         if isinstance(resultado.get('valor'), str):
             resultado['valor'] = int(re.sub(r'[^\d]', '', resultado['valor']) or 0)
         
+        cache.set(clave, resultado)
         return resultado
         
     except Exception as e:
         print(f"Error extrayendo información: {e}")
-        return {"concepto": texto, "valor": 0, "categoria": None}
+        return local
 
 def transcribir_y_extraer(audio_file_path: str, categorias: list = None) -> Dict:
     """
@@ -133,12 +224,20 @@ def transcribir_y_extraer(audio_file_path: str, categorias: list = None) -> Dict
         "categoria": info.get("categoria")
     }
 
-def analizar_foto_factura(imagen_base64: str) -> Dict:
+def analizar_foto_factura(imagen_base64: str, detalle: str = None) -> Dict:
     """
     Analiza una foto de factura/recibo usando GPT-4 Vision.
     Extrae: concepto (nombre del establecimiento + descripción), valor total
+    La foto debería venir ya reducida con preprocesamiento.preparar_imagen.
     """
+    detalle = detalle or IMAGEN_DETALLE
     try:
+        cache = get_cache_respuestas()
+        clave = clave_cache("gpt-4o", VERSION_PROMPT_FACTURA, detalle, imagen_base64)
+        cacheada = cache.get(clave)
+        if cacheada is not None:
+            return cacheada
+        
         client = get_openai_client()
         if not client:
             return {"concepto": "", "valor": 0}
@@ -174,7 +273,7 @@ Si no puedes identificar el establecimiento, usa "Compra"."""
                             "type": "image_url",
                             "image_url": {
                                 "url": f"data:image/jpeg;base64,{imagen_base64}",
-                                "detail": "high"
+                                "detail": detalle
                             }
                         }
                     ]
@@ -202,16 +301,35 @@ Si no puedes identificar el establecimiento, usa "Compra"."""
         if establecimiento and establecimiento.lower() not in concepto.lower():
             concepto = f"{concepto} en {establecimiento}"
         
-        return {
+        resultado_final = {
             "concepto": concepto,
             "valor": resultado.get("valor", 0)
         }
+        cache.set(clave, resultado_final)
+        return resultado_final
         
     except Exception as e:
         print(f"Error analizando foto: {e}")
         return {"concepto": "", "valor": 0}
 
-def generar_analisis_inteligente(gastos: list, participantes: list, deudas: list) -> str:
+# Modelo y mensaje de sistema del análisis del paseo (compartidos por la versión normal y la de streaming)
+MODELO_ANALISIS = "gpt-4o-mini"
+SISTEMA_ANALISIS = "Eres un asistente financiero experto en dividir gastos de viajes grupales. Respondes en español con formato Markdown limpio."
+
+def _crear_completion_analisis(client, prompt: str, stream: bool = False):
+    return client.chat.completions.create(
+        model=MODELO_ANALISIS,
+        messages=[
+            {"role": "system", "content": SISTEMA_ANALISIS},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,
+        max_tokens=1500,
+        stream=stream
+    )
+
+def generar_analisis_inteligente(gastos: list, participantes: list, deudas: list,
+                                 transferencias: list = None) -> str:
     """
     Genera un análisis inteligente del paseo usando ChatGPT.
     Incluye: resumen, división por concepto, quién debe a quién y recomendaciones.
@@ -221,65 +339,39 @@ def generar_analisis_inteligente(gastos: list, participantes: list, deudas: list
         if not client:
             return None
         
-        # Preparar datos para el análisis
-        gastos_texto = "\n".join([
-            f"- {g.get('concepto', 'Sin concepto')}: ${g.get('valor', 0):,.0f} (pagó: {g.get('pagador_nombre', 'Desconocido')}, fecha: {g.get('fecha', 'N/A')})"
-            for g in gastos
-        ])
-        
-        participantes_texto = ", ".join([p.get('nombre', 'Desconocido') for p in participantes])
-        
-        deudas_texto = "\n".join([
-            f"- {d.get('deudor_nombre', '?')} debe a {d.get('pagador_nombre', '?')}: ${d.get('total', 0):,.0f}"
-            for d in deudas
-        ]) if deudas else "No hay deudas pendientes."
-        
-        total_gastos = sum(g.get('valor', 0) for g in gastos)
-        num_participantes = len(participantes)
-        
-        prompt = f"""Analiza los gastos de este paseo y genera un resumen inteligente en español.
-
-PARTICIPANTES ({num_participantes}): {participantes_texto}
-
-GASTOS TOTALES: ${total_gastos:,.0f} COP
-
-LISTA DE GASTOS:
-{gastos_texto}
-
-DEUDAS ACTUALES:
-{deudas_texto}
-
-Genera un análisis con este formato exacto:
-
-## 📊 Resumen del Paseo
-
-**Total gastado:** ${total_gastos:,.0f} COP
-**Por persona (promedio):** ${total_gastos/num_participantes if num_participantes > 0 else 0:,.0f} COP
-
-## 🏪 Gastos por Concepto/Lugar
-(Agrupa los gastos similares y muestra el total de cada grupo)
-
-## 💰 Lo que debe cada persona
-(Para cada participante, lista cuánto debe en total y a quién, simplificando las deudas)
-
-## 💡 Recomendación de pago
-(Sugiere la forma más simple de saldar las deudas, minimizando transferencias)
-
-Sé conciso, usa emojis y formatea los números con separadores de miles."""
-
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "Eres un asistente financiero experto en dividir gastos de viajes grupales. Respondes en español con formato Markdown limpio."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=1500
-        )
-        
+        prompt = construir_prompt_analisis(gastos, participantes, deudas, transferencias)
+        response = _crear_completion_analisis(client, prompt)
         return response.choices[0].message.content.strip()
         
     except Exception as e:
         print(f"Error generando análisis: {e}")
         return None
 
+def generar_analisis_inteligente_stream(gastos: list, participantes: list, deudas: list,
+                                        transferencias: list = None, estado: Dict = None) -> Iterator[str]:
+    """
+    Igual que generar_analisis_inteligente, pero entrega el texto a medida que el
+    modelo lo genera (para mostrarlo con st.write_stream). Si no hay cliente o la
+    llamada falla, termina sin entregar nada más.
+    En estado['completo'] queda True solo si el modelo terminó la respuesta
+    (finish_reason "stop"): un texto cortado por un error o por max_tokens no se guarda.
+    """
+    if estado is not None:
+        estado['completo'] = False
+    client = get_openai_client()
+    if not client:
+        return
+    
+    prompt = construir_prompt_analisis(gastos, participantes, deudas, transferencias)
+    try:
+        for chunk in _crear_completion_analisis(client, prompt, stream=True):
+            if not chunk.choices:
+                continue
+            if chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.choices[0].finish_reason and estado is not None:
+                estado['completo'] = chunk.choices[0].finish_reason == "stop"
+    except Exception as e:
+        if estado is not None:
+            estado['completo'] = False
+        print(f"Error generando análisis: {e}")
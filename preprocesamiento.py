@@ -0,0 +1,249 @@
+"""
+Preprocesamiento de archivos antes de enviarlos a OpenAI.
+Las fotos de la cámara llegan a resolución completa; reducirlas y recomprimirlas
+en el servidor achica mucho la petición a gpt-4o (y su latencia) sin perder lo
+que se necesita para leer el total de una factura. Los audios se recortan a la
+parte con voz, se pasan a 16 kHz mono (lo que usa Whisper) y se comprimen.
+Ambas funciones aceptan bytes o un archivo abierto (p. ej. el UploadedFile de
+Streamlit), para no tener que copiar la grabación o la foto entera a memoria.
+"""
+import os
+import shutil
+import subprocess
+import wave
+from io import BytesIO
+from typing import BinaryIO, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageFilter, ImageOps
+
+# Parámetros de las fotos de facturas (ajustables por variables de entorno)
+IMAGEN_MAX_LADO = int(os.getenv("PASEOS_IMAGEN_MAX_LADO", "1568"))
+IMAGEN_CALIDAD_JPEG = int(os.getenv("PASEOS_IMAGEN_CALIDAD_JPEG", "80"))
+IMAGEN_ESCALA_GRISES = os.getenv("PASEOS_IMAGEN_ESCALA_GRISES", "0") == "1"
+IMAGEN_RECORTAR = os.getenv("PASEOS_IMAGEN_RECORTAR", "0") == "1"
+
+# Parámetros de los audios (ajustables por variables de entorno)
+AUDIO_FRECUENCIA = 16000  # Whisper remuestrea todo a 16 kHz mono
+AUDIO_UMBRAL_SILENCIO_DB = float(os.getenv("PASEOS_AUDIO_UMBRAL_SILENCIO_DB", "-40"))
+AUDIO_MARGEN_SILENCIO = 0.25  # Segundos que se conservan antes y después de la voz
+AUDIO_OPUS = os.getenv("PASEOS_AUDIO_OPUS", "1") == "1"
+AUDIO_BITRATE_OPUS = os.getenv("PASEOS_AUDIO_BITRATE_OPUS", "24k")
+VENTANA_SILENCIO = 0.02  # Segundos por ventana al medir el volumen
+BLOQUE_LECTURA_WAV = 65536  # Frames que se decodifican a la vez
+
+# Recorte de la factura: el papel es más claro que el fondo
+UMBRAL_PAPEL = 160
+AREA_MINIMA_RECORTE = 0.2   # Menos que esto probablemente no es la factura
+AREA_MAXIMA_RECORTE = 0.95  # Más que esto no hay fondo que quitar
+MARGEN_RECORTE = 0.03
+
+def _abrir(datos: Union[bytes, BinaryIO]) -> BinaryIO:
+    """Un archivo para leer los datos: los bytes se envuelven (sin copiarlos) y los archivos se rebobinan"""
+    if isinstance(datos, (bytes, bytearray, memoryview)):
+        return BytesIO(datos)
+    datos.seek(0)
+    return datos
+
+def _contenido(datos: Union[bytes, BinaryIO]) -> bytes:
+    """Los datos como bytes, para retornarlos sin cambios cuando no se pueden procesar"""
+    if isinstance(datos, (bytes, bytearray, memoryview)):
+        return bytes(datos)
+    datos.seek(0)
+    return datos.read()
+
+def recortar_factura(imagen: Image.Image) -> Image.Image:
+    """
+    Recorta la imagen a la zona clara más grande (el papel de la factura).
+    Si esa zona es muy pequeña o no hay fondo que quitar, retorna la imagen igual.
+    """
+    # La máscara se calcula sobre una miniatura: el recorte no necesita precisión de píxel
+    miniatura = ImageOps.grayscale(imagen)
+    miniatura.thumbnail((256, 256))
+    mascara = miniatura.point(lambda p: 255 if p >= UMBRAL_PAPEL else 0).filter(ImageFilter.MedianFilter(5))
+    caja = mascara.getbbox()
+    if not caja:
+        return imagen
+
+    escala_x = imagen.width / miniatura.width
+    escala_y = imagen.height / miniatura.height
+    izq, arriba, der, abajo = caja
+    area = (der - izq) * (abajo - arriba) / (miniatura.width * miniatura.height)
+    if area < AREA_MINIMA_RECORTE or area > AREA_MAXIMA_RECORTE:
+        return imagen
+
+    margen_x = MARGEN_RECORTE * imagen.width
+    margen_y = MARGEN_RECORTE * imagen.height
+    return imagen.crop((
+        max(0, int(izq * escala_x - margen_x)),
+        max(0, int(arriba * escala_y - margen_y)),
+        min(imagen.width, int(der * escala_x + margen_x)),
+        min(imagen.height, int(abajo * escala_y + margen_y))
+    ))
+
+def preparar_imagen(datos: Union[bytes, BinaryIO], max_lado: int = None, calidad: int = None,
+                    escala_grises: bool = None, recortar: bool = None) -> bytes:
+    """
+    Prepara una foto para el análisis: la endereza según su EXIF, opcionalmente la
+    recorta a la factura y la pasa a escala de grises, la reduce para que su lado
+    mayor no supere max_lado y la recomprime como JPEG.
+    Si los datos no son una imagen válida se retornan sin cambios.
+    """
+    max_lado = max_lado or IMAGEN_MAX_LADO
+    calidad = calidad or IMAGEN_CALIDAD_JPEG
+    escala_grises = IMAGEN_ESCALA_GRISES if escala_grises is None else escala_grises
+    recortar = IMAGEN_RECORTAR if recortar is None else recortar
+
+    try:
+        imagen = Image.open(_abrir(datos))
+        # Decodificar directamente a menor escala cuando el JPEG es mucho más grande (más rápido)
+        imagen.draft("RGB", (max_lado, max_lado))
+        imagen = ImageOps.exif_transpose(imagen)
+    except Exception as e:
+        print(f"Error preparando imagen: {e}")
+        return _contenido(datos)
+
+    if recortar:
+        imagen = recortar_factura(imagen)
+    imagen = imagen.convert("L" if escala_grises else "RGB")
+    imagen.thumbnail((max_lado, max_lado), Image.LANCZOS)
+
+    salida = BytesIO()
+    imagen.save(salida, format="JPEG", quality=calidad, optimize=True)
+    return salida.getvalue()
+
+def _pcm_a_float(crudo: bytes, ancho: int) -> np.ndarray:
+    """Convierte muestras PCM a float32 entre -1 y 1"""
+    if ancho == 1:
+        return (np.frombuffer(crudo, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if ancho == 2:
+        return np.frombuffer(crudo, dtype="<i2").astype(np.float32) / 32768
+    if ancho == 4:
+        return np.frombuffer(crudo, dtype="<i4").astype(np.float32) / 2 ** 31
+    raise ValueError(f"WAV de {ancho * 8} bits no soportado")
+
+def leer_wav_mono(datos: Union[bytes, BinaryIO]) -> Tuple[np.ndarray, int]:
+    """
+    Decodifica un WAV PCM a una señal mono float32 entre -1 y 1 y su frecuencia.
+    Se lee por bloques y cada bloque se pasa a mono antes de seguir: en memoria
+    solo queda la señal final, no los bytes crudos ni todos los canales.
+    """
+    with wave.open(_abrir(datos)) as wav:
+        canales = wav.getnchannels()
+        ancho = wav.getsampwidth()
+        frecuencia = wav.getframerate()
+        senal = np.empty(wav.getnframes(), dtype=np.float32)
+        leidos = 0
+        while leidos < len(senal):
+            crudo = wav.readframes(BLOQUE_LECTURA_WAV)
+            if not crudo:
+                break
+            bloque = _pcm_a_float(crudo, ancho).reshape(-1, canales)
+            bloque = bloque[:, 0] if canales == 1 else bloque.mean(axis=1)
+            senal[leidos:leidos + len(bloque)] = bloque[:len(senal) - leidos]
+            leidos += len(bloque)
+    return senal[:leidos], frecuencia
+
+def escribir_wav(senal: np.ndarray, frecuencia: int) -> bytes:
+    """Codifica una señal mono float32 como WAV PCM de 16 bits"""
+    salida = BytesIO()
+    with wave.open(salida, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(frecuencia)
+        wav.writeframes((np.clip(senal, -1, 1) * 32767).astype("<i2").tobytes())
+    return salida.getvalue()
+
+def recortar_silencio(senal: np.ndarray, frecuencia: int, umbral_db: float = None,
+                      margen: float = AUDIO_MARGEN_SILENCIO) -> np.ndarray:
+    """Quita el silencio al inicio y al final; si todo está bajo el umbral retorna la señal igual"""
+    umbral_db = AUDIO_UMBRAL_SILENCIO_DB if umbral_db is None else umbral_db
+    tamano = max(1, int(frecuencia * VENTANA_SILENCIO))
+    ventanas = len(senal) // tamano
+    if ventanas == 0:
+        return senal
+    por_ventana = senal[:ventanas * tamano].reshape(ventanas, tamano)
+    # einsum suma los cuadrados sin crear una copia elevada al cuadrado de toda la señal
+    rms = np.sqrt(np.einsum("ij,ij->i", por_ventana, por_ventana) / tamano)
+    con_voz = np.flatnonzero(20 * np.log10(rms + 1e-10) > umbral_db)
+    if len(con_voz) == 0:
+        return senal
+    inicio = max(0, con_voz[0] * tamano - int(margen * frecuencia))
+    fin = min(len(senal), (con_voz[-1] + 1) * tamano + int(margen * frecuencia))
+    return senal[inicio:fin]
+
+def remuestrear(senal: np.ndarray, origen: int, destino: int) -> np.ndarray:
+    """
+    Cambia la frecuencia de muestreo por interpolación lineal.
+    Se procesa por bloques de la salida, para no crear arreglos auxiliares
+    (float64 o filtrados) del tamaño de toda la grabación.
+    """
+    if origen == destino:
+        return senal
+    n = int(round(len(senal) * destino / origen))
+    salida = np.empty(n, dtype=np.float32)
+    if len(senal) == 0:
+        return salida
+    # Media móvil como pasa-bajos: evita que las frecuencias altas se plieguen al bajar la frecuencia
+    ventana = int(np.ceil(origen / destino)) if origen > destino else 1
+    filtro = np.ones(ventana, dtype=np.float32) / ventana
+    ultimo = len(senal) - 1
+    for inicio in range(0, n, BLOQUE_LECTURA_WAV):
+        posiciones = np.arange(inicio, min(n, inicio + BLOQUE_LECTURA_WAV)) * (origen / destino)
+        izquierda = np.minimum(posiciones.astype(np.int64), ultimo)
+        derecha = np.minimum(izquierda + 1, ultimo)
+        # El tramo filtrado lleva una ventana de más a cada lado: así coincide con filtrar toda la señal
+        desde = max(0, int(izquierda[0]) - ventana)
+        hasta = min(len(senal), int(derecha[-1]) + ventana + 1)
+        tramo = senal[desde:hasta]
+        if ventana > 1:
+            tramo = np.convolve(tramo, filtro, mode="same")
+        fraccion = (posiciones - izquierda).astype(np.float32)
+        salida[inicio:inicio + len(posiciones)] = (tramo[izquierda - desde] * (1 - fraccion)
+                                                   + tramo[derecha - desde] * fraccion)
+    return salida
+
+def codificar_opus(wav: bytes, bitrate: str = None) -> bytes:
+    """Comprime un WAV a Opus (contenedor ogg) con ffmpeg; retorna None si ffmpeg no está disponible o falla"""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+    try:
+        proceso = subprocess.run(
+            [ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "wav", "-i", "pipe:0",
+             "-c:a", "libopus", "-b:a", bitrate or AUDIO_BITRATE_OPUS, "-application", "voip",
+             "-f", "ogg", "pipe:1"],
+            input=wav, capture_output=True, timeout=30
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"Error codificando audio: {e}")
+        return None
+    if proceso.returncode != 0 or not proceso.stdout:
+        print(f"Error codificando audio: {proceso.stderr.decode(errors='replace')}")
+        return None
+    return proceso.stdout
+
+def preparar_audio(datos: Union[bytes, BinaryIO], opus: bool = None) -> Tuple[bytes, str]:
+    """
+    Prepara una grabación para transcribirla y guardarla: la pasa a mono, le quita
+    el silencio de los extremos, la remuestrea a 16 kHz y la comprime a Opus si
+    ffmpeg está instalado (si no, queda como WAV de 16 bits).
+    Retorna los bytes y su extensión ("ogg" o "wav"). Si los datos no son un WAV
+    PCM válido se retornan sin cambios.
+    """
+    opus = AUDIO_OPUS if opus is None else opus
+    try:
+        senal, frecuencia = leer_wav_mono(datos)
+    except (wave.Error, ValueError, EOFError) as e:
+        print(f"Error preparando audio: {e}")
+        return _contenido(datos), "wav"
+
+    senal = recortar_silencio(senal, frecuencia)
+    senal = remuestrear(senal, frecuencia, AUDIO_FRECUENCIA)
+    wav = escribir_wav(senal, AUDIO_FRECUENCIA)
+
+    if opus:
+        comprimido = codificar_opus(wav)
+        if comprimido:
+            return comprimido, "ogg"
+    return wav, "wav"
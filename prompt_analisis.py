@@ -0,0 +1,161 @@
+"""
+Construcción del prompt del análisis inteligente de un paseo.
+En vez de una línea por gasto, los gastos se agregan localmente (por concepto o
+lugar, por pagador y por día) y el prompt se arma con el mayor nivel de detalle
+que quepa en un presupuesto de tokens. Así el tamaño, el costo y la latencia de
+la llamada quedan acotados sin importar cuántos gastos tenga el paseo.
+"""
+import os
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+# Presupuesto de tokens del prompt (sin contar la respuesta)
+PRESUPUESTO_TOKENS = int(os.getenv("PASEOS_ANALISIS_MAX_TOKENS", "3000"))
+
+# Niveles de detalle de mayor a menor: (incluir la lista de gastos, máximo de filas por sección)
+NIVELES_DETALLE = [(True, None), (False, 40), (False, 20), (False, 10), (False, 5)]
+
+# Codificación de gpt-4o y gpt-4o-mini
+CODIFICACION_TIKTOKEN = "o200k_base"
+
+_codificador = None
+_codificador_cargado = False
+
+def _get_codificador():
+    """Carga tiktoken si está instalado; si no (o no puede bajar la codificación) retorna None"""
+    global _codificador, _codificador_cargado
+    if not _codificador_cargado:
+        _codificador_cargado = True
+        try:
+            import tiktoken
+            _codificador = tiktoken.get_encoding(CODIFICACION_TIKTOKEN)
+        except Exception:
+            _codificador = None
+    return _codificador
+
+def contar_tokens(texto: str) -> int:
+    """Cuenta los tokens de un texto con tiktoken, o los estima (~4 caracteres por token)"""
+    codificador = _get_codificador()
+    if codificador is not None:
+        return len(codificador.encode(texto))
+    return len(texto) // 4 + 1
+
+def _concepto_base(gasto: dict) -> str:
+    """Concepto sin el " - Nombre" que la app agrega al final, para agrupar gastos iguales"""
+    concepto = (gasto.get('concepto') or 'Sin concepto').strip()
+    sufijo = f" - {gasto.get('pagador_nombre', '')}"
+    if gasto.get('pagador_nombre') and concepto.endswith(sufijo):
+        concepto = concepto[:-len(sufijo)]
+    return concepto
+
+def _agrupar(gastos: list, clave) -> List[Tuple[str, int, int]]:
+    """Agrupa gastos por clave: [(nombre, total, cantidad)] de mayor a menor total"""
+    totales = defaultdict(lambda: [None, 0, 0])
+    for g in gastos:
+        nombre = clave(g)
+        grupo = totales[nombre.lower()]
+        grupo[0] = grupo[0] or nombre
+        grupo[1] += g.get('valor', 0)
+        grupo[2] += 1
+    return sorted((tuple(grupo) for grupo in totales.values()), key=lambda x: (-x[1], x[0]))
+
+def _lineas(filas: List[Tuple[str, int, int]], limite: Optional[int], unidad: str = "gasto(s)") -> str:
+    """Una línea por fila hasta el límite; el resto se resume en una línea 'Otros'"""
+    visibles = filas if limite is None else filas[:limite]
+    lineas = [f"- {nombre}: ${total:,.0f} ({cantidad} {unidad})" for nombre, total, cantidad in visibles]
+    resto = filas[len(visibles):]
+    if resto:
+        lineas.append(f"- Otros ({len(resto)} más): ${sum(f[1] for f in resto):,.0f} "
+                      f"({sum(f[2] for f in resto)} {unidad})")
+    return "\n".join(lineas) if lineas else "- (ninguno)"
+
+def _armar_prompt(gastos: list, participantes: list, deudas: list, transferencias: Optional[list],
+                  incluir_gastos: bool, limite: Optional[int]) -> str:
+    participantes_texto = ", ".join([p.get('nombre', 'Desconocido') for p in participantes])
+    total_gastos = sum(g.get('valor', 0) for g in gastos)
+    num_participantes = len(participantes)
+
+    por_concepto = _agrupar(gastos, _concepto_base)
+    por_pagador = _agrupar(gastos, lambda g: g.get('pagador_nombre', 'Desconocido'))
+    # Por día en orden cronológico
+    por_dia = sorted(_agrupar(gastos, lambda g: str(g.get('fecha', 'N/A'))[:10]))
+
+    seccion_gastos = ""
+    if incluir_gastos:
+        gastos_texto = "\n".join([
+            f"- {g.get('concepto', 'Sin concepto')}: ${g.get('valor', 0):,.0f} (pagó: {g.get('pagador_nombre', 'Desconocido')}, fecha: {g.get('fecha', 'N/A')})"
+            for g in gastos
+        ])
+        seccion_gastos = f"\nLISTA DE GASTOS:\n{gastos_texto}\n"
+
+    deudas_ordenadas = sorted(deudas or [], key=lambda d: -d.get('total', 0))
+    deudas_visibles = deudas_ordenadas if limite is None else deudas_ordenadas[:limite]
+    deudas_texto = "\n".join([
+        f"- {d.get('deudor_nombre', '?')} debe a {d.get('pagador_nombre', '?')}: ${d.get('total', 0):,.0f}"
+        for d in deudas_visibles
+    ]) if deudas_visibles else "No hay deudas pendientes."
+    resto_deudas = deudas_ordenadas[len(deudas_visibles):]
+    if resto_deudas:
+        deudas_texto += f"\n- ...y {len(resto_deudas)} deudas más por ${sum(d.get('total', 0) for d in resto_deudas):,.0f}"
+
+    if transferencias is not None:
+        transferencias_texto = "\n".join([
+            f"- {t.get('deudor_nombre', '?')} paga a {t.get('pagador_nombre', '?')}: ${t.get('total', 0):,.0f}"
+            for t in transferencias
+        ]) if transferencias else "No hace falta ninguna transferencia."
+        seccion_transferencias = f"\nTRANSFERENCIAS MÍNIMAS PARA SALDAR:\n{transferencias_texto}\n"
+        recomendacion_pago = "(Presenta exactamente las TRANSFERENCIAS MÍNIMAS de arriba, ya calculadas; no las cambies)"
+    else:
+        seccion_transferencias = ""
+        recomendacion_pago = "(Sugiere la forma más simple de saldar las deudas, minimizando transferencias)"
+
+    return f"""Analiza los gastos de este paseo y genera un resumen inteligente en español.
+
+PARTICIPANTES ({num_participantes}): {participantes_texto}
+
+GASTOS TOTALES: ${total_gastos:,.0f} COP en {len(gastos)} gastos
+
+GASTOS POR CONCEPTO/LUGAR (ya agrupados):
+{_lineas(por_concepto, limite)}
+
+PAGADO POR CADA PERSONA:
+{_lineas(por_pagador, limite)}
+
+GASTOS POR DÍA:
+{_lineas(por_dia, limite)}
+{seccion_gastos}
+DEUDAS ACTUALES:
+{deudas_texto}
+{seccion_transferencias}
+Genera un análisis con este formato exacto:
+
+## 📊 Resumen del Paseo
+
+**Total gastado:** ${total_gastos:,.0f} COP
+**Por persona (promedio):** ${total_gastos/num_participantes if num_participantes > 0 else 0:,.0f} COP
+
+## 🏪 Gastos por Concepto/Lugar
+(Usa los totales ya agrupados de arriba; puedes unir grupos que sean el mismo lugar)
+
+## 💰 Lo que debe cada persona
+(Para cada participante, lista cuánto debe en total y a quién, simplificando las deudas)
+
+## 💡 Recomendación de pago
+{recomendacion_pago}
+
+Sé conciso, usa emojis y formatea los números con separadores de miles."""
+
+def construir_prompt_analisis(gastos: list, participantes: list, deudas: list,
+                              transferencias: list = None, presupuesto: int = None) -> str:
+    """
+    Arma el prompt del análisis del paseo con el mayor detalle que quepa en el presupuesto de tokens.
+    Si se pasan las transferencias ya simplificadas (liquidacion.simplificar_deudas),
+    se le pide al modelo usarlas tal cual en vez de intentar minimizarlas por su cuenta.
+    """
+    presupuesto = presupuesto or PRESUPUESTO_TOKENS
+    for incluir_gastos, limite in NIVELES_DETALLE:
+        prompt = _armar_prompt(gastos, participantes, deudas, transferencias, incluir_gastos, limite)
+        if contar_tokens(prompt) <= presupuesto:
+            return prompt
+    # Ni el nivel más resumido cabe (paseos con muchísimos participantes): se envía igual
+    return prompt
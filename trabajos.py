@@ -0,0 +1,111 @@
+"""
+Cola de trabajos en segundo plano.
+Las transcripciones de audio y los análisis de facturas se registran en la tabla
+trabajos y se procesan en un pool de hilos, así el usuario puede seguir ingresando
+gastos mientras varios audios y fotos se procesan a la vez. Como el estado queda
+en la base de datos, la app solo consulta la tabla para mostrar el avance, y los
+trabajos que quedaron a medias se vuelven a encolar al reiniciar el servidor.
+"""
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+from almacenamiento import Almacenamiento, AlmacenamientoLocal, liberar
+from database import Database
+from openai_helper import transcribir_y_extraer, analizar_foto_factura
+from preprocesamiento import preparar_imagen
+
+# Tipos de trabajo
+TIPO_AUDIO = "audio"
+TIPO_FOTO = "foto"
+
+# Estados de un trabajo
+ESTADO_PENDIENTE = "pendiente"    # Encolado, esperando un hilo libre
+ESTADO_PROCESANDO = "procesando"  # Llamando a OpenAI
+ESTADO_LISTO = "listo"            # Resultado disponible para el borrador del gasto
+ESTADO_ERROR = "error"            # No se pudo extraer información
+ESTADO_USADO = "usado"            # El resultado ya se cargó en un borrador (aún sin guardar)
+ESTADO_GUARDADO = "guardado"      # El gasto del borrador se guardó: su archivo lo retiene el gasto
+ESTADO_DESCARTADO = "descartado"  # El usuario lo quitó de la lista
+
+ESTADOS_ACTIVOS = [ESTADO_PENDIENTE, ESTADO_PROCESANDO]
+ESTADOS_VISIBLES = [ESTADO_PENDIENTE, ESTADO_PROCESANDO, ESTADO_LISTO, ESTADO_ERROR]
+
+EXTENSIONES = {TIPO_AUDIO: "wav", TIPO_FOTO: "jpg"}
+
+def procesar_audio(archivo_path: str) -> Optional[Dict]:
+    """Transcribe un audio y extrae concepto y valor"""
+    return transcribir_y_extraer(archivo_path)
+
+def procesar_foto(archivo_path: str) -> Optional[Dict]:
+    """Analiza la foto de una factura; retorna None si no se pudo extraer nada"""
+    with open(archivo_path, "rb") as f:
+        # Se envía una versión reducida (decodificada desde el archivo, sin leerlo entero);
+        # en el almacenamiento queda la foto original
+        imagen_base64 = base64.b64encode(preparar_imagen(f)).decode('utf-8')
+    resultado = analizar_foto_factura(imagen_base64)
+    if resultado and (resultado['concepto'] or resultado['valor'] > 0):
+        return resultado
+    return None
+
+PROCESADORES = {
+    TIPO_AUDIO: procesar_audio,
+    TIPO_FOTO: procesar_foto,
+}
+
+class ColaTrabajos:
+    def __init__(self, db: Database, almacenamiento: Almacenamiento = None, max_workers: int = 4,
+                 procesadores: Dict[str, Callable[[str], Optional[Dict]]] = None):
+        self.db = db
+        self.almacenamiento = almacenamiento or AlmacenamientoLocal()
+        self.procesadores = procesadores or PROCESADORES
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="trabajo")
+        # Retomar lo que quedó pendiente o a medias si el servidor se reinició
+        for trabajo in db.get_trabajos_por_estado(ESTADOS_ACTIVOS):
+            self.executor.submit(self._ejecutar, trabajo['id'], trabajo['tipo'], trabajo['archivo_path'])
+
+    def encolar(self, usuario_id: int, paseo_id: int, tipo: str, archivo_path: str) -> int:
+        """
+        Registra un trabajo y lo envía al pool; retorna su id sin esperar el resultado.
+        archivo_path es la referencia que retornó almacenamiento.guardar().
+        """
+        if tipo not in self.procesadores:
+            raise ValueError(f"Tipo de trabajo desconocido: {tipo}")
+        trabajo_id = self.db.crear_trabajo(usuario_id, paseo_id, tipo, archivo_path)
+        self.executor.submit(self._ejecutar, trabajo_id, tipo, archivo_path)
+        return trabajo_id
+
+    def descartar(self, trabajo_id: int) -> bool:
+        """Quita de la lista un trabajo que nadie va a usar y borra su archivo si nada más lo usa"""
+        trabajo = self.db.get_trabajo(trabajo_id)
+        if not trabajo or trabajo['estado'] in (ESTADO_USADO, ESTADO_GUARDADO, ESTADO_DESCARTADO):
+            return False
+        if not self.db.actualizar_trabajo(trabajo_id, ESTADO_DESCARTADO, estado_anterior=trabajo['estado']):
+            return False
+        liberar(self.db, self.almacenamiento, trabajo['archivo_path'])
+        return True
+
+    def _ejecutar(self, trabajo_id: int, tipo: str, archivo_path: str):
+        trabajo = self.db.get_trabajo(trabajo_id)
+        if not trabajo or trabajo['estado'] not in ESTADOS_ACTIVOS:
+            return
+        self.db.actualizar_trabajo(trabajo_id, ESTADO_PROCESANDO, estado_anterior=trabajo['estado'])
+        try:
+            with self.almacenamiento.ruta_local(archivo_path) as ruta:
+                resultado = self.procesadores[tipo](ruta)
+        except Exception as e:
+            resultado = None
+            error = str(e)
+        else:
+            error = None if resultado else "No se pudo extraer información"
+        # Si mientras tanto el gasto se guardó a mano (trabajo ya usado) no se pisa ese estado
+        if resultado:
+            self.db.actualizar_trabajo(trabajo_id, ESTADO_LISTO, resultado=resultado,
+                                       estado_anterior=ESTADO_PROCESANDO)
+        else:
+            self.db.actualizar_trabajo(trabajo_id, ESTADO_ERROR, error=error,
+                                       estado_anterior=ESTADO_PROCESANDO)
+
+    def close(self, esperar: bool = True):
+        """Detiene el pool; los trabajos sin terminar se retoman en el próximo arranque"""
+        self.executor.shutdown(wait=esperar, cancel_futures=not esperar)